@@ -19,6 +19,7 @@ import queue
 curDir = os.path.abspath(os.path.dirname(__file__))
 sys.path.insert(0, curDir)
 sys.path.insert(0, os.path.join(curDir, "html"))
+import dnscache
 import events
 import netservice
 import websocket
@@ -27,6 +28,11 @@ import addonHandler, languageHandler
 
 addonHandler.initTranslation()
 
+websocket.setdefaultresolver(dnscache.resolver)
+
+# Events handled per service on each service timer tick
+SERVICE_EVENTS_PER_TICK = 64
+
 class GlobalPlugin(globalPluginHandler.GlobalPlugin):
     scriptCategory = _("Web Services")
     enabled = False
@@ -128,12 +134,22 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
         """Gives the given service the virtual focus"""
         self.unbindCustomizedGestures()
         if service:
+            self.notifyServiceFocus(self._currentService, service)
             self._currentService = service
         if service.isAvailable():
             self.postServiceEvent(service, events.MENU_UPDATE)
         self._serviceIdx = self._services.index(service)
         
 
+    def notifyServiceFocus(self, previous, current):
+        """Tells services that the user moved from previous to current"""
+        if previous is current:
+            return
+        if previous is not None:
+            self.postServiceEvent(previous, events.SERVICE_FOCUS, {"focused": False})
+        if current is not None:
+            self.postServiceEvent(current, events.SERVICE_FOCUS, {"focused": True})
+
     def postServiceEvent(self, service, event, params=None):
         data = {"event": event}
         if params:
@@ -141,25 +157,48 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
         service._inqueue.put(data)
 
     def registerService(self, service):
-        """Registers a service to be used"""
+        """Registers a service to be used.
+
+        Can be called from any thread: the service list is read by scripts,
+        so it is only changed in the main thread."""
+        wx.CallAfter(self._addService, service)
+
+    def unregisterService(self, service):
+        """Unregisters the service. Can be called from any thread."""
+        wx.CallAfter(self._removeService, service)
+
+    def _addService(self, service):
         self._services.append(service)
         logHandler.log.info(f"Registering service {service}")
 
-    def unregisterService(self, service):
-        """Unregisters the service"""
-        for srv in self._services:
-            if srv == service:
-                service.terminate()
-                self._services.remove(service)
-                lohHandler.log.info(f"Unregistericng {service}")
-                return
-        logHandler.log.error(f"Service {service} canot be unregistered")
+    def _removeService(self, service):
+        if service not in self._services:
+            logHandler.log.error(f"Service {service} canot be unregistered")
+            return
+        idx = self._services.index(service)
+        service.terminate()
+        self._services.remove(service)
+        logHandler.log.info(f"Unregistering {service}")
+        # Keep the selection on the same service, or on its neighbour if it is the one removed.
+        if service is self._currentService:
+            self._menuIdx = 0
+            self._itemIdx = 0
+            if self._services:
+                self._serviceIdx = min(idx, len(self._services) - 1)
+                self._currentService = self._services[self._serviceIdx]
+            else:
+                self._serviceIdx = None
+                self._currentService = None
+        elif self._serviceIdx is not None and idx < self._serviceIdx:
+            self._serviceIdx -= 1
 
     def terminateServices(self):
         for service in self._services:
             self.postServiceEvent(service, events.QUIT)
         for service in self._services:
-            service.join()
+            # Services registered over the network have no thread of their own.
+            if service.is_alive():
+                service.join()
     def terminate(self):
         """Called when this plugin is terminated"""
         self.updater.quit = True
@@ -190,13 +229,12 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 
     def onServiceTimer(self):
         wx.CallLater(500, self.onServiceTimer)
-        for service in self._services:
-            evt = None
-            try:
-                evt = service._outqueue.get_nowait()
-            except queue.Empty:
-                pass
-            if evt is not None:
+        for service in list(self._services):
+            for i in range(SERVICE_EVENTS_PER_TICK):
+                try:
+                    evt = service._outqueue.get_nowait()
+                except queue.Empty:
+                    break
                 self.dispatchServiceEvent(service, evt)
     def dispatchServiceEvent(self, service, data):
         code = data["event"]
@@ -217,9 +255,36 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
             items = data["items"].get("items", [])
             if self._itemIdx >= len(items):
                 self._itemIdx = 0
+        elif code == events.MENU_ITEMS_CHANGED:
+            self.applyMenuChanges(service, data)
         else:
             logHandler.log.warning(f"Unhandled event {code}: {service.name}, {data}")
 
+    def applyMenuChanges(self, service, data):
+        """Applies incremental item changes to the menu shown for a service"""
+        menu = self._menuItems.get(service.name, None)
+        if menu is None or menu.get("id", None) != data["id"]:
+            return
+        version = menu.get("version", None)
+        if version is not None and data["version"] <= version:
+            # Already part of the items we have.
+            return
+        if version != data["base"]:
+            # Some changes were missed: ask for the whole menu again.
+            self.postServiceEvent(service, events.MENU_GET_ITEMS, {"id": data["id"]})
+            return
+        items = menu["items"]
+        for change in data["changes"]:
+            if change[0] == "add":
+                items.insert(change[1], change[2])
+            elif change[0] == "del":
+                del items[change[1]]
+            elif change[0] == "update":
+                items[change[1]] = change[2]
+        menu["version"] = data["version"]
+        if self._itemIdx >= len(items):
+            self._itemIdx = 0
+
     def script_toggleInterface(self, gesture):
         self.enabled = not self.enabled
         if self.enabled:
@@ -245,10 +310,12 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
         if len(self._services) == 0:
             ui.message(_("No service registered"))
             return
+        previous = self._currentService
         self._serviceIdx -= 1
         if self._serviceIdx < 0:
             self._serviceIdx = len(self._services) - 1
         self._currentService = self._services[self._serviceIdx]
+        self.notifyServiceFocus(previous, self._currentService)
         ui.message(_(f"Service {self._currentService}"))
     script_previousService.__doc__ = _("Switch to the previous webservice")
 
@@ -256,10 +323,12 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
         if len(self._services) == 0:
             ui.message(_("No service registered"))
             return
+        previous = self._currentService
         self._serviceIdx += 1
         if self._serviceIdx >= len(self._services):
             self._serviceIdx = 0
         self._currentService = self._services[self._serviceIdx]
+        self.notifyServiceFocus(previous, self._currentService)
         ui.message(_(f"Service {self._currentService}"))
     script_previousService.__doc__ = _("Switch to the previous webservice")
 
@@ -0,0 +1,211 @@
+#dnscache.py
+#
+# Host name resolution cache shared by the add-on's network clients: the
+# websocket package (see websocket.setdefaultresolver) and the urllib
+# requests of the GitHub service and the updater (see urlopen). Services
+# which reconnect in a loop, like OBS while OBS Studio is closed, no longer
+# resolve the same name on every attempt.
+#
+# getaddrinfo() does not report record TTLs: answers are kept for a fixed
+# time, and failures for a shorter one so that a name which does not
+# resolve is not looked up on every retry either. An answer used shortly
+# before it expires is resolved again in a background thread while callers
+# keep getting the cached one. Callers drop an entry with invalidate() when
+# none of its addresses could be reached.
+
+import http.client
+import socket
+import threading
+import time
+import urllib.request
+
+# Seconds answers are kept.
+DEFAULT_TTL = 300
+# Seconds resolution failures are kept.
+NEGATIVE_TTL = 10
+# An answer used less than this many seconds before it expires is refreshed
+# in the background.
+REFRESH_AHEAD = 30
+# Entries kept at most.
+MAX_ENTRIES = 256
+
+
+class _Entry:
+    __slots__ = ("result", "error", "expires", "refreshing")
+
+    def __init__(self, result, error, expires):
+        self.result = result
+        self.error = error
+        self.expires = expires
+        self.refreshing = False
+
+
+class Resolver:
+    """Thread-safe cache in front of socket.getaddrinfo().
+
+    Entries are keyed by all the getaddrinfo() arguments. Only name
+    resolution errors (socket.gaierror) are cached."""
+
+    def __init__(self, ttl=DEFAULT_TTL, negativeTtl=NEGATIVE_TTL, refreshAhead=REFRESH_AHEAD,
+                 maxEntries=MAX_ENTRIES, getaddrinfo=socket.getaddrinfo, clock=time.monotonic):
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.refreshAhead = refreshAhead
+        self.maxEntries = maxEntries
+        self._getaddrinfo = getaddrinfo
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negativeHits = 0
+        self.refreshes = 0
+        self.invalidations = 0
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        """Same as socket.getaddrinfo(), from the cache when possible."""
+        key = (host, port, family, type, proto, flags)
+        refresh = False
+        with self._lock:
+            entry = self._entries.get(key)
+            now = self._clock()
+            if entry is not None and now < entry.expires:
+                if entry.error is not None:
+                    self.negativeHits += 1
+                    raise socket.gaierror(*entry.error.args)
+                self.hits += 1
+                if not entry.refreshing and entry.expires - now < self.refreshAhead:
+                    entry.refreshing = refresh = True
+                result = list(entry.result)
+            else:
+                self.misses += 1
+                result = None
+        if refresh:
+            threading.Thread(target=self._refresh, args=(key,), name="DNSRefresh", daemon=True).start()
+        if result is not None:
+            return result
+
+        try:
+            result = self._getaddrinfo(*key)
+        except socket.gaierror as e:
+            self._store(key, None, e, self.negativeTtl)
+            raise
+        self._store(key, result, None, self.ttl)
+        return list(result)
+
+    def invalidate(self, host, port=None):
+        """Drops the entries of host, or of host and port."""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == host and (port is None or key[1] == port)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the counters and the number of entries, as a dict."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "negativeHits": self.negativeHits,
+                    "refreshes": self.refreshes, "invalidations": self.invalidations,
+                    "entries": len(self._entries)}
+
+    def _refresh(self, key):
+        try:
+            result = self._getaddrinfo(*key)
+        except OSError:
+            # Keep the current answer until it expires.
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refreshing = False
+            return
+        with self._lock:
+            self.refreshes += 1
+        self._store(key, result, None, self.ttl)
+
+    def _store(self, key, result, error, ttl):
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._entries) >= self.maxEntries:
+                now = self._clock()
+                expired = [k for k, entry in self._entries.items() if entry.expires <= now]
+                for k in expired:
+                    del self._entries[k]
+                if len(self._entries) >= self.maxEntries:
+                    # Entries are in insertion order: drop the oldest.
+                    del self._entries[next(iter(self._entries))]
+            self._entries[key] = _Entry(result, error, self._clock() + ttl)
+
+
+# Resolver shared by the add-on.
+resolver = Resolver()
+
+
+def createConnection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """socket.create_connection() resolving through the shared resolver.
+
+    The host is invalidated when none of its addresses can be reached,
+    unless they refused the connection."""
+    host, port = address
+    err = None
+    for family, socktype, proto, canonname, sa in resolver.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        sock = None
+        try:
+            sock = socket.socket(family, socktype, proto)
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sa)
+            return sock
+        except OSError as e:
+            err = e
+            if sock is not None:
+                sock.close()
+    if err is None:
+        raise OSError("getaddrinfo returns an empty list")
+    if not isinstance(err, ConnectionRefusedError):
+        resolver.invalidate(host)
+    raise err
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = createConnection
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = createConnection
+
+
+_CONNECTIONS = {
+    http.client.HTTPConnection: _HTTPConnection,
+    http.client.HTTPSConnection: _HTTPSConnection,
+}
+
+
+class _CachingHandler:
+    def do_open(self, http_class, req, **http_conn_args):
+        return super().do_open(_CONNECTIONS.get(http_class, http_class), req, **http_conn_args)
+
+
+class HTTPHandler(_CachingHandler, urllib.request.HTTPHandler):
+    pass
+
+
+class HTTPSHandler(_CachingHandler, urllib.request.HTTPSHandler):
+    pass
+
+
+_opener = urllib.request.build_opener(HTTPHandler, HTTPSHandler)
+
+
+def urlopen(url, data=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+    """urllib.request.urlopen() resolving through the shared resolver."""
+    return _opener.open(url, data, timeout)
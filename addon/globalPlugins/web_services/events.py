@@ -8,6 +8,8 @@ MENU_GET_ITEMS = 6
 SERVICE_NEW = 7
 SERVICE_DEL = 8
 MENU_ACTIVATE = 9
+SERVICE_FOCUS = 10
+MENU_ITEMS_CHANGED = 11
 
 
 EVT_NAMES = {
@@ -20,9 +22,17 @@ EVT_NAMES = {
     MENU_GET_ITEMS: "menu_get_items",
     SERVICE_NEW: "service_new",
     SERVICE_DEL: "service_del",
-    MENU_ACTIVATE: "menu_activate"
+    MENU_ACTIVATE: "menu_activate",
+    SERVICE_FOCUS: "service_focus",
+    MENU_ITEMS_CHANGED: "menu_items_changed",
     }
 
+EVT_CODES = {name: code for code, name in EVT_NAMES.items()}
+
 def toString(code):
     """Returns an event's name based on its code."""
     return EVT_NAMES.get(code, "unknown_event")
+
+def fromString(name):
+    """Returns an event's code based on its name, or None."""
+    return EVT_CODES.get(name, None)
@@ -0,0 +1,247 @@
+#menustore.py
+#
+# Menus of services registered over the network.
+#
+# Items are looked up by their client-supplied id in O(1). Their display
+# order is kept in an ItemList, a list split in blocks of bounded size with a
+# Fenwick tree over the block sizes, so that positional insertion, deletion
+# and lookups run in O(log n) plus the size of a block.
+#
+# A block growing above twice BLOCK_SIZE is split in two halves, and a block
+# becoming empty is removed. Only the items of that block are touched; the
+# following blocks are renumbered and the Fenwick tree is rebuilt over the
+# block sizes, which costs O(n / BLOCK_SIZE) at most once every BLOCK_SIZE
+# insertions or removals.
+
+BLOCK_SIZE = 64
+
+
+class _Fenwick:
+    """Fenwick tree over the sizes of the blocks of an ItemList."""
+
+    def __init__(self, sizes):
+        self._tree = [0] * (len(sizes) + 1)
+        for i, size in enumerate(sizes):
+            self._tree[i + 1] += size
+            parent = i + 1 + ((i + 1) & -(i + 1))
+            if parent <= len(sizes):
+                self._tree[parent] += self._tree[i + 1]
+
+    def add(self, index, delta):
+        index += 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def prefix(self, index):
+        """Sum of the sizes of the blocks before index."""
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def find(self, position):
+        """Returns the block holding position and the offset in that block."""
+        index = 0
+        step = 1
+        while step * 2 < len(self._tree):
+            step *= 2
+        while step:
+            nxt = index + step
+            if nxt < len(self._tree) and self._tree[nxt] <= position:
+                index = nxt
+                position -= self._tree[nxt]
+            step //= 2
+        return index, position
+
+
+class _Block:
+    __slots__ = ("ids", "index")
+
+    def __init__(self, ids, index):
+        self.ids = ids
+        self.index = index
+
+
+class ItemList:
+    """Ordered list of item ids with O(log n) positional operations."""
+
+    def __init__(self, ids=()):
+        self._blockOf = {}
+        self._blocks = []
+        self._build(list(ids))
+
+    def _build(self, ids):
+        """Splits ids in half-full blocks."""
+        self._blocks = [_Block(ids[i:i + BLOCK_SIZE], n)
+                        for n, i in enumerate(range(0, len(ids), BLOCK_SIZE))]
+        if not self._blocks:
+            self._blocks.append(_Block([], 0))
+        self._blockOf = {}
+        for block in self._blocks:
+            for itemId in block.ids:
+                self._blockOf[itemId] = block
+        self._sizes = _Fenwick([len(b.ids) for b in self._blocks])
+        self._count = len(ids)
+
+    def _splitBlock(self, block):
+        """Moves the second half of an overfull block to a new block after it."""
+        half = len(block.ids) // 2
+        newBlock = _Block(block.ids[half:], block.index + 1)
+        del block.ids[half:]
+        for itemId in newBlock.ids:
+            self._blockOf[itemId] = newBlock
+        self._blocks.insert(newBlock.index, newBlock)
+        self._renumber(newBlock.index + 1)
+
+    def _removeBlock(self, block):
+        """Removes an empty block."""
+        del self._blocks[block.index]
+        self._renumber(block.index)
+
+    def _renumber(self, start):
+        """Renumbers the blocks from start on, after one has been inserted or
+        removed, and rebuilds the Fenwick tree over the block sizes."""
+        for index in range(start, len(self._blocks)):
+            self._blocks[index].index = index
+        self._sizes = _Fenwick([len(b.ids) for b in self._blocks])
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, itemId):
+        return itemId in self._blockOf
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block.ids
+
+    def position(self, itemId):
+        """Returns the position of an item."""
+        block = self._blockOf[itemId]
+        return self._sizes.prefix(block.index) + block.ids.index(itemId)
+
+    def idAt(self, position):
+        """Returns the id of the item at position."""
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        index, offset = self._sizes.find(position)
+        return self._blocks[index].ids[offset]
+
+    def insert(self, position, itemId):
+        """Inserts an item at position, clamped to the list bounds. Returns the
+        actual position."""
+        if itemId in self._blockOf:
+            raise ValueError(f"duplicate id {itemId}")
+        position = max(0, min(position, self._count))
+        if position == self._count:
+            block = self._blocks[-1]
+            offset = len(block.ids)
+        else:
+            index, offset = self._sizes.find(position)
+            block = self._blocks[index]
+        block.ids.insert(offset, itemId)
+        self._blockOf[itemId] = block
+        self._sizes.add(block.index, 1)
+        self._count += 1
+        if len(block.ids) > 2 * BLOCK_SIZE:
+            self._splitBlock(block)
+        return position
+
+    def append(self, itemId):
+        return self.insert(self._count, itemId)
+
+    def remove(self, itemId):
+        """Removes an item and returns the position it had."""
+        block = self._blockOf.pop(itemId)
+        offset = block.ids.index(itemId)
+        position = self._sizes.prefix(block.index) + offset
+        del block.ids[offset]
+        self._sizes.add(block.index, -1)
+        self._count -= 1
+        if not block.ids and len(self._blocks) > 1:
+            self._removeBlock(block)
+        return position
+
+
+class Menu:
+    """A menu of a network service, with versioned item changes.
+
+    Every change increments version and is recorded until takeChanges() is
+    called, so that consumers can apply incremental updates."""
+
+    def __init__(self, menuId, name):
+        self.id = menuId
+        self.name = name
+        self.version = 0
+        self._items = {}
+        self._order = ItemList()
+        self._changes = []
+        self._baseVersion = 0
+
+    def __len__(self):
+        return len(self._order)
+
+    def get(self, itemId):
+        return self._items.get(itemId, None)
+
+    def itemAt(self, position):
+        return self._items[self._order.idAt(position)]
+
+    def _changed(self, change):
+        self.version += 1
+        self._changes.append(change)
+
+    def addItem(self, item, position=None):
+        """Adds an item, at the end unless a position is given. Returns its position."""
+        itemId = item["id"]
+        if itemId in self._items:
+            raise ValueError(f"duplicate item id {itemId}")
+        if position is None:
+            position = self._order.append(itemId)
+        else:
+            position = self._order.insert(position, itemId)
+        self._items[itemId] = item
+        self._changed(["add", position, item])
+        return position
+
+    def updateItem(self, itemId, fields):
+        """Updates some fields of an item. Returns its position."""
+        item = self._items[itemId]
+        item.update(fields)
+        position = self._order.position(itemId)
+        self._changed(["update", position, item])
+        return position
+
+    def removeItem(self, itemId):
+        """Removes an item. Returns the position it had."""
+        del self._items[itemId]
+        position = self._order.remove(itemId)
+        self._changed(["del", position])
+        return position
+
+    def items(self):
+        """Items, in display order."""
+        return [self._items[itemId] for itemId in self._order]
+
+    def snapshot(self):
+        """Full content of the menu, as posted to the global plugin."""
+        return {"id": self.id,
+                "name": self.name,
+                "version": self.version,
+                "items": [dict(item) for item in self.items()]}
+
+    def takeChanges(self):
+        """Returns the changes since the last call, or None.
+
+        The result holds the version they apply to and the version they lead to."""
+        if not self._changes:
+            return None
+        delta = {"id": self.id,
+                 "base": self._baseVersion,
+                 "version": self.version,
+                 "changes": [[c[0], c[1]] + [dict(c[2])] if len(c) > 2 else c for c in self._changes]}
+        self._changes = []
+        self._baseVersion = self.version
+        return delta
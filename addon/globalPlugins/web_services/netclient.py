@@ -0,0 +1,667 @@
+#netclient.py
+#
+# Client library for the netservice protocol, usable outside of NVDA.
+#
+# NetClient is blocking and AsyncNetClient uses asyncio. Both keep a local
+# mirror of the menus they publish: setting a menu again only sends what
+# changed, requests are pipelined and matched by req_id, and after a
+# reconnection the whole mirror is published again.
+#
+# Example:
+#   client = NetClient("player", "Music player")
+#   client.connect()
+#   client.setMenu("playlist", "Playlist", [{"id": 1, "name": "First song"}])
+#   client.notify("Ready")
+
+import asyncio
+import bisect
+import contextlib
+import json
+import socket
+import time
+
+import netcodec
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 62100
+# Delay before reconnecting, doubled after each failed attempt up to the max.
+RECONNECT_DELAY = 0.5
+RECONNECT_MAX_DELAY = 10.0
+RECV_SIZE = 65536
+# Ops which change menus: they are replayed by the resync after a reconnection.
+MENU_OPS = ("3", "4", "5", "6", "7", "8")
+ITEM_FIELDS = ("name", "action", "actionData")
+
+
+class NetError(Exception):
+    """A request has been answered with an error."""
+
+    def __init__(self, op, error, reply=None):
+        super().__init__(f"op {op}: {error}")
+        self.op = op
+        self.error = error
+        self.reply = reply
+
+
+class _Menu:
+    """Local copy of a published menu."""
+
+    def __init__(self, name):
+        self.name = name
+        self.order = []
+        self.items = {}
+
+
+def _itemFields(item):
+    return {key: item[key] for key in ITEM_FIELDS if key in item}
+
+
+def _stableIds(ids, oldPos):
+    """Returns the largest set of ids whose old positions are in order.
+
+    These items can stay where they are; the others have to be moved."""
+    tailPos = []
+    tails = []
+    previous = [None] * len(ids)
+    for i, itemId in enumerate(ids):
+        pos = oldPos[itemId]
+        k = bisect.bisect_left(tailPos, pos)
+        if k == len(tailPos):
+            tailPos.append(pos)
+            tails.append(i)
+        else:
+            tailPos[k] = pos
+            tails[k] = i
+        previous[i] = tails[k - 1] if k > 0 else None
+    stable = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        stable.add(ids[i])
+        i = previous[i]
+    return stable
+
+
+class _ClientBase:
+    """Protocol state shared by NetClient and AsyncNetClient, without I/O.
+
+    Requests are queued in an outbox and written together by the transport.
+    Updates of an item still in the outbox are merged, unless the item has
+    been removed or added since."""
+
+    def __init__(self, serviceName, displayName=None, version="", author="",
+                 host=DEFAULT_HOST, port=DEFAULT_PORT, unixPath=None,
+                 compression=True, autoReconnect=True, eventHandler=None):
+        self.serviceName = serviceName
+        self.displayName = displayName or serviceName
+        self.version = version
+        self.author = author
+        self.host = host
+        self.port = port
+        self.unixPath = unixPath
+        self.compression = compression
+        self.autoReconnect = autoReconnect
+        self.eventHandler = eventHandler
+        self.reconnections = 0
+        self._menus = {}
+        self._subscriptions = set()
+        self._nextId = 0
+        self._inFlight = {}
+        self._outbox = []
+        self._pendingUpdates = {}
+        self._codec = netcodec.Codec()
+        self._inBuf = b""
+        self._closed = False
+
+    # Requests
+
+    def _queue(self, op, fields=None):
+        """Queues a request and returns its req_id."""
+        if op == "8":
+            key = (fields["menu"], fields["id"])
+            msg = self._pendingUpdates.get(key, None)
+            if msg is not None:
+                msg.update(fields)
+                return msg["req_id"]
+        self._nextId += 1
+        msg = {"op": op, "req_id": self._nextId}
+        if fields:
+            msg.update(fields)
+        self._outbox.append(msg)
+        self._inFlight[self._nextId] = op
+        if op == "8":
+            self._pendingUpdates[key] = msg
+        self._requestQueued(self._nextId)
+        return self._nextId
+
+    def _requestQueued(self, reqId):
+        pass
+
+    def _takeOutput(self):
+        """Returns the encoded content of the outbox, and empties it."""
+        if not self._outbox:
+            return b""
+        data = b"".join(self._codec.encode(msg) for msg in self._outbox)
+        self._outbox = []
+        self._pendingUpdates = {}
+        return data
+
+    def _resyncRequests(self):
+        """Queues identification and the whole local state, for a new connection."""
+        identify = {"service-name": self.serviceName,
+                    "display-name": self.displayName,
+                    "version": self.version,
+                    "author": self.author}
+        if self.compression:
+            identify["compression"] = list(netcodec.COMPRESSIONS)
+        ids = [self._queue("1", identify)]
+        if self._subscriptions:
+            ids.append(self._queue("10", {"events": sorted(self._subscriptions)}))
+        for menuId, menu in self._menus.items():
+            ids.append(self._queue("3", {"id": menuId, "name": menu.name}))
+            for itemId in menu.order:
+                ids.append(self._addItemRequest(menuId, menu.items[itemId]))
+        return ids
+
+    def _addItemRequest(self, menuId, item, position=None):
+        # Later updates apply to the new item, after this request.
+        self._pendingUpdates.pop((menuId, item["id"]), None)
+        fields = {"menu": menuId, "id": item["id"]}
+        fields.update(_itemFields(item))
+        if position is not None:
+            fields["position"] = position
+        return self._queue("6", fields)
+
+    # Local menu mirror
+
+    def _addMenu(self, menuId, name, items):
+        if menuId in self._menus:
+            raise ValueError(f"menu {menuId} already exists")
+        self._menus[menuId] = _Menu(name)
+        ids = [self._queue("3", {"id": menuId, "name": name})]
+        for item in items:
+            ids.append(self._addItem(menuId, item))
+        return ids
+
+    def _removeMenu(self, menuId):
+        del self._menus[menuId]
+        for key in [key for key in self._pendingUpdates if key[0] == menuId]:
+            del self._pendingUpdates[key]
+        return [self._queue("4", {"id": menuId})]
+
+    def _setMenu(self, menuId, name, items):
+        """Queues the requests turning the published menu into the given one."""
+        menu = self._menus.get(menuId, None)
+        if menu is None:
+            return self._addMenu(menuId, name, items)
+        ids = []
+        if name != menu.name:
+            menu.name = name
+            ids.append(self._queue("5", {"id": menuId, "name": name}))
+        wanted = [item["id"] for item in items]
+        if len(set(wanted)) != len(wanted):
+            raise ValueError("duplicate item ids")
+        oldPos = {itemId: pos for pos, itemId in enumerate(menu.order)}
+        stable = _stableIds([itemId for itemId in wanted if itemId in oldPos], oldPos)
+        for itemId in list(menu.order):
+            if itemId not in stable:
+                ids.append(self._removeItem(menuId, itemId))
+        for position, item in enumerate(items):
+            if item["id"] in stable:
+                updateId = self._updateItem(menuId, item["id"], _itemFields(item))
+                if updateId is not None:
+                    ids.append(updateId)
+            else:
+                ids.append(self._addItem(menuId, item, position))
+        return ids
+
+    def _addItem(self, menuId, item, position=None):
+        menu = self._menus[menuId]
+        if item["id"] in menu.items:
+            raise ValueError(f"item {item['id']} already exists")
+        item = dict(item)
+        if position is None or position >= len(menu.order):
+            menu.order.append(item["id"])
+            position = None
+        else:
+            menu.order.insert(position, item["id"])
+        menu.items[item["id"]] = item
+        return self._addItemRequest(menuId, item, position)
+
+    def _updateItem(self, menuId, itemId, fields):
+        """Queues an update of the fields which changed, if any; returns its req_id or None."""
+        item = self._menus[menuId].items[itemId]
+        changed = {key: value for key, value in fields.items() if item.get(key, None) != value}
+        if not changed:
+            return None
+        item.update(changed)
+        changed.update({"menu": menuId, "id": itemId})
+        return self._queue("8", changed)
+
+    def _removeItem(self, menuId, itemId):
+        menu = self._menus[menuId]
+        del menu.items[itemId]
+        menu.order.remove(itemId)
+        self._pendingUpdates.pop((menuId, itemId), None)
+        return self._queue("7", {"menu": menuId, "id": itemId})
+
+    def menu(self, menuId):
+        """Returns the published items of a menu, in order."""
+        menu = self._menus[menuId]
+        return [dict(menu.items[itemId]) for itemId in menu.order]
+
+    # Input
+
+    def _receive(self, data):
+        """Handles bytes received from the server."""
+        buf = self._inBuf + data
+        pos = 0
+        while True:
+            line, pos = self._codec.unframe(buf, pos)
+            if line is None:
+                break
+            self._handleMessage(json.loads(line))
+        self._inBuf = buf[pos:]
+
+    def _handleMessage(self, msg):
+        reqId = msg.get("req_id", None)
+        op = msg.get("op", None)
+        if reqId is not None and reqId in self._inFlight:
+            requestOp = self._inFlight.pop(reqId)
+            if requestOp == "1" and msg.get("compression", None):
+                # The server compresses what follows its reply.
+                self._codec.enableCompression(msg["compression"],
+                                              msg.get("threshold", netcodec.COMPRESS_THRESHOLD))
+            self._replyReceived(reqId, msg)
+        elif op == "0" and "ping_id" in msg:
+            # Server heartbeat
+            self._outbox.append({"op": "0", "pong_id": msg["ping_id"]})
+        elif op == "12":
+            if self.eventHandler is not None:
+                self.eventHandler(msg.get("event", None), msg.get("data", {}), msg.get("seq", None))
+
+    def _replyReceived(self, reqId, msg):
+        """Called with the reply to a request, or None if the connection was
+        lost before it. The transports hand it to whoever waits for it."""
+        pass
+
+    def _connectionLost(self):
+        """Forgets the connection state.
+
+        Menu requests in flight are answered as done, since the resync
+        publishes the mirror they have already been applied to; the others
+        are answered with None."""
+        lost = self._inFlight
+        self._inFlight = {}
+        self._outbox = []
+        self._pendingUpdates = {}
+        self._inBuf = b""
+        self._codec = netcodec.Codec()
+        for reqId, op in lost.items():
+            if op in MENU_OPS:
+                self._replyReceived(reqId, {"op": op, "req_id": reqId,
+                                            "status": "ok", "resynced": True})
+            else:
+                self._replyReceived(reqId, None)
+
+    def _openSocket(self):
+        if self.unixPath is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.unixPath)
+        else:
+            sock = socket.create_connection((self.host, self.port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+
+def _checkReply(reply):
+    if reply is None:
+        raise ConnectionError("connection lost before the reply")
+    if reply.get("status", "ok") == "error":
+        raise NetError(reply.get("op", None), reply.get("error", None), reply)
+    return reply
+
+
+class NetClient(_ClientBase):
+    """Blocking netservice client.
+
+    Events and server heartbeats are only handled while waiting for replies,
+    or in poll(), which idle clients should call regularly."""
+
+    def __init__(self, *args, timeout=10.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+        self._sock = None
+        self._replies = {}
+        self._batch = None
+
+    def connect(self):
+        """Connects, identifies and publishes the local state."""
+        self._closed = False
+        self._sock = self._openSocket()
+        self._sock.settimeout(self.timeout)
+        self._complete(self._resyncRequests())
+
+    def close(self):
+        self._closed = True
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _replyReceived(self, reqId, msg):
+        self._replies[reqId] = msg
+
+    def _flush(self):
+        data = self._takeOutput()
+        if data:
+            self._sock.sendall(data)
+
+    def _readOnce(self, timeout):
+        """Waits up to timeout for data and handles it."""
+        self._sock.settimeout(timeout)
+        try:
+            data = self._sock.recv(RECV_SIZE)
+        except socket.timeout:
+            return
+        if not data:
+            raise ConnectionResetError("connection closed by the server")
+        self._receive(data)
+
+    def _reconnect(self):
+        """Reconnects until it works, then publishes the local state again."""
+        self._connectionLost()
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        delay = RECONNECT_DELAY
+        while not self._closed:
+            try:
+                self._sock = self._openSocket()
+                break
+            except OSError:
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        self.reconnections += 1
+        return self._resyncRequests()
+
+    def _wait(self, reqIds):
+        """Exchanges data until all the given requests have been answered."""
+        deadline = time.monotonic() + self.timeout
+        while not all(reqId in self._replies for reqId in reqIds):
+            try:
+                self._flush()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("no reply from the server")
+                self._readOnce(remaining)
+            except (ConnectionError, OSError) as ex:
+                if isinstance(ex, TimeoutError) or not self.autoReconnect or self._closed:
+                    raise
+                for reply in self._wait(self._reconnect()):
+                    _checkReply(reply)
+        self._flush()
+        return [self._replies.pop(reqId) for reqId in reqIds]
+
+    def _complete(self, reqIds):
+        """Waits for the replies, unless in a batch, and raises the first error."""
+        if self._batch is not None:
+            self._batch.extend(reqIds)
+            return None
+        # Merged item updates share their req_id.
+        replies = self._wait(list(dict.fromkeys(reqIds)))
+        for reply in replies:
+            _checkReply(reply)
+        return replies
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Sends the requests made in the block together, and waits for them at the end."""
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = []
+        try:
+            yield self
+        finally:
+            reqIds = self._batch
+            self._batch = None
+        self._complete(reqIds)
+
+    def request(self, op, **fields):
+        """Sends a request and returns its reply, or None in a batch."""
+        replies = self._complete([self._queue(op, fields)])
+        return replies[0] if replies else None
+
+    def poll(self, timeout=0.0):
+        """Handles events and heartbeats received within timeout."""
+        try:
+            self._flush()
+            self._readOnce(timeout)
+            self._flush()
+        except (ConnectionError, OSError):
+            if not self.autoReconnect or self._closed:
+                raise
+            for reply in self._wait(self._reconnect()):
+                _checkReply(reply)
+
+    def ping(self):
+        """Returns the round-trip time to the server, in seconds."""
+        start = time.perf_counter()
+        self.request("0", ping_id=self._nextId + 1)
+        return time.perf_counter() - start
+
+    def notify(self, message):
+        """Asks NVDA to speak a message."""
+        self.request("9", message=message)
+
+    def subscribe(self, events):
+        self._subscriptions.update(events)
+        self.request("10", events=list(events))
+
+    def unsubscribe(self, events):
+        self._subscriptions.difference_update(events)
+        self.request("11", events=list(events))
+
+    def addMenu(self, menuId, name, items=()):
+        self._complete(self._addMenu(menuId, name, items))
+
+    def removeMenu(self, menuId):
+        self._complete(self._removeMenu(menuId))
+
+    def setMenu(self, menuId, name, items):
+        """Publishes a menu, sending only the differences with what was published."""
+        self._complete(self._setMenu(menuId, name, items))
+
+    def addItem(self, menuId, item, position=None):
+        self._complete([self._addItem(menuId, item, position)])
+
+    def updateItem(self, menuId, itemId, **fields):
+        reqId = self._updateItem(menuId, itemId, fields)
+        if reqId is not None:
+            self._complete([reqId])
+
+    def removeItem(self, menuId, itemId):
+        self._complete([self._removeItem(menuId, itemId)])
+
+
+class AsyncNetClient(_ClientBase):
+    """asyncio netservice client.
+
+    A reader task handles replies, events and heartbeats, and reconnects
+    when the connection is lost."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._reader = None
+        self._writer = None
+        self._readTask = None
+        self._futures = {}
+        self._batch = None
+        self.resyncError = None
+
+    async def connect(self):
+        """Connects, identifies and publishes the local state."""
+        self._closed = False
+        await self._open()
+        reqIds = self._resyncRequests()
+        self._readTask = asyncio.ensure_future(self._readLoop())
+        await self._complete(reqIds)
+
+    async def close(self):
+        self._closed = True
+        if self._readTask is not None:
+            self._readTask.cancel()
+            try:
+                await self._readTask
+            except asyncio.CancelledError:
+                pass
+            self._readTask = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _open(self):
+        if self.unixPath is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.unixPath)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    def _requestQueued(self, reqId):
+        self._futures[reqId] = asyncio.get_event_loop().create_future()
+
+    def _replyReceived(self, reqId, msg):
+        future = self._futures.get(reqId, None)
+        if future is not None and not future.done():
+            future.set_result(msg)
+
+    def _flush(self):
+        data = self._takeOutput()
+        if data and self._writer is not None:
+            self._writer.write(data)
+
+    async def _readLoop(self):
+        delay = RECONNECT_DELAY
+        while not self._closed:
+            try:
+                data = await self._reader.read(RECV_SIZE)
+                if not data:
+                    raise ConnectionResetError("connection closed by the server")
+                self._receive(data)
+                self._flush()
+                delay = RECONNECT_DELAY
+            except (ConnectionError, OSError):
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+                self._connectionLost()
+                if not self.autoReconnect:
+                    return
+                while not self._closed:
+                    try:
+                        await self._open()
+                        break
+                    except OSError:
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                self.reconnections += 1
+                asyncio.ensure_future(self._resync(self._resyncRequests()))
+                self._flush()
+
+    async def _resync(self, reqIds):
+        """Waits for the replies to a resync; errors are kept in resyncError."""
+        try:
+            await self._complete(reqIds)
+            self.resyncError = None
+        except (NetError, ConnectionError) as ex:
+            self.resyncError = ex
+
+    async def _complete(self, reqIds):
+        """Waits for the replies, unless in a batch, and raises the first error."""
+        if self._batch is not None:
+            self._batch.extend(reqIds)
+            return None
+        # Merged item updates share their req_id.
+        reqIds = list(dict.fromkeys(reqIds))
+        futures = [self._futures[reqId] for reqId in reqIds]
+        self._flush()
+        if self._writer is not None:
+            await self._writer.drain()
+        try:
+            replies = await asyncio.gather(*futures)
+        finally:
+            for reqId in reqIds:
+                self._futures.pop(reqId, None)
+        for reply in replies:
+            _checkReply(reply)
+        return replies
+
+    @contextlib.asynccontextmanager
+    async def batch(self):
+        """Sends the requests made in the block together, and waits for them at the end."""
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = []
+        try:
+            yield self
+        finally:
+            reqIds = self._batch
+            self._batch = None
+        await self._complete(reqIds)
+
+    async def request(self, op, **fields):
+        """Sends a request and returns its reply."""
+        replies = await self._complete([self._queue(op, fields)])
+        return replies[0] if replies else None
+
+    async def ping(self):
+        """Returns the round-trip time to the server, in seconds."""
+        start = time.perf_counter()
+        await self.request("0", ping_id=self._nextId + 1)
+        return time.perf_counter() - start
+
+    async def notify(self, message):
+        """Asks NVDA to speak a message."""
+        await self.request("9", message=message)
+
+    async def subscribe(self, events):
+        self._subscriptions.update(events)
+        await self.request("10", events=list(events))
+
+    async def unsubscribe(self, events):
+        self._subscriptions.difference_update(events)
+        await self.request("11", events=list(events))
+
+    async def addMenu(self, menuId, name, items=()):
+        await self._complete(self._addMenu(menuId, name, items))
+
+    async def removeMenu(self, menuId):
+        await self._complete(self._removeMenu(menuId))
+
+    async def setMenu(self, menuId, name, items):
+        """Publishes a menu, sending only the differences with what was published."""
+        await self._complete(self._setMenu(menuId, name, items))
+
+    async def addItem(self, menuId, item, position=None):
+        await self._complete([self._addItem(menuId, item, position)])
+
+    async def updateItem(self, menuId, itemId, **fields):
+        reqId = self._updateItem(menuId, itemId, fields)
+        if reqId is not None:
+            await self._complete([reqId])
+
+    async def removeItem(self, menuId, itemId):
+        await self._complete([self._removeItem(menuId, itemId)])
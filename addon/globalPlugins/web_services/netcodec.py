@@ -0,0 +1,109 @@
+#netcodec.py
+#
+# Wire format of the netservice protocol, shared by the server (netservice)
+# and the client library (netclient). It does not depend on NVDA.
+#
+# Messages are JSON objects, one per line. Once compression has been
+# negotiated at identify time, messages of COMPRESS_THRESHOLD bytes or more
+# are sent as compressed frames instead.
+
+import json
+import struct
+import zlib
+
+# Compression algorithms a client may ask for at identify time.
+COMPRESSIONS = ("deflate",)
+# Messages shorter than this many bytes are always sent uncompressed.
+COMPRESS_THRESHOLD = 512
+COMPRESS_LEVEL = 6
+# Largest compressed frame or decompressed message accepted.
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+# Preset deflate dictionary: the protocol's field names and reply envelopes
+# only, as sent by json.dumps(), most frequent strings last. Values are left
+# to the compression context, whatever the tool sending them.
+COMPRESS_DICTIONARY = (b'{"op": "1", "service-name": "display-name": "author": '
+                       b'"compression": ["deflate"], "threshold": '
+                       b'{"op": "12", "event": "seq": "data": {"menuId": "itemIdx": '
+                       b'"message": "events": "ping_id": "pong_id": "time": '
+                       b'{"op": "3", "status": "error", "error": "Unknown item"} '
+                       b'"actionData": {}, "action": "position": "version": '
+                       b'{"op": "8", "req_id": "menu": "id": "name": '
+                       b'{"op": "6", "status": "ok", "position": ')
+# A compressed frame is this marker byte, a 4 bytes big-endian length and raw
+# deflate data. JSON lines never start with a NUL byte.
+COMPRESSED_MARKER = 0
+_frameHeader = struct.Struct(">BI")
+# Trailer of a deflate sync flush, implied in compressed frames.
+_SYNC_TRAILER = b"\x00\x00\xff\xff"
+
+
+class Codec:
+    """Frames and unframes the messages of one connection.
+
+    Compression keeps its context across messages, so each direction of a
+    connection needs its own Codec."""
+
+    def __init__(self):
+        self.compression = None
+        self.threshold = COMPRESS_THRESHOLD
+        self._compressor = None
+        self._decompressor = None
+
+    def enableCompression(self, algorithm, threshold=COMPRESS_THRESHOLD):
+        """Starts compressing large messages in both directions"""
+        self.compression = algorithm
+        self.threshold = threshold
+        self._compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                            zdict=COMPRESS_DICTIONARY)
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=COMPRESS_DICTIONARY)
+
+    def encode(self, msg):
+        """Returns the bytes carrying a message on the wire"""
+        return self.frame(json.dumps(msg).encode("utf-8"))
+
+    def frame(self, encoded):
+        """Returns the bytes carrying an encoded message on the wire"""
+        if self._compressor is not None and len(encoded) >= self.threshold:
+            return self.deflate(encoded)
+        return encoded + b"\n"
+
+    def unframe(self, buf, pos=0):
+        """Extracts the message starting at pos in buf.
+
+        Returns the encoded message and the position of the next one, or
+        None and pos if the message is not complete yet."""
+        size = len(buf)
+        if pos >= size:
+            return None, pos
+        if buf[pos] == COMPRESSED_MARKER:
+            if size - pos < _frameHeader.size:
+                return None, pos
+            marker, length = _frameHeader.unpack_from(buf, pos)
+            if length > MAX_MESSAGE_SIZE:
+                raise ValueError(f"compressed frame too large ({length} bytes)")
+            end = pos + _frameHeader.size + length
+            if end > size:
+                return None, pos
+            return self.inflate(buf[pos + _frameHeader.size:end]), end
+        end = buf.find(b"\n", pos)
+        if end < 0:
+            if size - pos > MAX_MESSAGE_SIZE:
+                raise ValueError("message too large")
+            return None, pos
+        return buf[pos:end], end + 1
+
+    def inflate(self, payload):
+        """Decompresses a compressed frame's payload"""
+        if self._decompressor is None:
+            raise ValueError("compressed frame received but compression is not enabled")
+        data = self._decompressor.decompress(payload + _SYNC_TRAILER, MAX_MESSAGE_SIZE)
+        if self._decompressor.unconsumed_tail:
+            raise ValueError("decompressed message too large")
+        return data
+
+    def deflate(self, data):
+        """Returns the compressed frame for an encoded message"""
+        payload = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        # A sync flush always ends with the same empty block; the reader re-adds it.
+        payload = payload[:-len(_SYNC_TRAILER)]
+        return _frameHeader.pack(COMPRESSED_MARKER, len(payload)) + payload
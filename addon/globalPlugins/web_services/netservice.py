@@ -1,196 +1,1196 @@
+import collections
+import itertools
+import json
+import os
+import secrets
 import socket
 import select
+import stat
+import struct
 import threading
+import tempfile
+import time
 import queue
+import urllib.parse
 
 from logHandler import log
+import events
+import menustore
+import netcodec
 import service
+import shmring
+from websocket._abnf import ABNF, frame_buffer, continuous_frame
+from websocket._exceptions import WebSocketException, WebSocketMessageTooBigException
+from websocket._handshake import _create_accept_key
+# The wire format is shared with the client library.
+from netcodec import COMPRESSIONS, COMPRESS_THRESHOLD, MAX_MESSAGE_SIZE
 
+# Client ops. Each op has a name, a rate limiting class, and a schema:
+# "required" and "fields" (optional) map field names to accepted types.
+# Any op may also carry the COMMON_FIELDS.
+_ID = (str, int)
 NET_OPS = {
-    "0": "ping",
-    "1": "identify",
-    "2": "logout",
-    "3": "menuAdd",
-    "4": "menuDel",
-    "5": "menuUpdate",
-    "6": "menuItemAdd",
-    "7": "menuItemDel",
-    "8": "menuItemUpdate",
-    "9": "userNotification",
+    "0": {"name": "ping", "class": "control",
+          "fields": {"ping_id": _ID, "pong_id": _ID}},
+    "1": {"name": "identify", "class": "control",
+          "required": {"service-name": str},
+          "fields": {"display-name": str, "version": str, "author": str,
+                     "compression": list}},
+    "2": {"name": "logout", "class": "control"},
+    "3": {"name": "menuAdd", "class": "menu",
+          "required": {"id": _ID, "name": str}},
+    "4": {"name": "menuDel", "class": "menu",
+          "required": {"id": _ID}},
+    "5": {"name": "menuUpdate", "class": "menu",
+          "required": {"id": _ID},
+          "fields": {"name": str}},
+    "6": {"name": "menuItemAdd", "class": "menu",
+          "required": {"menu": _ID, "id": _ID, "name": str},
+          "fields": {"action": str, "actionData": dict, "position": int}},
+    "7": {"name": "menuItemDel", "class": "menu",
+          "required": {"menu": _ID, "id": _ID}},
+    "8": {"name": "menuItemUpdate", "class": "menu",
+          "required": {"menu": _ID, "id": _ID},
+          "fields": {"name": str, "action": str, "actionData": dict}},
+    "9": {"name": "userNotification", "class": "notification",
+          "required": {"message": str}},
+    "10": {"name": "subscribe", "class": "control",
+           "required": {"events": list}},
+    "11": {"name": "unsubscribe", "class": "control",
+           "required": {"events": list}},
+    # Server to client only
+    "12": {"name": "event", "class": "control"},
+    "13": {"name": "shmOpen", "class": "control",
+           "fields": {"size": int}},
+    "14": {"name": "shmClose", "class": "control"},
 }
+# A request's req_id is echoed in the reply, or error, to that request, so
+# that clients can have many requests in flight.
+COMMON_FIELDS = {"req_id": _ID}
+
+# Per op class and per client: (messages per second, bytes per second).
+RATE_LIMITS = {
+    "control": (50, 64 * 1024),
+    "menu": (1000, 1024 * 1024),
+    "notification": (5, 16 * 1024),
+}
+# Bucket capacity, in seconds worth of the rate.
+RATE_BURST = 2.0
+# Complete messages buffered for a client before its socket stops being read.
+MAX_PENDING_MESSAGES = 256
+# Messages handled for one client before moving to the next one.
+ROUND_QUANTUM = 16
+# Messages handled per loop iteration, across all clients.
+PROCESS_BUDGET = 1024
+
+
+# Doorbell datagrams carry the 8 bytes token of the ring to drain.
+_doorbellToken = struct.Struct(">Q")
+
+# Events a client can subscribe to. They are pushed with op "12".
+SUBSCRIBABLE_EVENTS = {
+    events.QUIT,
+    events.MENU_UPDATE,
+    events.MENU_GET_ITEMS,
+    events.MENU_ACTIVATE,
+    events.SERVICE_FOCUS,
+}
+
+# Address the TCP listener binds to. Only local tools are expected to connect.
+TCP_HOST = "127.0.0.1"
+# Directory of the AF_UNIX listening socket, where the platform supports it.
+# The temporary directory is shared: each user gets a private directory.
+UNIX_SOCKET_DIR = os.path.join(tempfile.gettempdir(),
+                               f"nvda-webservices-{os.getuid()}" if hasattr(os, "getuid") else "nvda-webservices")
+UNIX_SOCKET_PATH = os.path.join(UNIX_SOCKET_DIR, "nvda-webservices.sock")
+
+# Port of the WebSocket endpoint, on the same address as the TCP listener.
+WS_PORT = 62101
+# Largest WebSocket upgrade request accepted.
+WS_MAX_HANDSHAKE = 8192
+# Origins allowed to open a WebSocket, besides clients sending none (Node,
+# Electron main processes): browser extensions, by scheme, and local pages,
+# whose host must be exactly one of WS_LOCAL_HOSTS, on any port. Web pages
+# from other origins are refused.
+WS_EXTENSION_SCHEMES = ("chrome-extension", "moz-extension", "safari-web-extension")
+WS_LOCAL_SCHEMES = ("http", "file")
+WS_LOCAL_HOSTS = ("localhost", "127.0.0.1")
+
+# Bytes of encoded output queued for a client above which events stop being
+# fanned out to it.
+OUT_HIGH_WATER = 256 * 1024
+# Bytes of queued output above which a client is disconnected right away.
+OUT_HARD_LIMIT = 4 * 1024 * 1024
+# Seconds a client may stay above the high-water mark before being dropped.
+OUT_STALL_TIMEOUT = 10.0
+# Maximum number of queued chunks handed to a single sendmsg() call.
+OUT_MAX_CHUNKS = 64
+# Size of a single recv() call.
+RECV_SIZE = 65536
+
+# Seconds without any data from a client before the server pings it.
+IDLE_TIMEOUT = 30.0
+# Seconds a client has to answer a server ping before being reaped.
+HEARTBEAT_TIMEOUT = 10.0
+# Resolution and size of the timer wheel holding client deadlines.
+TIMER_TICK = 0.5
+TIMER_SLOTS = 128
+
+# sendmsg() is not available on Windows; fall back to joining the chunks.
+_HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+# Menu changes are batched and handed to the global plugin at most this often.
+MENU_FLUSH_INTERVAL = 0.1
+
+
+class TimerWheel:
+    """Hashed timer wheel.
+
+    Keys are hashed into slots by their deadline tick, so scheduling,
+    cancelling and advancing by one tick are O(1) whatever the number of
+    keys. Deadlines further away than the wheel length simply stay in their
+    slot for more than one turn.
+    """
+
+    def __init__(self, tick=TIMER_TICK, slots=TIMER_SLOTS, now=None):
+        self._tickLength = tick
+        self._slots = [set() for i in range(slots)]
+        self._deadlines = {}
+        if now is None:
+            now = time.monotonic()
+        self._currentTick = self._toTick(now)
+
+    def _toTick(self, when):
+        return int(when / self._tickLength)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, key, deadline):
+        """Schedules key to expire at deadline, replacing any previous deadline."""
+        self.cancel(key)
+        tick = max(self._toTick(deadline), self._currentTick + 1)
+        self._deadlines[key] = tick
+        self._slots[tick % len(self._slots)].add(key)
+
+    def cancel(self, key):
+        """Removes key from the wheel, if scheduled."""
+        tick = self._deadlines.pop(key, None)
+        if tick is not None:
+            self._slots[tick % len(self._slots)].discard(key)
+
+    def advance(self, now):
+        """Moves the wheel up to now and returns the expired keys."""
+        expired = []
+        target = self._toTick(now)
+        # After a long stall, one full turn visits every slot.
+        if target - self._currentTick > len(self._slots):
+            self._currentTick = target - len(self._slots)
+        while self._currentTick < target:
+            self._currentTick += 1
+            slot = self._slots[self._currentTick % len(self._slots)]
+            if not slot:
+                continue
+            for key in [k for k in slot if self._deadlines[k] <= target]:
+                slot.discard(key)
+                del self._deadlines[key]
+                expired.append(key)
+        return expired
+
+
+def compileValidator(spec):
+    """Compiles an op schema into a function returning None for a valid
+    message, or an error message.
+
+    Fields may be left out, but not set to null: handlers only check
+    whether optional fields are present."""
+    required = tuple(spec.get("required", {}).items())
+    optional = tuple(spec.get("fields", {}).items()) + tuple(COMMON_FIELDS.items())
+
+    def validate(msg):
+        for key, types in required:
+            value = msg.get(key, None)
+            if value is None:
+                return f"missing {key}"
+            if not isinstance(value, types) or value is True or value is False:
+                return f"invalid {key}"
+        for key, types in optional:
+            if key not in msg:
+                continue
+            value = msg[key]
+            if not isinstance(value, types) or value is True or value is False:
+                return f"invalid {key}"
+        return None
+    return validate
+
+
+def _requestId(msg):
+    """Returns the req_id of a message, or None if it has no valid one."""
+    if not isinstance(msg, dict):
+        return None
+    reqId = msg.get("req_id", None)
+    if isinstance(reqId, _ID) and not isinstance(reqId, bool):
+        return reqId
+    return None
+
+
+def _makePrivateDir(path):
+    """Creates a directory only the current user can access, or checks that
+    an existing one is. Raises OSError otherwise."""
+    os.makedirs(path, 0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError(f"{path} is not a directory")
+    if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+        raise OSError(f"{path} is not private to the current user")
+
+
+def _removeStaleSocket(path):
+    """Removes an AF_UNIX socket left behind by a server which exited.
+
+    Raises OSError if path is not a socket, or if a server still listens on
+    it."""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise OSError(f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"{path} is used by another server")
+
+
+def _originAllowed(origin):
+    """Returns True if a WebSocket may be opened from origin."""
+    try:
+        parts = urllib.parse.urlsplit(origin)
+        host = parts.hostname
+        # Raises ValueError on an invalid port.
+        parts.port
+    except ValueError:
+        return False
+    if parts.scheme in WS_EXTENSION_SCHEMES:
+        return True
+    if parts.scheme == "file" and not parts.netloc:
+        # file:///path is a local file.
+        return True
+    return parts.scheme in WS_LOCAL_SCHEMES and host in WS_LOCAL_HOSTS
+
+
+def _lookupRingId(lookup, text):
+    """Calls lookup with an id read from a ring key, as a string, then as an
+    integer if the string is unknown. Returns None if both are."""
+    found = lookup(text)
+    if found is None and text.lstrip("-").isdigit():
+        found = lookup(int(text))
+    return found
+
+
+class OpEntry:
+    """A compiled NET_OPS entry.
+
+    handler is the Client method handling the op, looked up once, or None
+    for ops clients may not send."""
+
+    __slots__ = ("code", "name", "opClass", "validate", "method", "handler")
+
+    def __init__(self, code, spec, cls):
+        self.code = code
+        self.name = spec["name"]
+        self.opClass = spec.get("class", "control")
+        self.validate = compileValidator(spec)
+        self.method = f"on_{self.name}"
+        self.handler = getattr(cls, self.method, None)
+
+
+class OpStats:
+    """Per op counters and timings, in seconds."""
+
+    __slots__ = ("count", "rejected", "parseTime", "validateTime", "handleTime")
+
+    def __init__(self):
+        self.count = 0
+        self.rejected = 0
+        self.parseTime = 0.0
+        self.validateTime = 0.0
+        self.handleTime = 0.0
+
+    def toDict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second, holding up to capacity."""
+
+    def __init__(self, rate, capacity, now=None):
+        self._rate = float(rate)
+        self._capacity = float(capacity)
+        self._tokens = self._capacity
+        self._last = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self._last:
+            self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def consume(self, count, now):
+        """Takes count tokens if available and returns True.
+
+        A full bucket always grants the request, so that a single message
+        larger than the capacity is delayed instead of blocked forever."""
+        self._refill(now)
+        if self._tokens >= count or self._tokens >= self._capacity:
+            self._tokens -= count
+            return True
+        return False
+
+    def delay(self, count, now):
+        """Seconds until count tokens would be available."""
+        self._refill(now)
+        missing = min(count, self._capacity) - self._tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self._rate
+
+
+class RateLimiter:
+    """Per op class message and byte rate limits of a client."""
+
+    def __init__(self, limits=RATE_LIMITS, burst=RATE_BURST):
+        self._buckets = {}
+        for opClass, (messages, size) in limits.items():
+            self._buckets[opClass] = (TokenBucket(messages, messages * burst),
+                                      TokenBucket(size, size * burst))
+
+    def allow(self, opClass, size, now):
+        """Returns True and takes the tokens if a message can be handled now."""
+        buckets = self._buckets.get(opClass, None)
+        if buckets is None:
+            return True
+        messages, octets = buckets
+        if messages.delay(1, now) > 0 or octets.delay(size, now) > 0:
+            return False
+        messages.consume(1, now)
+        octets.consume(size, now)
+        return True
+
+    def delay(self, opClass, size, now):
+        """Seconds until a message of this class and size can be handled."""
+        buckets = self._buckets.get(opClass, None)
+        if buckets is None:
+            return 0.0
+        return max(buckets[0].delay(1, now), buckets[1].delay(size, now))
 
 
 class Server(threading.Thread):
-    """TCP Server listening for incoming service requests.
+    """Server listening for incoming service requests.
+
+    Clients connect either over loopback TCP or, where available, over an
+    AF_UNIX stream socket; both share the same Client protocol handling.
     """
-    _clients = []
     _sock = None
-    _outQueue = queue.Queue()
-    _inQueue = queue.Queue()
+    _unixSock = None
+    _wsSock = None
     
     _port = None
     _gp = None
 
-    def __init__(self, gp, port, *args, **kwargs):
+    def __init__(self, gp, port, host=TCP_HOST, unixPath=UNIX_SOCKET_PATH,
+                 rateLimits=RATE_LIMITS, wsPort=WS_PORT, *args, **kwargs):
         kwargs["name"] = "WSNetwork"
         super().__init__(*args, **kwargs)
         self._port = port
+        self._host = host
+        self._unixPath = unixPath
+        self._wsPort = wsPort
         self._gp = gp
+        self._rateLimits = rateLimits
         self._shouldQuit = False
+        self._inQueue = queue.Queue()
+        self._clients = {}
+        self._listeners = []
+        self._timers = TimerWheel()
+        self._roundStart = 0
+        # Shared memory rings, by doorbell token
+        self._rings = {}
+        self._doorbell = None
+        self.opStats = collections.defaultdict(OpStats)
+        # Services with menu changes not yet posted to the global plugin
+        self._dirtyServices = set()
+        self._lastMenuFlush = 0.0
+        # Lets other threads wake the select() loop up when posting events.
+        self._wakeupSock, self._wakeupSender = socket.socketpair()
+        self._wakeupSock.setblocking(False)
+        self._wakeupSender.setblocking(False)
         self.create_server()
+        self.create_unix_server()
+        self.create_ws_server()
     def create_server(self):
-        """Creates a li,stening socket on specified port"""
+        """Creates a listening socket on specified port"""
         try:
             self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
-            self._sock.bind(("0.0.0.0", self._port))
+            self._sock.bind((self._host, self._port))
             self._sock.listen(5)
+            self._sock.setblocking(False)
+            self._listeners.append(self._sock)
+        except Exception as ex:
+            log.info(f"Unable to bind to {self._host}:{self._port}: {ex}")
+
+    def create_unix_server(self):
+        """Creates a listening AF_UNIX socket, if supported.
+
+        The socket is created in a directory private to the current user. A
+        path which is not a socket, or a socket another server listens on,
+        is left alone."""
+        if not self._unixPath or not hasattr(socket, "AF_UNIX"):
+            return
+        try:
+            _makePrivateDir(os.path.dirname(self._unixPath))
+            _removeStaleSocket(self._unixPath)
+            self._unixSock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
+            self._unixSock.bind(self._unixPath)
+            self._unixSock.listen(5)
+            self._unixSock.setblocking(False)
+            self._listeners.append(self._unixSock)
+        except Exception as ex:
+            log.info(f"Unable to bind to {self._unixPath}: {ex}")
+            self._unixSock = None
+
+    def create_ws_server(self):
+        """Creates the listening socket of the WebSocket endpoint"""
+        if self._wsPort is None:
+            return
+        try:
+            self._wsSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+            self._wsSock.bind((self._host, self._wsPort))
+            self._wsSock.listen(5)
+            self._wsSock.setblocking(False)
+            self._listeners.append(self._wsSock)
         except Exception as ex:
-            log.info(f"Unable to bind to {self._port}: {ex}")
+            log.info(f"Unable to bind to {self._host}:{self._wsPort}: {ex}")
+            self._wsSock = None
 
     def run(self):
-        log.info(f"TCP server running on port {self._port}")
+        log.info(f"Server running on {self._host}:{self._port}" + (f" and {self._unixPath}" if self._unixSock else ""))
         while self._shouldQuit is False:
-            evt = None
-            try:
-                self._inQueue.get_nowait()
-            except queue.Empty:
-                pass
-            if evt is not None:
-                method = f"on_{events.toString(evt['event'])}"
-                attr = getattr(self, method, None)
-                if attr:
-                    try:
-                        attr(evt)
-                    except Exception as ex:
-                        log.info(f"Error executing {method}: {ex}")
-                else:
-                    log.info(f"{method}: unknown to {self.__class__.__name__}")
-            # TCP I/O polling
-            input = []
+            self.handleEvents()
+            # Socket I/O polling
+            input = list(self._listeners)
+            input.append(self._wakeupSock)
+            if self._doorbell is not None:
+                input.append(self._doorbell)
             output = []
-            input.append(self._sock)
-            for client in self._clients:
-                input.append(client._sock)
-                if client.out_buf:
-                    output.append(client._sock)
-            rlist, wlist, xlist = select.select(input, output, [], 0.1)
-            for fd in rlist:
-                self.on_read(fd)
-            for fd in wlist:
-                self.on_write(fd)
+            for sock, client in self._clients.items():
+                if client.wantsRead():
+                    input.append(sock)
+                if client.hasPendingOutput():
+                    output.append(sock)
+            rlist, wlist, xlist = select.select(input, output, [], self.pollTimeout())
+            for sock in rlist:
+                self.on_read(sock)
+            self.drainRings()
+            self.processClients()
+            self.flushMenuChanges()
+            for sock in wlist:
+                self.on_write(sock)
+            self.checkSlowClients()
+            self.checkIdleClients()
             
-        log.info("TCP Server exiting")
-        self._sock.close()
-        for client in self._clients:
+        log.info("Server exiting")
+        for sock in self._listeners:
+            sock.close()
+        if self._unixSock is not None:
+            try:
+                os.unlink(self._unixPath)
+            except OSError:
+                pass
+        for client in list(self._clients.values()):
             client.terminate()
+        self._clients.clear()
+        self._wakeupSock.close()
+        self._wakeupSender.close()
+        if self._doorbell is not None:
+            self._doorbell.close()
+
+    def postEvent(self, evt):
+        """Queues an event for the server thread. Can be called from any thread."""
+        self._inQueue.put(evt)
+        try:
+            self._wakeupSender.send(b"\0")
+        except OSError:
+            # Wakeup already pending
+            pass
+
+    def handleEvents(self):
+        """Handles the events posted to the server thread."""
+        while True:
+            try:
+                evt = self._inQueue.get_nowait()
+            except queue.Empty:
+                return
+            client = evt.pop("client", None)
+            if client is not None:
+                client.handleServiceEvent(evt)
+                continue
+            method = f"on_{events.toString(evt['event'])}"
+            attr = getattr(self, method, None)
+            if attr:
+                try:
+                    attr(evt)
+                except Exception as ex:
+                    log.info(f"Error executing {method}: {ex}")
+            else:
+                log.info(f"{method}: unknown to {self.__class__.__name__}")
+
+    def pollTimeout(self):
+        """Returns how long select() may wait, given throttled input."""
+        timeout = 0.1
+        now = time.monotonic()
+        for client in self._clients.values():
+            delay = client.throttleDelay(now)
+            if delay is not None and delay < timeout:
+                timeout = delay
+        return timeout
+
+    def processClients(self):
+        """Handles pending client messages, round-robin across clients.
+
+        Each client gets up to ROUND_QUANTUM messages per round, within its
+        rate limits, until PROCESS_BUDGET messages have been handled. The
+        first client served changes on every call."""
+        clients = list(self._clients.values())
+        if not clients:
+            return
+        start = self._roundStart % len(clients)
+        self._roundStart += 1
+        active = clients[start:] + clients[:start]
+        budget = PROCESS_BUDGET
+        now = time.monotonic()
+        while active and budget > 0:
+            nextRound = []
+            for client in active:
+                if client._closed:
+                    continue
+                count = client.process(min(ROUND_QUANTUM, budget), now)
+                budget -= count
+                if count == ROUND_QUANTUM and client.hasPendingInput():
+                    nextRound.append(client)
+                if budget <= 0:
+                    break
+            active = nextRound
+
+    def menuChanged(self, service):
+        """Schedules the posting of a service's menu changes."""
+        self._dirtyServices.add(service)
+
+    def flushMenuChanges(self):
+        """Posts pending menu changes to the global plugin, in batches."""
+        if not self._dirtyServices:
+            return
+        now = time.monotonic()
+        if now - self._lastMenuFlush < MENU_FLUSH_INTERVAL:
+            return
+        self._lastMenuFlush = now
+        dirty = self._dirtyServices
+        self._dirtyServices = set()
+        for service in dirty:
+            service.flushChanges()
 
-    def on_accept(self, fd):
+    def getStats(self):
+        """Returns per-client counters, keyed by client name."""
+        return {client._clientName: client.getStats() for client in self._clients.values()}
+
+    def getOpStats(self):
+        """Returns per op counters and timings, keyed by op name."""
+        return {name: stats.toDict() for name, stats in self.opStats.items()}
+
+    def on_accept(self, listener):
         """Accepts an incoming connection"""
-        sock,addr = _sock.accept()
-        self._clients.append(Client(self, sock, addr))
+        try:
+            sock, addr = listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        if sock.family != getattr(socket, "AF_UNIX", None):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if listener is self._wsSock:
+            client = WebSocketClient(self, sock, addr)
+        else:
+            client = Client(self, sock, addr)
+        self._clients[sock] = client
+        self._timers.schedule(client, client._lastActivity + IDLE_TIMEOUT)
         
-    def on_read(self, fd):
-        """Data to be read from a file descriptor."""
-        if self._sock.fileno() == fd:
-            self.on_accept()
-            return
-        for client in self._clients:
-            if client._sock.fileno() == fd:
-                ret = client.on_read()
-                if not ret:
-                    self._clients.remove(client)
-                return
-    def on_write(self, fd):
-        """File descriptor ready for write"""
-        for client in self._clients:
-            if client.fildno() == fd:
-                ret = client.on_write()
-                if not ret:
-                    self._clients.remove(client)
+    def on_read(self, sock):
+        """Data to be read from a socket."""
+        if sock in self._listeners:
+            self.on_accept(sock)
+            return
+        if sock is self._wakeupSock:
+            try:
+                while self._wakeupSock.recv(4096):
+                    pass
+            except OSError:
+                pass
+            return
+        if sock is self._doorbell:
+            self.on_doorbell()
+            return
+        client = self._clients.get(sock, None)
+        if client is not None and not client.on_read():
+            self.removeClient(client)
+
+    def getDoorbellPort(self):
+        """Returns the UDP port on which clients ring their shared memory doorbell."""
+        if self._doorbell is None:
+            self._doorbell = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._doorbell.bind(("127.0.0.1", 0))
+            self._doorbell.setblocking(False)
+        return self._doorbell.getsockname()[1]
+
+    def registerRing(self, client):
+        """Returns a new doorbell token for a client's ring."""
+        token = secrets.randbits(63)
+        while token in self._rings:
+            token = secrets.randbits(63)
+        self._rings[token] = client
+        return token
+
+    def unregisterRing(self, token):
+        self._rings.pop(token, None)
+
+    def on_doorbell(self):
+        """Drains the rings whose doorbell has been rung."""
+        while True:
+            try:
+                data = self._doorbell.recv(64)
+            except OSError:
                 return
+            if len(data) != _doorbellToken.size:
+                continue
+            client = self._rings.get(_doorbellToken.unpack(data)[0], None)
+            if client is not None:
+                client.drainRing()
+
+    def drainRings(self):
+        """Consumes pending ring records, in case a doorbell was missed."""
+        for client in list(self._rings.values()):
+            client.drainRing()
+
+    def on_write(self, sock):
+        """Socket ready for write"""
+        client = self._clients.get(sock, None)
+        if client is not None and not client.on_write():
+            self.removeClient(client)
+
+    def checkSlowClients(self):
+        """Disconnects clients which stopped consuming their output."""
+        now = time.monotonic()
+        for client in list(self._clients.values()):
+            if client.isStalled(now):
+                log.info(f"Client({client._clientName}): too slow, disconnecting ({client._outSize} bytes pending)")
+                self.removeClient(client)
+
+    def checkIdleClients(self):
+        """Pings idle clients and reaps the ones which did not answer."""
+        now = time.monotonic()
+        for client in self._timers.advance(now):
+            deadline = client.on_timer(now)
+            if deadline is None:
+                log.info(f"Client({client._clientName}): not responding, disconnecting")
+                self.removeClient(client)
+            else:
+                self._timers.schedule(client, deadline)
+
+    def removeClient(self, client):
+        """Closes a client connection and forgets about it."""
+        self._clients.pop(client._sock, None)
+        self._timers.cancel(client)
+        client.terminate()
+        if client._service is not None:
+            self._dirtyServices.discard(client._service)
+            self.unregisterService(client._service)
+            client._service = None
+
+    def registerService(self, service):
+        """Makes a client's service available to the global plugin.
+
+        The global plugin changes its service list in the main thread, later
+        on: this thread must not touch it."""
+        self._gp.registerService(service)
+
+    def unregisterService(self, service):
+        """Removes a client's service from the global plugin, in its main thread."""
+        self._gp.unregisterService(service)
 
 class Client:
-    """Holds a TCP Client session"""
+    """Holds a client session, over TCP or a local socket"""
     _sock = None
     _service = None
     _gp = None
-    out_buf = bytes()
-    in_buf = bytes()
+    # req_id of the request being handled, echoed in the messages sent meanwhile
+    _reqId = None
+    # Whether message compression can be negotiated on this transport
+    _compressionSupported = True
 
     def __init__(self, server, sock, addr):
         self._sock = sock
         self._server = server
         self._gp = self._server._gp
-        self._clientName = f"{addr[0]}, {self._sock.fileno()}"
-        
+        if isinstance(addr, tuple):
+            self._clientName = f"{addr[0]}, {self._sock.fileno()}"
+        else:
+            self._clientName = f"unix, {self._sock.fileno()}"
+        self.in_buf = bytes()
+        # Message framing and negotiated compression
+        self._codec = netcodec.Codec()
+        # Pending output, as a queue of encoded chunks flushed with sendmsg().
+        self._outQueue = collections.deque()
+        self._outSize = 0
+        self._congestedSince = None
+        self.droppedEvents = 0
+        # Heartbeat state
+        self._lastActivity = time.monotonic()
+        self._pingSentAt = None
+        self._pingId = 0
+        # Input waiting to be handled, as (OpEntry, message, size, parse time) tuples.
+        self._pending = collections.deque()
+        self._limiter = RateLimiter(server._rateLimits)
+        self.handled = collections.Counter()
+        self.throttled = collections.Counter()
+        self._headThrottled = False
+        # Shared memory ring
+        self._ring = None
+        self._ringToken = None
+        self.ringUpdates = 0
+        # Pushed events
+        self._subscriptions = set()
+        self._eventSeq = 0
+        self._closed = False
+        self._closing = False
+
+    def terminate(self):
+        """Closes the connection and discards pending output."""
+        self._closed = True
+        self.closeRing()
+        self._outQueue.clear()
+        self._outSize = 0
+        try:
+            self._sock.close()
+        except OSError:
+            pass
 
     def on_read(self):
         """Read data from socket"""
         try:
-            data = self._sock.recv()
-            self.in_buf.append(data.decode("utf-8"))
-            self.parse()
+            data = self._sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return True
         except Exception as ex:
-            log.info(f"Client({self._sock.fileno()}): Error reading/ parsing data: {ex}")
+            log.info(f"Client({self._clientName}): Error reading data: {ex}")
+            return False
+        if not data:
+            log.info(f"Client({self._clientName}): connection closed")
+            return False
+        self._lastActivity = time.monotonic()
+        if self._closing:
+            return True
+        try:
+            self.feed(data)
+        except Exception as ex:
+            log.info(f"Client({self._clientName}): Error parsing data: {ex}")
             return False
         return True
 
+    def feed(self, data):
+        """Handles data received from the socket"""
+        self.in_buf += data
+        self.parse()
+
+    def closeAfterFlush(self):
+        """Stops reading and closes the connection once pending output is written."""
+        self._closing = True
+
+    def wantsRead(self):
+        """Returns False while too many received messages wait to be handled."""
+        return not self._closing and len(self._pending) < MAX_PENDING_MESSAGES
+
+    def hasPendingInput(self):
+        """Returns True if received messages wait to be handled."""
+        return len(self._pending) > 0
+
+    def throttleDelay(self, now):
+        """Seconds until the next pending message may be handled, or None."""
+        if not self._pending:
+            return None
+        entry, jsdata, size, parseTime = self._pending[0]
+        return self._limiter.delay(entry.opClass, size, now)
+
+    def process(self, budget, now):
+        """Handles up to budget pending messages, in order, within rate limits.
+
+        Returns the number of messages handled."""
+        count = 0
+        while self._pending and count < budget and not self._closing:
+            entry, jsdata, size, parseTime = self._pending[0]
+            opClass = entry.opClass
+            if not self._limiter.allow(opClass, size, now):
+                if not self._headThrottled:
+                    self._headThrottled = True
+                    self.throttled[opClass] += 1
+                break
+            self._headThrottled = False
+            self._pending.popleft()
+            self.handled[opClass] += 1
+            self.decode(entry, jsdata, parseTime)
+            count += 1
+        return count
+
+    def getStats(self):
+        """Returns this client's counters."""
+        return {"pending": len(self._pending),
+                "handled": dict(self.handled),
+                "throttled": dict(self.throttled),
+                "droppedEvents": self.droppedEvents,
+                "ringUpdates": self.ringUpdates,
+                "outputBytes": self._outSize}
+
+    def hasPendingOutput(self):
+        """Returns True if some output is waiting to be written."""
+        return self._outSize > 0 or self._closing
+
+    def isCongested(self):
+        """Returns True when the pending output exceeds the high-water mark."""
+        return self._outSize > OUT_HIGH_WATER
+
+    def isStalled(self, now):
+        """Returns True if this client should be dropped for not reading its output."""
+        if self._outSize > OUT_HARD_LIMIT:
+            return True
+        if self._outSize <= OUT_HIGH_WATER:
+            self._congestedSince = None
+            return False
+        if self._congestedSince is None:
+            self._congestedSince = now
+            return False
+        return now - self._congestedSince > OUT_STALL_TIMEOUT
+
+    def on_timer(self, now):
+        """Heartbeat check.
+
+        Returns the next deadline for this client, or None if it should be
+        reaped."""
+        if self._pingSentAt is not None and self._lastActivity < self._pingSentAt:
+            if now - self._pingSentAt >= HEARTBEAT_TIMEOUT:
+                return None
+            return self._pingSentAt + HEARTBEAT_TIMEOUT
+        self._pingSentAt = None
+        if now - self._lastActivity < IDLE_TIMEOUT:
+            return self._lastActivity + IDLE_TIMEOUT
+        self._pingId += 1
+        self._pingSentAt = now
+        self.sendHeartbeat()
+        return now + HEARTBEAT_TIMEOUT
+
+    def sendHeartbeat(self):
+        """Sends a ping the client has to answer"""
+        self.send("0", {"time": time.time(),
+                        "ping_id": f"server-{self._pingId}"})
+
     def on_write(self):
         """Data to be written to the socket"""
-        if self.out_buf:
-            try:
-                ret = self._sock.send(bytes(self.out_buf, "utf-8"))
-                if ret == len(self.out_buf):
-                    self.out_buf = ""
-                    return True
-                if ret > 0:
-                    self.out_buf = self.out_buf[ret:]
-                    return True
-                log.info(f"Client({self._sock.fileno()}): Cannot write data")
-                return False
-            except Exception as ex:
-                log.info(f"Client({self._sock.fileno()}): Cannot write: {ex}")
+        if not self._outQueue:
+            return not self._closing
+        chunks = list(itertools.islice(self._outQueue, OUT_MAX_CHUNKS))
+        try:
+            if _HAS_SENDMSG:
+                ret = self._sock.sendmsg(chunks)
+            else:
+                ret = self._sock.send(b"".join(chunks))
+        except (BlockingIOError, InterruptedError):
+            return True
+        except Exception as ex:
+            log.info(f"Client({self._clientName}): Cannot write: {ex}")
             return False
+        if ret <= 0:
+            log.info(f"Client({self._clientName}): Cannot write data")
+            return False
+        self._consume(ret)
         return True
 
+    def _consume(self, count):
+        """Drops the first count bytes from the output queue."""
+        self._outSize -= count
+        while count > 0:
+            chunk = self._outQueue[0]
+            size = len(chunk)
+            if count >= size:
+                self._outQueue.popleft()
+                count -= size
+            else:
+                # Keep the unsent tail without copying it.
+                self._outQueue[0] = memoryview(chunk)[count:]
+                count = 0
+
+    def _enqueue(self, chunk):
+        """Appends an encoded chunk to the output queue."""
+        self._outQueue.append(chunk)
+        self._outSize += len(chunk)
+
     def parse(self):
-        """Extracts a JSON and parses it"""
-        if self.in_buf:
-            for line in self.in_buf.split("\n"):
-                try:
-                    data = json.loads(line)
-                    self.decode(data)
-                except Exception as ex:
-                    log.info(f"Client({self._sock.fileno()}): Unable to decode JsÝON data {line}: {ex}")
-    def decode(self, data):
-        """Handles a client request"""
+        """Extracts complete messages from the input buffer and queues them
+
+        Messages are JSON lines, or compressed frames once compression has
+        been negotiated."""
+        buf = self.in_buf
+        pos = 0
+        while True:
+            line, pos = self._codec.unframe(buf, pos)
+            if line is None:
+                break
+            self.queueMessage(line)
+        self.in_buf = buf[pos:]
+
+    def queueMessage(self, line):
+        """Parses one JSON message and queues it for handling"""
+        if not line.strip():
+            return
+        start = time.perf_counter()
         try:
-            jsdata = json.loads(data)
-            op = jsdata.get("op", "unknown_operation")
-            method = f"on_{self._ops.get(op, 'unknown_operation')}"
-            attr = getattr(self, method, None)
-            if attr:
-                return attr(jsdata)
-            else:
-                log.info(f"{method}: No such method")
+            data = json.loads(line)
+        except ValueError as ex:
+            log.info(f"Client({self._clientName}): Unable to decode JSON data {line}: {ex}")
+            self.reject(None, None, "invalid JSON")
+            return
+        parseTime = time.perf_counter() - start
+        op = data.get("op", None) if isinstance(data, dict) else None
+        entry = OP_TABLE.get(op, None) if isinstance(op, str) else None
+        if entry is None:
+            self._reqId = _requestId(data)
+            try:
+                self.reject(None, op, "unknown op")
+            finally:
+                self._reqId = None
+            return
+        self._pending.append((entry, data, len(line), parseTime))
+
+    def enableCompression(self, algorithm):
+        """Starts compressing large messages in both directions"""
+        self._codec.enableCompression(algorithm)
+
+    def decode(self, entry, jsdata, parseTime=0.0):
+        """Validates and handles a client request"""
+        stats = self._server.opStats[entry.name]
+        stats.count += 1
+        stats.parseTime += parseTime
+        start = time.perf_counter()
+        error = entry.validate(jsdata)
+        handlerStart = time.perf_counter()
+        stats.validateTime += handlerStart - start
+        self._reqId = _requestId(jsdata)
+        try:
+            if error is not None:
+                self.reject(entry, entry.code, error)
+                return False
+            if entry.handler is None:
+                self.reject(entry, entry.code, "unsupported op")
+                return False
+            return entry.handler(self, jsdata)
         except Exception as ex:
-            log.info("Unable to parse payload {data}: {ex}")
+            log.info(f"Client({self._clientName}): {entry.method} failed on {jsdata}: {ex}")
+            self.send(entry.code, {"status": "error",
+                                   "error": "internal error"})
+        finally:
+            self._reqId = None
+            stats.handleTime += time.perf_counter() - handlerStart
         return False
 
+    def reject(self, entry, op, error):
+        """Answers a malformed or unknown request with an error"""
+        if entry is not None:
+            self._server.opStats[entry.name].rejected += 1
+        else:
+            self._server.opStats["invalid"].rejected += 1
+        self.send(op if isinstance(op, str) else "unknown",
+                  {"status": "error", "error": error})
 
     def send(self, code, payload):
-        """Sends the given payload to the client"""
+        """Sends the given payload to the client.
+
+        While a request is handled, its req_id is added to what is sent."""
         data = {"op": code}
-        data.extend(payload)
-        self._outbuf += json.dumps(data) + "\n"
+        if self._reqId is not None:
+            data["req_id"] = self._reqId
+        data.update(payload)
+        self._enqueue(self.frameMessage(json.dumps(data).encode("utf-8")))
+
+    def frameMessage(self, encoded):
+        """Returns the bytes carrying an encoded message on the wire"""
+        return self._codec.frame(encoded)
+
+    def sendEvent(self, code, payload):
+        """Sends an event to the client unless its output is congested.
+
+        Returns False if the event has been dropped."""
+        if self.isCongested():
+            self.droppedEvents += 1
+            return False
+        self.send(code, payload)
+        return True
 
     def on_ping(self, jsdata):
         """Answers to a ping command"""
-        self._outbuf += json.dumps({"op": "0",
-                                    "time": time.time(),
-                                    "pong_id": jsdata.get("ping_id", "not_provided")})
+        if "pong_id" in jsdata:
+            # Answer to a server ping: receiving it already counts as activity.
+            return
+        self.send("0", {"time": time.time(),
+                        "pong_id": jsdata.get("ping_id", "not_provided")})
         
                                    
+    def on_subscribe(self, jsdata):
+        """Subscribes to pushed events"""
+        codes = self._eventCodes(jsdata.get("events", []))
+        if codes is None:
+            self.send("10", {"status": "error",
+                             "error": "Unknown event"})
+            return
+        self._subscriptions.update(codes)
+        self.send("10", {"status": "ok",
+                         "events": sorted(events.toString(c) for c in self._subscriptions)})
+
+    def on_unsubscribe(self, jsdata):
+        """Cancels event subscriptions"""
+        codes = self._eventCodes(jsdata.get("events", []))
+        if codes is None:
+            self.send("11", {"status": "error",
+                             "error": "Unknown event"})
+            return
+        self._subscriptions.difference_update(codes)
+        self.send("11", {"status": "ok",
+                         "events": sorted(events.toString(c) for c in self._subscriptions)})
+
+    def _eventCodes(self, names):
+        """Converts event names to codes, or returns None if one is not subscribable."""
+        if not isinstance(names, list):
+            return None
+        codes = set()
+        for name in names:
+            if not isinstance(name, str):
+                return None
+            code = events.fromString(name)
+            if code not in SUBSCRIBABLE_EVENTS:
+                return None
+            codes.add(code)
+        return codes
+
+    def handleServiceEvent(self, evt):
+        """Handles an event the global plugin posted to this client's service.
+
+        The service answers from its menus, then the event is pushed to the
+        client."""
+        if self._service is not None:
+            self._service.handleEvent(evt)
+        self.pushEvent(evt)
+
+    def pushEvent(self, evt):
+        """Pushes an event to the client if it subscribed to it.
+
+        Every pushed event consumes a sequence number, even when dropped
+        because the client is congested, so that clients can detect gaps."""
+        code = evt.pop("event")
+        if self._closed or code not in self._subscriptions:
+            return
+        self._eventSeq += 1
+        self.sendEvent("12", {"event": events.toString(code),
+                              "seq": self._eventSeq,
+                              "data": evt})
+
+    def on_shmOpen(self, jsdata):
+        """Creates a shared memory ring the client publishes values into"""
+        if self._ring is not None:
+            self.send("13", {"status": "error",
+                             "error": "ring already open"})
+            return
+        size = jsdata.get("size", shmring.DEFAULT_CAPACITY)
+        token = self._server.registerRing(self)
+        try:
+            self._ring = shmring.RingBuffer.create(f"nvdaws-{os.getpid()}-{token:x}", size)
+        except (OSError, ValueError) as ex:
+            self._server.unregisterRing(token)
+            log.info(f"Client({self._clientName}): cannot create ring: {ex}")
+            self.send("13", {"status": "error",
+                             "error": "shared memory unavailable"})
+            return
+        self._ringToken = token
+        self._ring.setWaiting()
+        self.send("13", {"status": "ok",
+                         "name": self._ring.name,
+                         "capacity": self._ring.capacity,
+                         "doorbell": self._server.getDoorbellPort(),
+                         "token": token})
+
+    def on_shmClose(self, jsdata):
+        """Closes the client's shared memory ring"""
+        self.drainRing()
+        self.closeRing()
+        self.send("14", {"status": "ok"})
+
+    def closeRing(self):
+        if self._ring is None:
+            return
+        self._server.unregisterRing(self._ringToken)
+        self._ring.close()
+        self._ring = None
+        self._ringToken = None
+
+    def drainRing(self):
+        """Applies the latest values published in the ring"""
+        ring = self._ring
+        if ring is None or ring.isEmpty():
+            return
+        try:
+            updates = ring.readLatest()
+            ring.setWaiting()
+            # Catch records written before the producer could see the flag.
+            if not ring.isEmpty():
+                updates.update(ring.readLatest())
+        except ValueError as ex:
+            log.info(f"Client({self._clientName}): {ex}, closing ring")
+            self.closeRing()
+            return
+        self.ringUpdates += len(updates)
+        self.applyValues(updates)
+
+    def applyValues(self, updates):
+        """Renames the items designated by published values.
+
+        Keys are "<menu id>/<item id>" and values UTF-8 item names. Each
+        value is applied like a menuItemUpdate of the item's name, without a
+        reply; values for unknown items are ignored."""
+        service = self._service
+        if service is None:
+            return
+        for key, value in updates.items():
+            menuId, sep, itemId = key.partition("/")
+            menu = _lookupRingId(service.getRemoteMenu, menuId)
+            if menu is None:
+                continue
+            item = _lookupRingId(menu.get, itemId)
+            if item is None:
+                continue
+            try:
+                name = value.decode("utf-8")
+            except UnicodeDecodeError:
+                continue
+            menu.updateItem(item["id"], {"name": name})
+            service.menuChanged(menu)
+
     def on_identify(self, jsdata):
         """Performs client identification"""
         try:
@@ -202,20 +1202,404 @@ class Client:
                 self.send("1", {"status": "error",
                                 "error": "Invalid service name"})
                 return
-            new_service = NetService(service_name, service_display_name,
+            new_service = NetService(self, service_name, service_display_name,
                                      service_version, service_author)
+            log.info(f"Client({self._clientName}): identified as {new_service}")
+            if self._service is not None:
+                self._server._dirtyServices.discard(self._service)
+                self._server.unregisterService(self._service)
+            # Set first, so that the service is unregistered with the client whatever happens.
+            self._service = new_service
             self._server.registerService(new_service)
-            self.send("6", {"status": "ok"})
+            compression = None
+            accepted = jsdata.get("compression", [])
+            if isinstance(accepted, list) and self._compressionSupported:
+                compression = next((c for c in COMPRESSIONS if c in accepted), None)
+            if compression is not None and self._codec.compression is None:
+                # Announced uncompressed; compression applies to what follows.
+                self.send("1", {"status": "ok",
+                                "compression": compression,
+                                "threshold": COMPRESS_THRESHOLD})
+                self.enableCompression(compression)
+            else:
+                self.send("1", {"status": "ok",
+                                "compression": self._codec.compression})
             return
         except Exception as ex:
             log.error(f"Unable to parse identify command: {ex}")
+            self.send("1", {"status": "error",
+                            "error": "internal error"})
+
+    def on_logout(self, jsdata):
+        """Ends the session once the reply is written"""
+        self.send("2", {"status": "ok"})
+        self.closeAfterFlush()
+
+    def on_userNotification(self, jsdata):
+        """Queues a message to be spoken by NVDA.
+
+        The request is acknowledged as soon as the message is queued, not
+        once it has been spoken."""
+        service = self._menuService("9")
+        if service is None:
+            return
+        service.postUserNotification(jsdata["message"])
+        self.send("9", {"status": "ok"})
+
+    def _menuService(self, code):
+        """Returns the client's service, or answers with an error if it did not identify"""
+        if self._service is None:
+            self.send(code, {"status": "error",
+                             "error": "Not identified"})
+        return self._service
+
+    def _remoteMenu(self, code, menuId):
+        """Returns a menu of the client's service, or answers with an error"""
+        service = self._menuService(code)
+        if service is None:
+            return None
+        menu = service.getRemoteMenu(menuId)
+        if menu is None:
+            self.send(code, {"status": "error",
+                             "error": "Unknown menu"})
+        return menu
+
+    def on_menuAdd(self, jsdata):
+        """Adds a menu to the client's service"""
+        service = self._menuService("3")
+        if service is None:
+            return
+        if not service.addRemoteMenu(jsdata["id"], jsdata["name"]):
+            self.send("3", {"status": "error",
+                            "error": "Duplicate menu id"})
+            return
+        self.send("3", {"status": "ok"})
+
+    def on_menuDel(self, jsdata):
+        """Removes a menu and its items"""
+        service = self._menuService("4")
+        if service is None:
+            return
+        if not service.removeRemoteMenu(jsdata["id"]):
+            self.send("4", {"status": "error",
+                            "error": "Unknown menu"})
+            return
+        self.send("4", {"status": "ok"})
+
+    def on_menuUpdate(self, jsdata):
+        """Renames a menu"""
+        service = self._menuService("5")
+        if service is None:
+            return
+        if "name" in jsdata and not service.renameRemoteMenu(jsdata["id"], jsdata["name"]):
+            self.send("5", {"status": "error",
+                            "error": "Unknown menu"})
+            return
+        self.send("5", {"status": "ok"})
+
+    def on_menuItemAdd(self, jsdata):
+        """Adds an item to a menu, at the end or at the given position"""
+        menu = self._remoteMenu("6", jsdata["menu"])
+        if menu is None:
+            return
+        if menu.get(jsdata["id"]) is not None:
             self.send("6", {"status": "error",
-                            "message": "internal error"})
+                            "error": "Duplicate item id"})
+            return
+        item = {"id": jsdata["id"], "name": jsdata["name"]}
+        if "action" in jsdata:
+            item["action"] = jsdata["action"]
+            item["actionData"] = jsdata.get("actionData", {})
+        position = menu.addItem(item, jsdata.get("position", None))
+        self._service.menuChanged(menu)
+        self.send("6", {"status": "ok",
+                        "position": position,
+                        "version": menu.version})
+
+    def on_menuItemDel(self, jsdata):
+        """Removes an item from a menu"""
+        menu = self._remoteMenu("7", jsdata["menu"])
+        if menu is None:
+            return
+        if menu.get(jsdata["id"]) is None:
+            self.send("7", {"status": "error",
+                            "error": "Unknown item"})
+            return
+        position = menu.removeItem(jsdata["id"])
+        self._service.menuChanged(menu)
+        self.send("7", {"status": "ok",
+                        "position": position,
+                        "version": menu.version})
+
+    def on_menuItemUpdate(self, jsdata):
+        """Changes the name or the action of an item"""
+        menu = self._remoteMenu("8", jsdata["menu"])
+        if menu is None:
+            return
+        if menu.get(jsdata["id"]) is None:
+            self.send("8", {"status": "error",
+                            "error": "Unknown item"})
+            return
+        fields = {key: jsdata[key] for key in ("name", "action", "actionData") if key in jsdata}
+        position = menu.updateItem(jsdata["id"], fields)
+        self._service.menuChanged(menu)
+        self.send("8", {"status": "ok",
+                        "position": position,
+                        "version": menu.version})
+
+class WebSocketClient(Client):
+    """Client session over a WebSocket connection.
+
+    The upgrade request is answered by the server itself, then messages are
+    carried in text frames, one JSON message per frame. Received data is fed
+    to the websocket package's frame_buffer, which frames are read from.
+    """
+    _compressionSupported = False
+
+    def __init__(self, server, sock, addr):
+        super().__init__(server, sock, addr)
+        self._clientName = f"ws {self._clientName}"
+        self._upgraded = False
+        self._frames = frame_buffer(self._recvFrameData, False, max_length=MAX_MESSAGE_SIZE)
+        self._cont = continuous_frame(False, False, MAX_MESSAGE_SIZE)
+
+    def _recvFrameData(self, bufsize):
+        """recv() function of the frame_buffer: received data is fed to it,
+        so it only runs out of data"""
+        raise BlockingIOError
+
+    def feed(self, data):
+        """Handles data received from the socket"""
+        if not self._upgraded:
+            self.in_buf += data
+            end = self.in_buf.find(b"\r\n\r\n")
+            if end < 0:
+                if len(self.in_buf) > WS_MAX_HANDSHAKE:
+                    self.refuseUpgrade(431, "Request Header Fields Too Large")
+                return
+            request = self.in_buf[:end]
+            data = self.in_buf[end + 4:]
+            self.in_buf = bytes()
+            if not self.upgrade(request) or not data:
+                return
+        self._frames.feed(data)
+        self.readFrames()
+
+    def upgrade(self, request):
+        """Answers the WebSocket upgrade request. Returns True on success."""
+        try:
+            lines = request.decode("latin-1").split("\r\n")
+            method, path, version = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        except ValueError:
+            self.refuseUpgrade(400, "Bad Request")
+            return False
+        connection = [v.strip().lower() for v in headers.get("connection", "").split(",")]
+        key = headers.get("sec-websocket-key", None)
+        if (method != "GET" or headers.get("upgrade", "").lower() != "websocket"
+                or "upgrade" not in connection or key is None):
+            self.refuseUpgrade(400, "Bad Request")
+            return False
+        if headers.get("sec-websocket-version", None) != "13":
+            self.refuseUpgrade(426, "Upgrade Required", "Sec-WebSocket-Version: 13\r\n")
+            return False
+        origin = headers.get("origin", None)
+        if origin is not None and not _originAllowed(origin):
+            log.info(f"Client({self._clientName}): WebSocket origin {origin} refused")
+            self.refuseUpgrade(403, "Forbidden")
+            return False
+        self._enqueue(("HTTP/1.1 101 Switching Protocols\r\n"
+                       "Upgrade: websocket\r\n"
+                       "Connection: Upgrade\r\n"
+                       f"Sec-WebSocket-Accept: {_create_accept_key(key)}\r\n"
+                       "\r\n").encode("latin-1"))
+        self._upgraded = True
+        return True
+
+    def refuseUpgrade(self, status, reason, extraHeaders=""):
+        self._enqueue((f"HTTP/1.1 {status} {reason}\r\n"
+                       f"{extraHeaders}"
+                       "Content-Length: 0\r\n"
+                       "Connection: close\r\n"
+                       "\r\n").encode("latin-1"))
+        self.closeAfterFlush()
+
+    def readFrames(self):
+        """Handles all complete frames received so far"""
+        while not self._closing:
+            try:
+                frame = self._frames.recv_frame()
+            except BlockingIOError:
+                return
+            except WebSocketMessageTooBigException:
+                self.close(1009)
+                return
+            except WebSocketException as ex:
+                log.info(f"Client({self._clientName}): invalid frame: {ex}")
+                self.close(1002)
+                return
+            if not frame.mask:
+                # RFC 6455 section 5.1: clients must mask their frames.
+                self.close(1002)
+                return
+            if frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY, ABNF.OPCODE_CONT):
+                try:
+                    self._cont.validate(frame)
+                    self._cont.add(frame)
+                    if self._cont.is_fire(frame):
+                        opcode, message = self._cont.extract(frame)
+                        self.queueMessage(message.data)
+                except WebSocketMessageTooBigException:
+                    self.close(1009)
+                    return
+                except WebSocketException as ex:
+                    log.info(f"Client({self._clientName}): invalid message: {ex}")
+                    self.close(1007)
+                    return
+            elif frame.opcode == ABNF.OPCODE_PING:
+                self._enqueue(ABNF(1, 0, 0, 0, ABNF.OPCODE_PONG, 0, frame.data).format())
+            elif frame.opcode == ABNF.OPCODE_CLOSE:
+                self._enqueue(ABNF(1, 0, 0, 0, ABNF.OPCODE_CLOSE, 0, frame.data[:2]).format())
+                self.closeAfterFlush()
+
+    def close(self, status):
+        """Sends a close frame with the given status, then disconnects"""
+        self._enqueue(ABNF(1, 0, 0, 0, ABNF.OPCODE_CLOSE, 0, struct.pack("!H", status)).format())
+        self.closeAfterFlush()
+
+    def frameMessage(self, encoded):
+        """Carries an encoded message in an unmasked text frame"""
+        return ABNF(1, 0, 0, 0, ABNF.OPCODE_TEXT, 0, encoded).format()
+
+    def sendHeartbeat(self):
+        """Uses a ping frame, which browsers answer on their own"""
+        self._enqueue(ABNF(1, 0, 0, 0, ABNF.OPCODE_PING, 0, f"server-{self._pingId}".encode("utf-8")).format())
+
+
+# Client subclasses share the handlers of Client.
+OP_TABLE = {code: OpEntry(code, spec, Client) for code, spec in NET_OPS.items()}
+
+
+class ClientEventQueue:
+    """Input queue of a NetService.
+
+    Events the global plugin posts to the service are handed over to the
+    server thread, which pushes them to the client's connection.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def put(self, data):
+        evt = dict(data)
+        evt["client"] = self._client
+        self._client._server.postEvent(evt)
+
 
 class NetService(service.Service):
-    def __init__(self, name, display_name, author, version):
+    """Service registered by a remote client.
+
+    It has no thread of its own: its input events are forwarded to the
+    client through a ClientEventQueue, and handled in the server thread.
+
+    Menus sent by the client are kept in menustore.Menu objects, by
+    client-supplied id. Item changes are posted to the global plugin in
+    batches, as MENU_ITEMS_CHANGED events, instead of whole item lists.
+    """
+
+    def __init__(self, client, name, display_name, version, author):
         super().__init__(name, display_name)
+        self._client = client
         self._author = author
         self._version = version
+        self._inqueue = ClientEventQueue(client)
+        self._remoteMenus = {}
+        # Menus changed since the last flush, by id
+        self._changedMenus = {}
+        self._menuListChanged = False
+        self.enable()
 
-        
+    def terminate(self):
+        self._should_quit = True
+
+    def getRemoteMenu(self, menuId):
+        return self._remoteMenus.get(menuId, None)
+
+    def addRemoteMenu(self, menuId, name):
+        """Adds an empty menu. Returns False if the id is already used."""
+        if menuId in self._remoteMenus:
+            return False
+        self._remoteMenus[menuId] = menustore.Menu(menuId, name)
+        self._menuList.append((menuId, name))
+        self._listChanged()
+        return True
+
+    def removeRemoteMenu(self, menuId):
+        """Removes a menu. Returns False if it does not exist."""
+        if self._remoteMenus.pop(menuId, None) is None:
+            return False
+        self._changedMenus.pop(menuId, None)
+        self._menuList = [entry for entry in self._menuList if entry[0] != menuId]
+        self._listChanged()
+        return True
+
+    def renameRemoteMenu(self, menuId, name):
+        """Renames a menu. Returns False if it does not exist."""
+        menu = self._remoteMenus.get(menuId, None)
+        if menu is None:
+            return False
+        menu.name = name
+        self._menuList = [(entry[0], name if entry[0] == menuId else entry[1])
+                          for entry in self._menuList]
+        self._listChanged()
+        return True
+
+    def _listChanged(self):
+        self._menuListChanged = True
+        self._client._server.menuChanged(self)
+
+    def menuChanged(self, menu):
+        """Schedules the posting of a menu's item changes."""
+        self._changedMenus[menu.id] = menu
+        self._client._server.menuChanged(self)
+
+    def flushChanges(self):
+        """Posts the menu list and item changes made since the last flush."""
+        if self._menuListChanged:
+            self._menuListChanged = False
+            self.postMenuUpdate()
+        changed = self._changedMenus
+        self._changedMenus = {}
+        for menu in changed.values():
+            delta = menu.takeChanges()
+            if delta is not None:
+                delta["event"] = events.MENU_ITEMS_CHANGED
+                self.postEvent(delta)
+
+    #
+    ## Input events, handled in the server thread
+    #
+
+    def on_menu_get_items(self, event, args):
+        """Posts the whole content of a menu"""
+        menu = self._remoteMenus.get(args.get("id", None), None)
+        if menu is None:
+            return
+        # Pending changes come first, so that later ones apply to this snapshot.
+        self.flushChanges()
+        self.postMenuItemsList(menu.snapshot())
+
+    def on_menu_activate(self, event, args):
+        """Resolves the activated item, so that the client receives its id and action"""
+        menu = self._remoteMenus.get(args.get("menuId", None), None)
+        itemIdx = args.get("itemIdx", -1)
+        if menu is None or not 0 <= itemIdx < len(menu):
+            return
+        item = menu.itemAt(itemIdx)
+        args["itemId"] = item["id"]
+        for key in ("action", "actionData"):
+            if key in item:
+                args[key] = item[key]
@@ -27,6 +27,11 @@ class Service(threading.Thread):
         self._name = name
         self._display_name = display_name
         self._config = params
+        # Per-instance state: class-level defaults would be shared by all services.
+        self._inqueue = queue.Queue()
+        self._outqueue = queue.Queue()
+        self._menus = {}
+        self._menuList = []
 
     def __str__(self):
         """Service's display name"""
@@ -55,6 +60,13 @@ class Service(threading.Thread):
         """Gets en avent from the input queue and handles it."""
         try:
             data = self._inqueue.get_nowait()
+        except queue.Empty:
+            return
+        self.handleEvent(data)
+
+    def handleEvent(self, data):
+        """Handles an event posted by the global plugin."""
+        try:
             code = data["event"]
             if code == events.QUIT:
                 self.should_quit = True
@@ -65,8 +77,6 @@ class Service(threading.Thread):
                     attr(code, data)
                 else:
                     self.postLog(f"Unhandled event {events.toString(code)}: {data}")
-        except queue.Empty:
-            pass
         except Exception as ex:
             self.postLog(f"Failed to handle event: {ex}")
 
@@ -133,7 +143,7 @@ class Service(threading.Thread):
 
     def postMenuUpdate(self):
         """Menu list has been updated"""
-        self.postEvent({"event": events.MENU_UPDATE, "menus": self._menuList})
+        self.postEvent({"event": events.MENU_UPDATE, "menus": list(self._menuList)})
 
     def postMenuItemsList(self, items):
         """Items has been updated for a given menu"""
@@ -145,8 +155,12 @@ class Service(threading.Thread):
     ## Input events
     #
 
-    def on_menu_update(self, params=None):
+    def on_menu_update(self, event, params=None):
         """Asked by the global plugin to retrieve available menus"""
         self.postMenuUpdate()
 
+    def on_service_focus(self, event, params=None):
+        """The user moved to or away from this service"""
+        pass
+
 
@@ -17,6 +17,7 @@ import api
 import config
 import wx
 
+import dnscache
 import events
 import service
 
@@ -134,7 +135,7 @@ class Service(service.Service):
                 req.data = json.dumps(data).encode("utf-8")
                 req.add_header("Content-Type", "application/json")
 
-            with urllib.request.urlopen(req, timeout=30) as response:
+            with dnscache.urlopen(req, timeout=30) as response:
                 return json.loads(response.read().decode("utf-8"))
         except urllib.error.HTTPError as ex:
             if ex.code == 401:
@@ -253,7 +254,7 @@ class Service(service.Service):
 
         try:
             req = urllib.request.Request(OAUTH_DEVICE_CODE_URL, data=data, headers=headers)
-            with urllib.request.urlopen(req, timeout=30) as response:
+            with dnscache.urlopen(req, timeout=30) as response:
                 result = json.loads(response.read().decode("utf-8"))
 
             self._oauthDeviceCode = result.get("device_code")
@@ -315,7 +316,7 @@ class Service(service.Service):
 
         try:
             req = urllib.request.Request(OAUTH_ACCESS_TOKEN_URL, data=data, headers=headers)
-            with urllib.request.urlopen(req, timeout=30) as response:
+            with dnscache.urlopen(req, timeout=30) as response:
                 result = json.loads(response.read().decode("utf-8"))
 
             error = result.get("error")
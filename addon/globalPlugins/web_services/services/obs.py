@@ -112,7 +112,7 @@ class Service(service.Service):
 
     def try_connect(self):
         try:
-            self._socket = websocket.create_connection("ws://localhost:4455/")
+            self._socket = websocket.create_connection("ws://localhost:4455/", permessage_deflate=True)
             self._socket.settimeout(0.5)
         except Exception as ex:
             return None
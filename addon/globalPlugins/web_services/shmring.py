@@ -0,0 +1,211 @@
+#shmring.py
+#
+# Single-producer single-consumer ring buffer in shared memory, used by
+# co-located netservice clients to publish high-frequency key/value updates
+# without a socket write per update.
+#
+# Layout (little-endian):
+#   0   u64 head: total bytes written by the producer
+#   8   u64 tail: total bytes consumed by the consumer
+#   16  u32 waiting: set by the consumer before it sleeps on the doorbell
+#   20  u32 capacity of the data area
+#   64  data area, records aligned on 8 bytes
+# Record: u32 size, u16 key size, key (UTF-8), value. A size of WRAP means
+# the rest of the data area is unused and the next record is at its start.
+#
+# The producer only writes head and the consumer only writes tail. Each side
+# writes its data before publishing its index. The consumer sets waiting and
+# the producer clears it when it rings the doorbell.
+
+import mmap
+import os
+import struct
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+HEADER_SIZE = 64
+DEFAULT_CAPACITY = 256 * 1024
+MAX_CAPACITY = 16 * 1024 * 1024
+WRAP = 0xFFFFFFFF
+
+# Names of the blocks created by this process.
+_created = set()
+
+_index = struct.Struct("<Q")
+_flag = struct.Struct("<I")
+_recordHeader = struct.Struct("<IH")
+_HEAD = 0
+_TAIL = 8
+_WAITING = 16
+_CAPACITY = 20
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+class SharedBlock:
+    """A named block of shared memory.
+
+    Uses multiprocessing.shared_memory when available, and named mappings of
+    the paging file on Windows otherwise."""
+
+    def __init__(self, name, size, create):
+        self.name = name
+        self.size = size
+        self._shm = None
+        self._mmap = None
+        self._owner = create
+        if shared_memory is not None:
+            if create:
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+                _created.add(name)
+            else:
+                self._shm = _attachSharedMemory(name)
+            self.buf = self._shm.buf
+        elif os.name == "nt":
+            self._mmap = mmap.mmap(-1, size, tagname=name)
+            self.buf = memoryview(self._mmap)
+        else:
+            raise OSError("shared memory is not supported on this platform")
+
+    def close(self):
+        """Unmaps the block, and destroys it if this side created it."""
+        self.buf.release()
+        if self._shm is not None:
+            self._shm.close()
+            if self._owner:
+                _created.discard(self.name)
+                try:
+                    self._shm.unlink()
+                except OSError:
+                    pass
+        if self._mmap is not None:
+            self._mmap.close()
+
+
+def _attachSharedMemory(name):
+    """Attaches to an existing block without letting this process destroy it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13, the resource tracker unlinks attached blocks on exit.
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name != "nt" and name not in _created:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class RingBuffer:
+    """SPSC ring buffer over a SharedBlock."""
+
+    def __init__(self, block, capacity=None):
+        self._block = block
+        self._buf = block.buf
+        if capacity is not None:
+            _index.pack_into(self._buf, _HEAD, 0)
+            _index.pack_into(self._buf, _TAIL, 0)
+            _flag.pack_into(self._buf, _WAITING, 0)
+            _flag.pack_into(self._buf, _CAPACITY, capacity)
+        self.capacity = _flag.unpack_from(self._buf, _CAPACITY)[0]
+        if self.capacity % 8 or HEADER_SIZE + self.capacity > len(self._buf):
+            raise ValueError(f"invalid ring capacity {self.capacity}")
+
+    @classmethod
+    def create(cls, name, capacity=DEFAULT_CAPACITY):
+        """Creates a new ring in a new shared block."""
+        capacity = _align(min(capacity, MAX_CAPACITY))
+        return cls(SharedBlock(name, HEADER_SIZE + capacity, True), capacity)
+
+    @classmethod
+    def attach(cls, name, capacity):
+        """Attaches to a ring created by another process."""
+        return cls(SharedBlock(name, HEADER_SIZE + capacity, False))
+
+    @property
+    def name(self):
+        return self._block.name
+
+    def close(self):
+        self._buf = None
+        self._block.close()
+
+    def _get(self, offset):
+        return _index.unpack_from(self._buf, offset)[0]
+
+    def isEmpty(self):
+        return self._get(_HEAD) == self._get(_TAIL)
+
+    # Producer side
+
+    def write(self, key, value):
+        """Appends a record. Returns False if the ring is full."""
+        keyData = key.encode("utf-8")
+        size = _recordHeader.size + len(keyData) + len(value)
+        need = _align(size)
+        if need > self.capacity:
+            raise ValueError(f"record too large ({size} bytes)")
+        head = self._get(_HEAD)
+        free = self.capacity - (head - self._get(_TAIL))
+        offset = head % self.capacity
+        if offset + need > self.capacity:
+            pad = self.capacity - offset
+            if free < pad + need:
+                return False
+            _flag.pack_into(self._buf, HEADER_SIZE + offset, WRAP)
+            head += pad
+            offset = 0
+        elif free < need:
+            return False
+        pos = HEADER_SIZE + offset
+        _recordHeader.pack_into(self._buf, pos, size, len(keyData))
+        pos += _recordHeader.size
+        self._buf[pos:pos + len(keyData)] = keyData
+        pos += len(keyData)
+        self._buf[pos:pos + len(value)] = value
+        _index.pack_into(self._buf, _HEAD, head + need)
+        return True
+
+    def consumerWaiting(self):
+        """Returns True, and clears the flag, if the consumer waits for a doorbell."""
+        if _flag.unpack_from(self._buf, _WAITING)[0]:
+            _flag.pack_into(self._buf, _WAITING, 0)
+            return True
+        return False
+
+    # Consumer side
+
+    def readLatest(self):
+        """Consumes all records and returns the latest value of each key."""
+        spans = {}
+        head = self._get(_HEAD)
+        tail = self._get(_TAIL)
+        buf = self._buf
+        if head - tail > self.capacity or tail > head:
+            raise ValueError("corrupted ring indexes")
+        while tail < head:
+            offset = tail % self.capacity
+            pos = HEADER_SIZE + offset
+            size = _flag.unpack_from(buf, pos)[0]
+            if size == WRAP:
+                tail += self.capacity - offset
+                continue
+            size, keySize = _recordHeader.unpack_from(buf, pos)
+            if size < _recordHeader.size + keySize or offset + size > self.capacity:
+                raise ValueError(f"corrupted ring record at {offset}")
+            start = pos + _recordHeader.size
+            key = bytes(buf[start:start + keySize])
+            spans[key] = (start + keySize, pos + size)
+            tail += _align(size)
+        # Only the surviving values are copied, before the space is released.
+        latest = {key.decode("utf-8"): bytes(buf[start:end]) for key, (start, end) in spans.items()}
+        _index.pack_into(buf, _TAIL, tail)
+        return latest
+
+    def setWaiting(self):
+        """Asks the producer to ring the doorbell on its next write."""
+        _flag.pack_into(self._buf, _WAITING, 1)
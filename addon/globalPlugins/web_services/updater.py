@@ -12,6 +12,8 @@ import urllib
 import json
 import os
 
+import dnscache
+
 class ExtensionUpdater(threading.Thread):
     quit = False
     queue = queue.Queue()
@@ -26,7 +28,7 @@ class ExtensionUpdater(threading.Thread):
             if time.time() - self.lastCheck < UPDATE_CHECK_INTERVAL:
                 continue
             try:
-                res = urllib.request.urlopen("http://www.mtyp.fr/nvda")
+                res = dnscache.urlopen("http://www.mtyp.fr/nvda")
                 data = res.read()
                 packet = json.loads(data)
                 mod = packet.get(ADDON_NAME, None)
@@ -80,7 +82,7 @@ class ExtensionUpdater(threading.Thread):
         tmp = os.path.join(config.getUserDefaultConfigPath(), ADDON_NAME + ".nvda-addon")
         try:
             f = open(tmp, "wb")
-            res = urllib.request.urlopen(mod["url"])
+            res = dnscache.urlopen(mod["url"])
             f.write(res.read())
             f.close()
         except Exception as ex:
@@ -17,10 +17,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 from ._abnf import *
-from ._app import WebSocketApp, setReconnect
+from ._app import WebSocketApp, MultiplexDispatcher, setReconnect
+from ._async import *
 from ._core import *
 from ._exceptions import *
 from ._logging import *
+from ._metrics import *
 from ._socket import *
 
 __version__ = "1.5.2"
@@ -1,10 +1,9 @@
-import array
 import os
 import struct
 import sys
 
 from ._exceptions import *
-from ._utils import validate_utf8
+from ._utils import Utf8Validator, validate_utf8
 from threading import Lock
 
 """
@@ -27,24 +26,108 @@ limitations under the License.
 """
 
 try:
-    # If wsaccel is available, use compiled routines to mask data.
-    # wsaccel only provides around a 10% speed boost compared
-    # to the websocket-client _mask() implementation.
-    # Note that wsaccel is unmaintained.
+    # If wsaccel is available, its compiled routine masks payloads of any
+    # size; it is the first choice. Note that wsaccel is unmaintained.
     from wsaccel.xormask import XorMaskerSimple
+except ImportError:
+    XorMaskerSimple = None
 
-    def _mask(_m, _d) -> bytes:
-        return XorMaskerSimple(_m).process(_d)
-
+try:
+    # Otherwise, if NumPy is available, large payloads are masked 8 bytes
+    # at a time.
+    import numpy
 except ImportError:
-    # wsaccel is not available, use websocket-client _mask()
-    native_byteorder = sys.byteorder
+    numpy = None
+
+native_byteorder = sys.byteorder
+
+# Payloads shorter than this are masked as one big integer; the other paths
+# have a higher fixed cost.
+_MASK_INT_MAX = 1024
+# The pure Python path masks larger payloads by chunks of this size (a
+# multiple of 4), so temporary copies stay small.
+_MASK_CHUNK = 65536
+# bytes.translate() tables XORing every byte with a given key byte, built
+# on first use.
+_xor_tables = [None] * 256
+
+
+def _xor_table(key: int) -> bytes:
+    table = _xor_tables[key]
+    if table is None:
+        table = _xor_tables[key] = bytes(b ^ key for b in range(256))
+    return table
+
+
+def _mask_wsaccel(mask_key: bytes, data) -> bytes:
+    return XorMaskerSimple(mask_key).process(data)
+
+
+def _mask_int(mask_key: bytes, data) -> bytes:
+    datalen = len(data)
+    data_value = int.from_bytes(data, native_byteorder)
+    mask_value = int.from_bytes(mask_key * (datalen // 4) + mask_key[: datalen % 4], native_byteorder)
+    return (data_value ^ mask_value).to_bytes(datalen, native_byteorder)
+
+
+def _mask_lanes(tables: list, chunk: bytearray) -> None:
+    # Byte i of each 4 bytes group is XORed with mask byte i.
+    for i in range(4):
+        chunk[i::4] = chunk[i::4].translate(tables[i])
+
+
+def _mask_python(mask_key: bytes, data) -> bytes:
+    tables = [_xor_table(key) for key in mask_key]
+    chunks = []
+    with memoryview(data) as view:
+        for start in range(0, len(view), _MASK_CHUNK):
+            chunk = bytearray(view[start:start + _MASK_CHUNK])
+            _mask_lanes(tables, chunk)
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _mask_python_inplace(mask_key: bytes, buffer) -> None:
+    tables = [_xor_table(key) for key in mask_key]
+    if isinstance(buffer, bytearray) and len(buffer) <= _MASK_CHUNK:
+        _mask_lanes(tables, buffer)
+        return
+    # Extended slices of a memoryview are slow to assign: chunks are masked
+    # in a bytearray, then copied back.
+    with memoryview(buffer) as view:
+        for start in range(0, len(view), _MASK_CHUNK):
+            chunk = bytearray(view[start:start + _MASK_CHUNK])
+            _mask_lanes(tables, chunk)
+            view[start:start + len(chunk)] = chunk
+
+
+def _mask_numpy_array(mask_key: bytes, src, dst) -> None:
+    # XORing 8 bytes words with the key repeated twice is the same
+    # whatever the byte order.
+    words = len(src) // 8 * 8
+    key = numpy.frombuffer(mask_key * 2, numpy.uint64)
+    numpy.bitwise_xor(src[:words].view(numpy.uint64), key, out=dst[:words].view(numpy.uint64))
+    if words < len(src):
+        tail = numpy.frombuffer(mask_key * 2, numpy.uint8)[:len(src) - words]
+        numpy.bitwise_xor(src[words:], tail, out=dst[words:])
+
+
+def _mask_numpy(mask_key: bytes, data) -> bytes:
+    src = numpy.frombuffer(data, numpy.uint8)
+    dst = numpy.empty(len(src), numpy.uint8)
+    _mask_numpy_array(mask_key, src, dst)
+    return dst.tobytes()
+
 
-    def _mask(mask_value: int, data_value: int) -> bytes:
-        datalen = len(data_value)
-        data_value = int.from_bytes(data_value, native_byteorder)
-        mask_value = int.from_bytes(mask_value * (datalen // 4) + mask_value[: datalen % 4], native_byteorder)
-        return (data_value ^ mask_value).to_bytes(datalen, native_byteorder)
+def _mask_numpy_inplace(mask_key: bytes, buffer) -> None:
+    array_ = numpy.frombuffer(buffer, numpy.uint8)
+    _mask_numpy_array(mask_key, array_, array_)
+
+
+def _mask_key(mask_key) -> bytes:
+    if isinstance(mask_key, str):
+        return mask_key.encode('latin-1')
+    return bytes(mask_key)
 
 
 __all__ = [
@@ -96,6 +179,17 @@ VALID_CLOSE_STATUS = (
     STATUS_BAD_GATEWAY,
 )
 
+# Extended payload lengths of frame headers.
+_length16 = struct.Struct("!H")
+_length64 = struct.Struct("!Q")
+# Frame headers: flags and opcode, mask bit and length, extended length.
+_header7 = struct.Struct("!BB")
+_header16 = struct.Struct("!BBH")
+_header64 = struct.Struct("!BBQ")
+# Unmasked payloads at least this long are not copied by format_into():
+# they are sent from their own buffer.
+_FORMAT_COPY_MAX = 4096
+
 
 class ABNF:
     """
@@ -147,15 +241,19 @@ class ABNF:
         self.data = data
         self.get_mask_key = os.urandom
 
-    def validate(self, skip_utf8_validation: bool = False) -> None:
+    def validate(self, skip_utf8_validation: bool = False, allow_rsv1: bool = False) -> None:
         """
         Validate the ABNF frame.
 
         Parameters
         ----------
         skip_utf8_validation: skip utf8 validation.
+        allow_rsv1: accept RSV1 on the first frame of data messages, which
+            marks compressed messages when permessage-deflate is in use.
         """
-        if self.rsv1 or self.rsv2 or self.rsv3:
+        if self.rsv2 or self.rsv3:
+            raise WebSocketProtocolException("rsv is not implemented, yet")
+        if self.rsv1 and not (allow_rsv1 and self.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY)):
             raise WebSocketProtocolException("rsv is not implemented, yet")
 
         if self.opcode not in ABNF.OPCODES:
@@ -211,31 +309,72 @@ class ABNF:
         """
         Format this object to string(byte array) to send data to server.
         """
-        if any(x not in (0, 1) for x in [self.fin, self.rsv1, self.rsv2, self.rsv3]):
+        frame_header = self._header(len(self.data))
+
+        if not self.mask:
+            return frame_header + self.data
+        else:
+            mask_key = self.get_mask_key(4)
+            return frame_header + self._get_masked(mask_key)
+
+    def format_into(self, buffer: bytearray, copy: bool = True):
+        """
+        Append this frame, formatted, to buffer. The payload is masked in
+        buffer rather than in a temporary copy.
+
+        Parameters
+        ----------
+        buffer: bytearray
+            buffer to append the frame to.
+        copy: bool
+            If False, unmasked payloads of at least 4 KB are not appended:
+            they are returned, to be sent after buffer.
+
+        Returns the payload to send after buffer, or None.
+        """
+        data = self.data
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        buffer += self._header(len(data))
+
+        if not self.mask:
+            if not copy and len(data) >= _FORMAT_COPY_MAX:
+                return data
+            buffer += data
+            return None
+
+        mask_key = _mask_key(self.get_mask_key(4))
+        buffer += mask_key
+        if XorMaskerSimple is not None:
+            buffer += _mask_wsaccel(mask_key, data)
+            return None
+        if len(data) < _MASK_INT_MAX:
+            buffer += _mask_int(mask_key, data)
+            return None
+        start = len(buffer)
+        buffer += data
+        with memoryview(buffer) as view, view[start:] as payload:
+            if numpy is not None:
+                _mask_numpy_inplace(mask_key, payload)
+            else:
+                _mask_python_inplace(mask_key, payload)
+        return None
+
+    def _header(self, length: int) -> bytes:
+        if self.fin | self.rsv1 | self.rsv2 | self.rsv3 not in (0, 1):
             raise ValueError("not 0 or 1")
         if self.opcode not in ABNF.OPCODES:
             raise ValueError("Invalid OPCODE")
-        length = len(self.data)
         if length >= ABNF.LENGTH_63:
             raise ValueError("data is too long")
 
-        frame_header = chr(self.fin << 7 |
-                           self.rsv1 << 6 | self.rsv2 << 5 | self.rsv3 << 4 |
-                           self.opcode).encode('latin-1')
+        flags = self.fin << 7 | self.rsv1 << 6 | self.rsv2 << 5 | self.rsv3 << 4 | self.opcode
         if length < ABNF.LENGTH_7:
-            frame_header += chr(self.mask << 7 | length).encode('latin-1')
+            return _header7.pack(flags, self.mask << 7 | length)
         elif length < ABNF.LENGTH_16:
-            frame_header += chr(self.mask << 7 | 0x7e).encode('latin-1')
-            frame_header += struct.pack("!H", length)
+            return _header16.pack(flags, self.mask << 7 | 0x7e, length)
         else:
-            frame_header += chr(self.mask << 7 | 0x7f).encode('latin-1')
-            frame_header += struct.pack("!Q", length)
-
-        if not self.mask:
-            return frame_header + self.data
-        else:
-            mask_key = self.get_mask_key(4)
-            return frame_header + self._get_masked(mask_key)
+            return _header64.pack(flags, self.mask << 7 | 0x7f, length)
 
     def _get_masked(self, mask_key: bytes) -> bytes:
         s = ABNF.mask(mask_key, self.data)
@@ -254,31 +393,74 @@ class ABNF:
         ----------
         mask_key: bytes or str
             4 byte mask.
-        data: bytes or str
+        data: bytes, bytearray, memoryview or str
             data to mask/unmask.
         """
         if data is None:
             data = ""
 
-        if isinstance(mask_key, str):
-            mask_key = mask_key.encode('latin-1')
+        mask_key = _mask_key(mask_key)
 
         if isinstance(data, str):
             data = data.encode('latin-1')
 
-        return _mask(array.array("B", mask_key), array.array("B", data))
+        if XorMaskerSimple is not None:
+            return _mask_wsaccel(mask_key, data)
+        if len(data) < _MASK_INT_MAX:
+            return _mask_int(mask_key, data)
+        if numpy is not None:
+            return _mask_numpy(mask_key, data)
+        return _mask_python(mask_key, data)
+
+    @staticmethod
+    def mask_inplace(mask_key: bytes, buffer: bytearray) -> None:
+        """
+        Mask or unmask data in place, without copying it.
+
+        Parameters
+        ----------
+        mask_key: bytes or str
+            4 byte mask.
+        buffer: bytearray or writable memoryview
+            data to mask/unmask.
+        """
+        mask_key = _mask_key(mask_key)
+
+        if XorMaskerSimple is not None:
+            buffer[:] = _mask_wsaccel(mask_key, buffer)
+        elif len(buffer) < _MASK_INT_MAX:
+            buffer[:] = _mask_int(mask_key, buffer)
+        elif numpy is not None:
+            _mask_numpy_inplace(mask_key, buffer)
+        else:
+            _mask_python_inplace(mask_key, buffer)
 
 
 class frame_buffer:
     _HEADER_MASK_INDEX = 5
     _HEADER_LENGTH_INDEX = 6
-
-    def __init__(self, recv_fn: int, skip_utf8_validation: bool) -> None:
+    # Room made for each recv_into() call: small frames following each other
+    # are read together.
+    _RECV_SIZE = 65536
+    # Larger buffers are released once they have been consumed.
+    _MAX_IDLE_BUFFER = 4 * 1024 * 1024
+
+    def __init__(self, recv_fn: int, skip_utf8_validation: bool, recv_into_fn=None,
+                 max_length: int = None) -> None:
         self.recv = recv_fn
+        self.recv_into = recv_into_fn
         self.skip_utf8_validation = skip_utf8_validation
+        # Frames announcing a longer payload raise
+        # WebSocketMessageTooBigException before it is read.
+        self.max_length = max_length
+        # Set once permessage-deflate has been negotiated.
+        self.allow_rsv1 = False
         # Buffers over the packets from the layer beneath until desired amount
-        # bytes of bytes are received.
-        self.recv_buffer = []
+        # bytes of bytes are received: the pending bytes are
+        # recv_buffer[start:end], the rest of recv_buffer is free space.
+        self.recv_buffer = bytearray()
+        self.start = 0
+        self.end = 0
         self.clear()
         self.lock = Lock()
 
@@ -291,14 +473,15 @@ class frame_buffer:
         return self.header is None
 
     def recv_header(self) -> None:
-        header = self.recv_strict(2)
-        b1 = header[0]
+        self._fill(2)
+        b1 = self.recv_buffer[self.start]
+        b2 = self.recv_buffer[self.start + 1]
+        self._skip(2)
         fin = b1 >> 7 & 1
         rsv1 = b1 >> 6 & 1
         rsv2 = b1 >> 5 & 1
         rsv3 = b1 >> 4 & 1
         opcode = b1 & 0xf
-        b2 = header[1]
         has_mask = b2 >> 7 & 1
         length_bits = b2 & 0x7f
 
@@ -316,11 +499,13 @@ class frame_buffer:
         bits = self.header[frame_buffer._HEADER_LENGTH_INDEX]
         length_bits = bits & 0x7f
         if length_bits == 0x7e:
-            v = self.recv_strict(2)
-            self.length = struct.unpack("!H", v)[0]
+            self._fill(2)
+            self.length = _length16.unpack_from(self.recv_buffer, self.start)[0]
+            self._skip(2)
         elif length_bits == 0x7f:
-            v = self.recv_strict(8)
-            self.length = struct.unpack("!Q", v)[0]
+            self._fill(8)
+            self.length = _length64.unpack_from(self.recv_buffer, self.start)[0]
+            self._skip(8)
         else:
             self.length = length_bits
 
@@ -342,6 +527,9 @@ class frame_buffer:
             if self.has_received_length():
                 self.recv_length()
             length = self.length
+            if self.max_length is not None and length > self.max_length:
+                raise WebSocketMessageTooBigException(
+                    "Frame of {length} bytes, larger than {size} bytes".format(length=length, size=self.max_length))
 
             # Mask
             if self.has_received_mask():
@@ -349,48 +537,161 @@ class frame_buffer:
             mask = self.mask
 
             # Payload
-            payload = self.recv_strict(length)
             if has_mask:
-                payload = ABNF.mask(mask, payload)
+                payload = self.recv_masked(length, mask)
+            else:
+                payload = self.recv_strict(length)
 
             # Reset for next frame
             self.clear()
 
             frame = ABNF(fin, rsv1, rsv2, rsv3, opcode, has_mask, payload)
-            frame.validate(self.skip_utf8_validation)
+            frame.validate(self.skip_utf8_validation, self.allow_rsv1)
 
         return frame
 
-    def recv_strict(self, bufsize: int) -> bytes:
-        shortage = bufsize - sum(map(len, self.recv_buffer))
-        while shortage > 0:
-            # Limit buffer size that we pass to socket.recv() to avoid
-            # fragmenting the heap -- the number of bytes recv() actually
-            # reads is limited by socket buffer and is relatively small,
-            # yet passing large numbers repeatedly causes lots of large
-            # buffers allocated and then shrunk, which results in
-            # fragmentation.
-            bytes_ = self.recv(min(16384, shortage))
-            self.recv_buffer.append(bytes_)
-            shortage -= len(bytes_)
-
-        unified = b"".join(self.recv_buffer)
-
-        if shortage == 0:
-            self.recv_buffer = []
-            return unified
+    def feed(self, data: bytes) -> None:
+        """
+        Append received data, for callers which push data to the buffer
+        instead of letting it call recv_fn.
+        """
+        self._reserve(len(data))
+        self.recv_buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def pending(self) -> int:
+        """
+        Number of received bytes not consumed yet.
+        """
+        return self.end - self.start
+
+    def has_frame(self) -> bool:
+        """
+        Whether a whole frame is pending, so that recv_frame() returns it
+        without reading from the socket.
+        """
+        pending = self.end - self.start
+        offset = 0
+        if self.header is None:
+            if pending < 2:
+                return False
+            b2 = self.recv_buffer[self.start + 1]
+            has_mask = b2 >> 7 & 1
+            length_bits = b2 & 0x7f
+            offset = 2
         else:
-            self.recv_buffer = [unified[bufsize:]]
-            return unified[:bufsize]
+            has_mask = self.header[frame_buffer._HEADER_MASK_INDEX]
+            length_bits = self.header[frame_buffer._HEADER_LENGTH_INDEX] & 0x7f
+        length = self.length
+        if length is None:
+            if length_bits == 0x7e:
+                if pending < offset + 2:
+                    return False
+                length = _length16.unpack_from(self.recv_buffer, self.start + offset)[0]
+                offset += 2
+            elif length_bits == 0x7f:
+                if pending < offset + 8:
+                    return False
+                length = _length64.unpack_from(self.recv_buffer, self.start + offset)[0]
+                offset += 8
+            else:
+                length = length_bits
+        if self.mask is None and has_mask:
+            offset += 4
+        return pending >= offset + length
+
+    def recv_strict(self, bufsize: int) -> bytes:
+        self._fill(bufsize)
+        with memoryview(self.recv_buffer) as view:
+            data = view[self.start:self.start + bufsize].tobytes()
+        self._skip(bufsize)
+        return data
+
+    def recv_masked(self, bufsize: int, mask_key: bytes) -> bytes:
+        """
+        Like recv_strict, unmasking the data while copying it out of the buffer.
+        """
+        self._fill(bufsize)
+        with memoryview(self.recv_buffer) as view:
+            data = ABNF.mask(mask_key, view[self.start:self.start + bufsize])
+        self._skip(bufsize)
+        return data
+
+    def _skip(self, size: int) -> None:
+        self.start += size
+        if self.start == self.end:
+            # Everything has been consumed: reuse the buffer from its start.
+            self.start = self.end = 0
+            if len(self.recv_buffer) > self._MAX_IDLE_BUFFER:
+                self.recv_buffer = bytearray()
+
+    def _reserve(self, size: int) -> None:
+        """
+        Make room for size more bytes after the pending ones.
+        """
+        if len(self.recv_buffer) - self.end >= size:
+            return
+        pending = self.end - self.start
+        buffer = self.recv_buffer
+        if pending + size > len(buffer):
+            buffer = bytearray(max(pending + size, 4 * self._RECV_SIZE))
+        with memoryview(self.recv_buffer) as view:
+            # Move the pending bytes to the front.
+            buffer[:pending] = view[self.start:self.end]
+        self.recv_buffer = buffer
+        self.start = 0
+        self.end = pending
+
+    def _fill(self, size: int) -> None:
+        """
+        Receive until at least size bytes are pending.
+        """
+        shortage = size - (self.end - self.start)
+        if shortage <= 0:
+            return
+        if self.recv_into is None:
+            while shortage > 0:
+                # Limit buffer size that we pass to socket.recv() to avoid
+                # fragmenting the heap -- the number of bytes recv() actually
+                # reads is limited by socket buffer and is relatively small,
+                # yet passing large numbers repeatedly causes lots of large
+                # buffers allocated and then shrunk, which results in
+                # fragmentation.
+                bytes_ = self.recv(min(16384, shortage))
+                self.feed(bytes_)
+                shortage -= len(bytes_)
+            return
+        self._reserve(max(shortage, self._RECV_SIZE))
+        with memoryview(self.recv_buffer) as view:
+            while shortage > 0:
+                received = self.recv_into(view[self.end:])
+                self.end += received
+                shortage -= received
 
 
 class continuous_frame:
 
-    def __init__(self, fire_cont_frame: bool, skip_utf8_validation: bool) -> None:
+    def __init__(self, fire_cont_frame: bool, skip_utf8_validation: bool,
+                 max_message_size: int = None, on_fragment=None) -> None:
         self.fire_cont_frame = fire_cont_frame
         self.skip_utf8_validation = skip_utf8_validation
+        # Opcode and list of the fragments received, joined by extract().
         self.cont_data = None
         self.recving_frames = None
+        # Larger messages raise WebSocketMessageTooBigException as soon as
+        # the fragment going over the limit arrives. None allows any size.
+        self.max_message_size = max_message_size
+        self.message_size = 0
+        # If set, called as on_fragment(opcode, data, fin) with each fragment
+        # of the data messages instead of reassembling them: is_fire() is
+        # then never true.
+        self.on_fragment = on_fragment
+        # PerMessageDeflate of the connection, if negotiated.
+        self.deflate = None
+        self.compressed = False
+        # Text messages are validated fragment by fragment.
+        self.utf8_validator = Utf8Validator()
+        self.validating = False
 
     def validate(self, frame: ABNF) -> None:
         if not self.recving_frames and frame.opcode == ABNF.OPCODE_CONT:
@@ -400,25 +701,66 @@ class continuous_frame:
             raise WebSocketProtocolException("Illegal frame")
 
     def add(self, frame: ABNF) -> None:
-        if self.cont_data:
-            self.cont_data[1] += frame.data
+        if frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+            self.compressed = bool(frame.rsv1)
+            self.validating = frame.opcode == ABNF.OPCODE_TEXT and not self.skip_utf8_validation
+            if self.validating:
+                self.utf8_validator.reset()
+            self.message_size = 0
+        if self.compressed:
+            # Each fragment is inflated as it arrives; the flag only marks
+            # the first frame of a compressed message.
+            max_length = 0
+            if self.max_message_size is not None:
+                max_length = max(self.max_message_size - self.message_size, 1)
+            try:
+                frame.data = self.deflate.decompress(frame.data, frame.fin, max_length)
+            except WebSocketMessageTooBigException:
+                self.reset()
+                raise
+            frame.rsv1 = 0
+            if frame.fin:
+                self.compressed = False
+        self.message_size += len(frame.data)
+        if self.max_message_size is not None and self.message_size > self.max_message_size:
+            self.reset()
+            raise WebSocketMessageTooBigException(
+                "Message larger than {size} bytes".format(size=self.max_message_size))
+        if self.validating:
+            if not self.utf8_validator.validate(frame.data, frame.fin):
+                self.reset()
+                raise WebSocketPayloadException(
+                    "cannot decode: " + repr(frame.data))
+            if frame.fin:
+                self.validating = False
+
+        if frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+            self.recving_frames = frame.opcode
+        if self.on_fragment is not None:
+            self.on_fragment(self.recving_frames, frame.data, frame.fin)
+        elif self.cont_data:
+            # Joined once by extract(): adding them up is quadratic.
+            self.cont_data[1].append(frame.data)
         else:
-            if frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
-                self.recving_frames = frame.opcode
-            self.cont_data = [frame.opcode, frame.data]
+            self.cont_data = [frame.opcode, [frame.data]]
 
         if frame.fin:
             self.recving_frames = None
 
+    def reset(self) -> None:
+        """
+        Drops the message being received.
+        """
+        self.cont_data = None
+        self.recving_frames = None
+        self.compressed = False
+        self.validating = False
+
     def is_fire(self, frame: ABNF) -> bool or int:
-        return frame.fin or self.fire_cont_frame
+        return self.on_fragment is None and (frame.fin or self.fire_cont_frame)
 
     def extract(self, frame: ABNF) -> list:
-        data = self.cont_data
+        opcode, fragments = self.cont_data
         self.cont_data = None
-        frame.data = data[1]
-        if not self.fire_cont_frame and data[0] == ABNF.OPCODE_TEXT and not self.skip_utf8_validation and not validate_utf8(frame.data):
-            raise WebSocketPayloadException(
-                "cannot decode: " + repr(frame.data))
-
-        return [data[0], frame]
+        frame.data = fragments[0] if len(fragments) == 1 else b"".join(fragments)
+        return [opcode, frame]
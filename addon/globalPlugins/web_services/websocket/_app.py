@@ -1,4 +1,6 @@
+import heapq
 import inspect
+import itertools
 import selectors
 import sys
 import threading
@@ -13,6 +15,7 @@ from ._abnf import ABNF
 from ._url import parse_url
 from ._core import WebSocket, getdefaulttimeout
 from ._exceptions import *
+from ._metrics import connection_metrics
 
 """
 _app.py
@@ -33,7 +36,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-__all__ = ["WebSocketApp"]
+__all__ = ["WebSocketApp", "MultiplexDispatcher"]
 
 RECONNECT = 0
 
@@ -130,9 +133,181 @@ class WrappedDispatcher:
         self.timeout(seconds, reconnector)
 
 
+class MultiplexDispatcher:
+    """
+    Dispatcher running any number of WebSocketApp connections from one
+    thread: a selector watches their sockets and a heap holds their timers
+    (pings, ping timeout checks and reconnections). Pass it to run_forever
+    once started:
+
+    >>> dispatcher = MultiplexDispatcher()
+    >>> dispatcher.start()
+    >>> app.run_forever(dispatcher=dispatcher, ping_interval=10, reconnect=5)
+
+    run_forever then returns as soon as it is connected, and the callbacks
+    of the app run in the dispatcher thread. Receiving a message and
+    reconnecting block that thread, and so every connection, as long as
+    they would block the thread of run_forever otherwise.
+    """
+
+    def __init__(self) -> None:
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        # (deadline, sequence, seconds, callback), earliest first.
+        self.timers = []
+        self.sequence = itertools.count()
+        # Sockets and read callbacks given by other threads, registered by
+        # the dispatcher thread.
+        self.pending = []
+        self.wakeup, self.waker = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self.waker.setblocking(False)
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        self.running = False
+        self.thread = None
+
+    def read(self, sock: socket, callback: Callable) -> None:
+        """
+        Calls callback whenever sock is readable, until it returns False or
+        sock is closed.
+        """
+        with self.lock:
+            self.pending.append((sock, callback))
+        self._wake()
+
+    def timeout(self, seconds: int or float, callback: Callable) -> None:
+        """
+        Calls callback in seconds, then every seconds while it returns True.
+        """
+        with self.lock:
+            heapq.heappush(self.timers, (time.monotonic() + seconds, next(self.sequence), seconds, callback))
+        self._wake()
+
+    def signal(self, sig: int, callback: Callable) -> None:
+        """
+        Signals are left to the application: only the main thread can
+        handle them.
+        """
+        pass
+
+    def abort(self) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Runs dispatch() in a daemon thread.
+        """
+        self.thread = threading.Thread(target=self.dispatch, name="WebSocketDispatcher", daemon=True)
+        self.running = True
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        self._wake()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(3)
+
+    def close(self) -> None:
+        """
+        Stops the dispatcher and releases its selector. The sockets it
+        watched are left open.
+        """
+        self.stop()
+        self.selector.close()
+        self.wakeup.close()
+        self.waker.close()
+
+    def dispatch(self) -> None:
+        """
+        Watches the sockets and runs the timers until stop() is called.
+        """
+        self.running = True
+        while self.running:
+            with self.lock:
+                pending, self.pending = self.pending, []
+                timeout = None
+                if self.timers:
+                    timeout = max(0, self.timers[0][0] - time.monotonic())
+            for sock, callback in pending:
+                self._register(sock, callback)
+            self._unregister_closed()
+            try:
+                events = self.selector.select(timeout)
+            except OSError:
+                # A socket was closed while selected.
+                self._unregister_closed()
+                continue
+            for key, mask in events:
+                if key.fileobj is self.wakeup:
+                    try:
+                        while self.wakeup.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._read(key.fileobj, key.data)
+            self._run_timers()
+
+    def _wake(self) -> None:
+        try:
+            self.waker.send(b"\0")
+        except BlockingIOError:
+            # Already woken up.
+            pass
+
+    def _register(self, sock: socket, callback: Callable) -> None:
+        if sock.fileno() == -1:
+            return
+        try:
+            self.selector.register(sock, selectors.EVENT_READ, callback)
+        except KeyError:
+            self.selector.modify(sock, selectors.EVENT_READ, callback)
+
+    def _unregister(self, sock: socket) -> None:
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _unregister_closed(self) -> None:
+        for key in list(self.selector.get_map().values()):
+            if key.fileobj.fileno() == -1:
+                self._unregister(key.fileobj)
+
+    def _read(self, sock: socket, callback: Callable) -> None:
+        while True:
+            if not self._call(callback):
+                self._unregister(sock)
+                return
+            # Data already decrypted is not seen by the selector.
+            if sock.fileno() == -1 or not getattr(sock, "pending", None) or not sock.pending():
+                return
+
+    def _run_timers(self) -> None:
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                if not self.timers or self.timers[0][0] > now:
+                    return
+                deadline, sequence, seconds, callback = heapq.heappop(self.timers)
+            if self._call(callback):
+                with self.lock:
+                    heapq.heappush(self.timers, (time.monotonic() + seconds, next(self.sequence), seconds, callback))
+
+    def _call(self, callback: Callable) -> bool:
+        try:
+            return callback()
+        except Exception as e:
+            _logging.error("error from dispatcher callback {callback}: {err}".format(callback=callback, err=e))
+            return False
+
+
 class WebSocketApp:
     """
     Higher level of APIs are provided. The interface is like JavaScript WebSocket object.
+
+    The quality of the connection is measured in metrics, a
+    connection_metrics.
     """
 
     def __init__(self, url: str, header: list or dict = None,
@@ -142,7 +317,8 @@ class WebSocketApp:
                  keep_running: bool = True, get_mask_key: Callable = None, cookie: str = None,
                  subprotocols: list = None,
                  on_data: Callable = None,
-                 socket: socket = None) -> None:
+                 socket: socket = None,
+                 permessage_deflate: bool or dict = None) -> None:
         """
         WebSocketApp initialization
 
@@ -200,6 +376,8 @@ class WebSocketApp:
             List of available sub protocols. Default is None.
         socket: socket
             Pre-initialized stream socket.
+        permessage_deflate: bool or dict
+            Offer the permessage-deflate extension, see WebSocket.connect.
         """
         self.url = url
         self.header = header if header is not None else []
@@ -225,7 +403,10 @@ class WebSocketApp:
         self.ping_payload = ""
         self.subprotocols = subprotocols
         self.prepared_socket = socket
+        self.permessage_deflate = permessage_deflate
         self.has_errored = False
+        # Round trip times, message rates and reconnections.
+        self.metrics = connection_metrics()
 
     def send(self, data: str, opcode: int = ABNF.OPCODE_TEXT) -> None:
         """
@@ -243,6 +424,10 @@ class WebSocketApp:
         if not self.sock or self.sock.send(data, opcode) == 0:
             raise WebSocketConnectionClosedException(
                 "Connection is already closed.")
+        if isinstance(data, str) and not data.isascii():
+            self.metrics.message_sent(len(data.encode("utf-8")))
+        else:
+            self.metrics.message_sent(len(data))
 
     def close(self, **kwargs) -> None:
         """
@@ -253,9 +438,20 @@ class WebSocketApp:
             self.sock.close(**kwargs)
             self.sock = None
 
-    def _start_ping_thread(self) -> None:
+    def _start_ping_thread(self, dispatcher=None) -> None:
         self.last_ping_tm = self.last_pong_tm = 0
         self.stop_ping = threading.Event()
+        if dispatcher is not None:
+            # The dispatcher's timers send the pings instead of a thread.
+            stop_ping = self.stop_ping
+
+            def ping() -> bool:
+                if stop_ping.is_set() or not self.keep_running:
+                    return False
+                self._ping()
+                return True
+            dispatcher.timeout(self.ping_interval, ping)
+            return
         self.ping_thread = threading.Thread(target=self._send_ping)
         self.ping_thread.daemon = True
         self.ping_thread.start()
@@ -271,13 +467,16 @@ class WebSocketApp:
         if self.stop_ping.wait(self.ping_interval):
             return
         while not self.stop_ping.wait(self.ping_interval):
-            if self.sock:
-                self.last_ping_tm = time.time()
-                try:
-                    _logging.debug("Sending ping")
-                    self.sock.ping(self.ping_payload)
-                except Exception as e:
-                    _logging.debug("Failed to send ping: {err}".format(err=e))
+            self._ping()
+
+    def _ping(self) -> None:
+        if self.sock:
+            self.last_ping_tm = time.time()
+            try:
+                _logging.debug("Sending ping")
+                self.sock.ping(self.metrics.ping_sent(self.ping_payload))
+            except Exception as e:
+                _logging.debug("Failed to send ping: {err}".format(err=e))
 
     def run_forever(self, sockopt: tuple = None, sslopt: dict = None,
                     ping_interval: int or float = 0, ping_timeout: int or float = None,
@@ -308,7 +507,8 @@ class WebSocketApp:
         ping_timeout: int or float
             Timeout (in seconds) if the pong message is not received.
         ping_payload: str
-            Payload message to send with each ping.
+            Payload message to send with each ping, followed by a sequence
+            number matching pongs to pings.
         http_proxy_host: str
             HTTP proxy host name.
         http_proxy_port: int or str
@@ -402,21 +602,50 @@ class WebSocketApp:
                     http_proxy_port=http_proxy_port, http_no_proxy=http_no_proxy,
                     http_proxy_auth=http_proxy_auth, http_proxy_timeout=http_proxy_timeout,
                     subprotocols=self.subprotocols,
+                    permessage_deflate=self.permessage_deflate,
                     host=host, origin=origin, suppress_origin=suppress_origin,
                     proxy_type=proxy_type, socket=self.prepared_socket)
 
                 _logging.info("Websocket connected")
+                self.metrics.connected(self.sock.connect_attempts)
 
                 if self.ping_interval:
-                    self._start_ping_thread()
+                    self._start_ping_thread(dispatcher if custom_dispatcher else None)
 
                 self._callback(self.on_open)
 
-                dispatcher.read(self.sock.sock, read, check)
+                if custom_dispatcher:
+                    dispatcher.read(self.sock.sock, dispatched(read), dispatched(check))
+                else:
+                    dispatcher.read(self.sock.sock, read, check)
             except (WebSocketConnectionClosedException, ConnectionRefusedError, KeyboardInterrupt, SystemExit, Exception) as e:
                 handleDisconnect(e, reconnecting)
 
+        def dispatched(callback: Callable) -> Callable:
+            """
+            Wraps callback for a custom dispatcher, which runs it while the
+            current connection lasts and does not handle its errors.
+            """
+            sock = self.sock
+
+            def run() -> bool:
+                if self.sock is not sock:
+                    return False
+                try:
+                    return callback()
+                except Exception as e:
+                    return handleDisconnect(e)
+            return run
+
         def read() -> bool:
+            # Frames received along with the first one wait in the frame
+            # buffer, where the dispatcher's selector does not see them.
+            while readFrame():
+                if not self.sock or not self.sock.frame_buffer.has_frame():
+                    return True
+            return False
+
+        def readFrame() -> bool:
             if not self.keep_running:
                 return teardown()
 
@@ -434,14 +663,17 @@ class WebSocketApp:
                 self._callback(self.on_ping, frame.data)
             elif op_code == ABNF.OPCODE_PONG:
                 self.last_pong_tm = time.time()
+                self.metrics.pong_received(frame.data)
                 self._callback(self.on_pong, frame.data)
             elif op_code == ABNF.OPCODE_CONT and self.on_cont_message:
+                self.metrics.message_received(len(frame.data), frame.fin)
                 self._callback(self.on_data, frame.data,
                                frame.opcode, frame.fin)
                 self._callback(self.on_cont_message,
                                frame.data, frame.fin)
             else:
                 data = frame.data
+                self.metrics.message_received(len(data), frame.fin)
                 if op_code == ABNF.OPCODE_TEXT and not skip_utf8_validation:
                     data = data.decode("utf-8")
                 self._callback(self.on_data, data, frame.opcode, True)
@@ -464,6 +696,7 @@ class WebSocketApp:
         def handleDisconnect(e: Exception, reconnecting: bool = False) -> bool:
             self.has_errored = True
             self._stop_ping_thread()
+            self.metrics.disconnected()
             if not reconnecting:
                 self._callback(self.on_error, e)
 
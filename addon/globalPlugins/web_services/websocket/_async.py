@@ -0,0 +1,446 @@
+import asyncio
+import struct
+import sys
+import time
+
+from ._abnf import *
+from ._exceptions import *
+from ._handshake import SUCCESS_STATUSES, SUPPORTED_REDIRECT_STATUSES, _check_response, _get_handshake_headers
+from ._http import CONNECTION_ATTEMPT_DELAY, _ssl_context, _ssl_options, parse_headers
+from ._logging import *
+from ._url import parse_url
+
+"""
+_async.py
+websocket - WebSocket client library for Python
+
+Not part of upstream websocket-client: added to the copy of the package
+bundled with the NVDA Web Services add-on, under the same license as the
+rest of the package.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__all__ = ['AsyncWebSocket', 'create_async_connection']
+
+# Largest handshake response accepted, in bytes.
+MAX_RESPONSE_HEADER = 65536
+# Bytes read from the stream at once.
+READ_SIZE = 65536
+
+
+class AsyncWebSocket:
+    """
+    WebSocket client for asyncio.
+
+    Frames are parsed and built by the same code as WebSocket. A task reads
+    them as they arrive, answers pings and queues messages for recv(), so
+    waiting for a message does not need timeouts.
+
+    >>> ws = await create_async_connection("ws://localhost:4455/")
+    >>> await ws.send("Hello, Server")
+    >>> async for message in ws:
+    ...     print(message)
+    >>> await ws.close()
+
+    Parameters
+    ----------
+    ping_interval: int or float
+        Send a ping every ping_interval seconds. 0 disables it.
+    ping_timeout: int or float
+        Close the connection if no pong answers a ping within ping_timeout
+        seconds. None waits forever.
+    ping_payload: str
+        Payload of the pings.
+    max_queue: int
+        Received messages waiting for recv(). Once reached, the socket is
+        not read until recv() takes one.
+    get_mask_key: func
+        A callable function to get new mask keys, see
+        WebSocket.set_mask_key.
+    skip_utf8_validation: bool
+        Skip utf8 validation.
+    max_message_size: int
+        Largest message accepted, in bytes. The connection is closed with
+        STATUS_MESSAGE_TOO_BIG when a larger one arrives. None accepts any
+        size.
+    on_fragment: func
+        Called as on_fragment(opcode, data, fin) with each fragment of the
+        text and binary messages, which are then not queued for recv().
+    """
+
+    def __init__(self, ping_interval=0, ping_timeout=None, ping_payload="", max_queue=64,
+                 get_mask_key=None, skip_utf8_validation=False, max_message_size=None,
+                 on_fragment=None):
+        if ping_timeout is not None and ping_timeout <= 0:
+            raise WebSocketException("Ensure ping_timeout > 0")
+        if ping_timeout and ping_interval and ping_interval <= ping_timeout:
+            raise WebSocketException("Ensure ping_interval > ping_timeout")
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.ping_payload = ping_payload
+        self.get_mask_key = get_mask_key
+        self.handshake_response = None
+        self.connected = False
+        # Status and reason of the close frame received from the server.
+        self.close_status = None
+        self.close_reason = None
+        self.last_ping_tm = 0
+        self.last_pong_tm = 0
+        self.frame_buffer = frame_buffer(self._recv_frame_data, skip_utf8_validation,
+                                         max_length=max_message_size)
+        self.cont_frame = continuous_frame(False, skip_utf8_validation, max_message_size, on_fragment)
+        self.deflate = None
+        self._max_queue = max_queue
+        self._messages = None
+        self._reader = None
+        self._writer = None
+        self._send_lock = None
+        self._closed = None
+        self._tasks = []
+        self._error = None
+        self._eof = False
+
+    @property
+    def subprotocol(self):
+        if self.handshake_response:
+            return self.handshake_response.subprotocol
+        return None
+
+    @property
+    def headers(self):
+        if self.handshake_response:
+            return self.handshake_response.headers
+        return None
+
+    async def connect(self, url, **options):
+        """
+        Connect to url, ie. ws://host:port/resource
+
+        Parameters
+        ----------
+        header, cookie, origin, connection, suppress_origin, host,
+        subprotocols, permessage_deflate:
+            see WebSocket.connect.
+        sslopt: dict
+            SSL options, as for WebSocket.
+        timeout: int or float
+            Time allowed to connect and complete the handshake, in seconds.
+            None waits forever.
+        redirect_limit: int
+            Number of redirects to follow.
+
+        Proxies are not supported: use WebSocket to go through one.
+        """
+        timeout = options.get("timeout")
+        for attempt in range(options.get("redirect_limit", 3) + 1):
+            try:
+                await asyncio.wait_for(self._open(url, options), timeout)
+            except asyncio.TimeoutError:
+                self._abort()
+                raise WebSocketTimeoutException("Handshake timed out")
+            except BaseException:
+                self._abort()
+                raise
+            if self.handshake_response.status not in SUPPORTED_REDIRECT_STATUSES:
+                break
+            url = self.handshake_response.headers["location"]
+            self._abort()
+        else:
+            raise WebSocketException("Too many redirects")
+
+        self.deflate = self.handshake_response.deflate
+        self.frame_buffer.allow_rsv1 = self.deflate is not None
+        self.cont_frame.deflate = self.deflate
+        self._messages = asyncio.Queue(self._max_queue)
+        self._send_lock = asyncio.Lock()
+        self._closed = asyncio.Event()
+        self._error = None
+        self._eof = False
+        self.connected = True
+        self._tasks = [asyncio.ensure_future(self._read_loop())]
+        if self.ping_interval:
+            self._tasks.append(asyncio.ensure_future(self._keepalive()))
+
+    async def _open(self, url, options):
+        hostname, port, resource, is_secure = parse_url(url)
+        context = None
+        server_hostname = None
+        if is_secure:
+            sslopt, server_hostname = _ssl_options(options.get("sslopt") or {}, hostname)
+            context = _ssl_context(sslopt)
+        connection_options = {}
+        if sys.version_info >= (3, 8):
+            # Staggered attempts, as WebSocket.connect() does.
+            connection_options = {"happy_eyeballs_delay": CONNECTION_ATTEMPT_DELAY, "interleave": 1}
+        self._reader, self._writer = await asyncio.open_connection(
+            hostname, port, ssl=context, server_hostname=server_hostname, limit=MAX_RESPONSE_HEADER,
+            **connection_options)
+
+        headers, key = _get_handshake_headers(resource, url, hostname, port, options)
+        header_str = "\r\n".join(headers)
+        self._writer.write(header_str.encode("utf-8"))
+        dump("request header", header_str)
+
+        try:
+            response = await self._reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            raise WebSocketConnectionClosedException("Connection to remote host was lost.")
+        except asyncio.LimitOverrunError:
+            raise WebSocketException("Handshake response header too large")
+        trace("--- response header ---")
+        lines = [line.strip() for line in response.decode("utf-8").split("\r\n") if line.strip()]
+        for line in lines:
+            trace(line)
+        trace("-----------------------")
+        status, resp, status_message = parse_headers(lines)
+        if status not in SUCCESS_STATUSES:
+            response_body = await self._reader.read(int(resp.get("content-length", 0)))
+            raise WebSocketBadStatusException("Handshake status {status} {message} -+-+- {headers} -+-+- {body}".format(status=status, message=status_message, headers=resp, body=response_body), status, status_message, resp, response_body)
+        self.handshake_response = _check_response(status, resp, key, options)
+
+    async def send(self, payload, opcode=ABNF.OPCODE_TEXT):
+        """
+        Send a message, see WebSocket.send. Returns once it has been handed
+        to the transport, waiting if its buffer is full.
+        """
+        frame = ABNF.create_frame(payload, opcode)
+        compress = self.deflate is not None and opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY) \
+            and len(frame.data) >= self.deflate.MIN_SIZE
+        return await self.send_frame(frame, compress)
+
+    async def send_binary(self, payload):
+        return await self.send(payload, ABNF.OPCODE_BINARY)
+
+    async def send_frame(self, frame, compress=False):
+        """
+        Send a frame, see WebSocket.send_frame.
+        """
+        if self._writer is None or self._writer.is_closing():
+            raise WebSocketConnectionClosedException("Connection is already closed.")
+        if self.get_mask_key:
+            frame.get_mask_key = self.get_mask_key
+        async with self._send_lock:
+            # Nothing is awaited between compressing and writing, so
+            # messages are written in the order they were compressed.
+            if compress:
+                data = frame.data
+                if isinstance(data, str):
+                    data = data.encode('latin-1')
+                frame.data = self.deflate.compress(data)
+                frame.rsv1 = 1
+            data = frame.format()
+            if isEnabledForTrace():
+                trace("++Sent raw: " + repr(data))
+                trace("++Sent decoded: " + frame.__str__())
+            self._writer.write(data)
+            await self._writer.drain()
+        return len(data)
+
+    async def ping(self, payload=""):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        await self.send(payload, ABNF.OPCODE_PING)
+
+    async def pong(self, payload=""):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        await self.send(payload, ABNF.OPCODE_PONG)
+
+    async def recv(self):
+        """
+        Wait for the next message: str for text, bytes for binary ones.
+
+        Raises WebSocketConnectionClosedException once the connection is
+        closed and all received messages have been returned, or the error
+        which broke the connection.
+        """
+        opcode, data = await self.recv_data()
+        if opcode == ABNF.OPCODE_TEXT:
+            return data.decode("utf-8")
+        return data
+
+    async def recv_data(self):
+        """
+        Wait for the next message. Returns its opcode and data.
+        """
+        if self._messages is None or self._eof:
+            self._raise_closed()
+        message = await self._messages.get()
+        if message is None:
+            self._eof = True
+            self._raise_closed()
+        return message
+
+    def _raise_closed(self):
+        if self._error is not None:
+            raise self._error
+        raise WebSocketConnectionClosedException("Connection is already closed.")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except WebSocketConnectionClosedException:
+            raise StopAsyncIteration
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self, status=STATUS_NORMAL, reason=b"", timeout=3):
+        """
+        Close the connection: send a close frame and wait up to timeout
+        seconds for the server's one.
+        """
+        if status < 0 or status >= ABNF.LENGTH_16:
+            raise ValueError("code is invalid range")
+        if self.connected:
+            self.connected = False
+            try:
+                await self.send(struct.pack('!H', status) + reason, ABNF.OPCODE_CLOSE)
+                await asyncio.wait_for(self._closed.wait(), timeout)
+            except (asyncio.TimeoutError, OSError, WebSocketException):
+                pass
+        self._abort()
+
+    def _abort(self):
+        current = asyncio.current_task() if hasattr(asyncio, "current_task") else asyncio.Task.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        self._tasks = []
+        if self._writer is not None:
+            self._writer.close()
+        self.connected = False
+
+    def _recv_frame_data(self, bufsize):
+        # Received data is fed to the frame_buffer: it only runs out of data.
+        raise BlockingIOError
+
+    async def _read_loop(self):
+        try:
+            while True:
+                data = await self._reader.read(READ_SIZE)
+                if not data:
+                    raise WebSocketConnectionClosedException("Connection to remote host was lost.")
+                self.frame_buffer.feed(data)
+                while True:
+                    try:
+                        frame = self.frame_buffer.recv_frame()
+                    except BlockingIOError:
+                        break
+                    if not await self._handle_frame(frame):
+                        return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._fail(e)
+
+    async def _handle_frame(self, frame):
+        """
+        Returns False once the close frame has been received.
+        """
+        if isEnabledForTrace():
+            trace("++Rcv raw: " + repr(frame.format()))
+            trace("++Rcv decoded: " + frame.__str__())
+        if frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY, ABNF.OPCODE_CONT):
+            self.cont_frame.validate(frame)
+            self.cont_frame.add(frame)
+            if self.cont_frame.is_fire(frame):
+                opcode, frame = self.cont_frame.extract(frame)
+                await self._messages.put((opcode, frame.data))
+        elif frame.opcode == ABNF.OPCODE_CLOSE:
+            if len(frame.data) >= 2:
+                self.close_status = struct.unpack("!H", frame.data[:2])[0]
+                self.close_reason = frame.data[2:]
+            if self.connected:
+                # Closed by the server: answer its close frame.
+                self.connected = False
+                try:
+                    await self.send(struct.pack('!H', STATUS_NORMAL), ABNF.OPCODE_CLOSE)
+                except (OSError, WebSocketException):
+                    pass
+                self._writer.close()
+            self._closed.set()
+            await self._messages.put(None)
+            return False
+        elif frame.opcode == ABNF.OPCODE_PING:
+            if len(frame.data) >= 126:
+                raise WebSocketProtocolException("Ping message is too long")
+            await self.pong(frame.data)
+        elif frame.opcode == ABNF.OPCODE_PONG:
+            self.last_pong_tm = time.time()
+        return True
+
+    async def _fail(self, error):
+        """
+        Ends the connection after error.
+        """
+        self._error = error
+        if self.connected and self._writer is not None and not self._writer.is_closing():
+            self.connected = False
+            if isinstance(error, WebSocketMessageTooBigException):
+                status = STATUS_MESSAGE_TOO_BIG
+            elif isinstance(error, WebSocketPayloadException):
+                status = STATUS_INVALID_PAYLOAD
+            elif isinstance(error, WebSocketProtocolException):
+                status = STATUS_PROTOCOL_ERROR
+            else:
+                status = None
+            if status is not None:
+                try:
+                    await self.send(struct.pack('!H', status), ABNF.OPCODE_CLOSE)
+                except (OSError, WebSocketException):
+                    pass
+        self._abort()
+        self._closed.set()
+        await self._messages.put(None)
+
+    async def _keepalive(self):
+        while self.connected:
+            await asyncio.sleep(self.ping_interval - (self.ping_timeout or 0))
+            if not self.connected:
+                return
+            self.last_ping_tm = time.time()
+            try:
+                await self.ping(self.ping_payload)
+            except (OSError, WebSocketException):
+                return
+            if self.ping_timeout:
+                await asyncio.sleep(self.ping_timeout)
+                if self.connected and self.last_pong_tm < self.last_ping_tm:
+                    await self._fail(WebSocketTimeoutException("ping/pong timed out"))
+                    return
+
+
+async def create_async_connection(url, **options):
+    """
+    Connect to url and return the AsyncWebSocket.
+
+    ping_interval, ping_timeout, ping_payload, max_queue, get_mask_key,
+    skip_utf8_validation, max_message_size and on_fragment are passed to
+    AsyncWebSocket, the other options to AsyncWebSocket.connect.
+    """
+    kwargs = {}
+    for name in ("ping_interval", "ping_timeout", "ping_payload", "max_queue",
+                 "get_mask_key", "skip_utf8_validation", "max_message_size", "on_fragment"):
+        if name in options:
+            kwargs[name] = options.pop(name)
+    websock = AsyncWebSocket(**kwargs)
+    await websock.connect(url, **options)
+    return websock
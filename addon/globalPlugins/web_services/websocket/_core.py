@@ -34,6 +34,11 @@ limitations under the License.
 
 __all__ = ['WebSocket', 'create_connection']
 
+# The send buffer is not kept once it has grown larger than this.
+SEND_BUFFER_MAX = 1 << 18
+# Single frames with a shorter payload are not formatted in the send buffer.
+SEND_COPY_MIN = 65536
+
 
 class WebSocket:
     """
@@ -71,11 +76,20 @@ class WebSocket:
         If set to True, lock send method.
     skip_utf8_validation: bool
         Skip utf8 validation.
+    max_message_size: int
+        Largest message accepted, in bytes. Larger ones raise
+        WebSocketMessageTooBigException as soon as the frame going over the
+        limit is announced. None, the default, accepts any size.
+    on_fragment: func
+        Called as on_fragment(opcode, data, fin) with each fragment of the
+        text and binary messages, which are then neither reassembled nor
+        returned by recv_data_frame; opcode is the message's.
     """
 
     def __init__(self, get_mask_key=None, sockopt=None, sslopt=None,
                  fire_cont_frame=False, enable_multithread=True,
-                 skip_utf8_validation=False, **_):
+                 skip_utf8_validation=False, max_message_size=None,
+                 on_fragment=None, **_):
         """
         Initialize WebSocket object.
 
@@ -91,9 +105,16 @@ class WebSocket:
         self.connected = False
         self.get_mask_key = get_mask_key
         # These buffer over the build-up of a single frame.
-        self.frame_buffer = frame_buffer(self._recv, skip_utf8_validation)
+        self.frame_buffer = frame_buffer(self._recv, skip_utf8_validation, self._recv_into,
+                                         max_message_size)
         self.cont_frame = continuous_frame(
-            fire_cont_frame, skip_utf8_validation)
+            fire_cont_frame, skip_utf8_validation, max_message_size, on_fragment)
+        # PerMessageDeflate state, once negotiated by connect().
+        self.deflate = None
+        # connect_attempt timings of the last connect().
+        self.connect_attempts = []
+        # Frames are formatted and masked in this buffer, under self.lock.
+        self.send_buffer = bytearray()
 
         if enable_multithread:
             self.lock = threading.Lock()
@@ -242,12 +263,17 @@ class WebSocket:
             Number of redirects to follow.
         subprotocols: list
             List of available subprotocols. Default is None.
+        permessage_deflate: bool or dict
+            Offer the permessage-deflate extension (RFC 7692). A dict may set
+            client_max_window_bits, server_max_window_bits,
+            client_no_context_takeover and server_no_context_takeover.
         socket: socket
             Pre-initialized stream socket.
         """
         self.sock_opt.timeout = options.get('timeout', self.sock_opt.timeout)
+        self.connect_attempts = []
         self.sock, addrs = connect(url, self.sock_opt, proxy_info(**options),
-                                   options.pop('socket', None))
+                                   options.pop('socket', None), self.connect_attempts)
 
         try:
             self.handshake_response = handshake(self.sock, url, *addrs, **options)
@@ -256,8 +282,10 @@ class WebSocket:
                     url = self.handshake_response.headers['location']
                     self.sock.close()
                     self.sock, addrs = connect(url, self.sock_opt, proxy_info(**options),
-                                               options.pop('socket', None))
+                                               options.pop('socket', None), self.connect_attempts)
                     self.handshake_response = handshake(self.sock, url, *addrs, **options)
+            self._set_deflate(self.handshake_response.deflate)
+            self.frame_buffer.feed(self.handshake_response.rest)
             self.connected = True
         except:
             if self.sock:
@@ -280,9 +308,11 @@ class WebSocket:
         """
 
         frame = ABNF.create_frame(payload, opcode)
-        return self.send_frame(frame)
+        compress = self.deflate is not None and opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY) \
+            and len(frame.data) >= self.deflate.MIN_SIZE
+        return self.send_frame(frame, compress)
 
-    def send_frame(self, frame):
+    def send_frame(self, frame, compress=False):
         """
         Send the data frame.
 
@@ -298,19 +328,103 @@ class WebSocket:
         ----------
         frame: ABNF frame
             frame data created by ABNF.create_frame
+        compress: bool
+            Compress the frame with permessage-deflate. The frame must hold
+            a whole text or binary message.
+        """
+        return self.send_many([frame], compress)
+
+    def send_many(self, frames, compress=False):
         """
+        Send several frames at once: they are formatted in one buffer and
+        written with as few system calls as possible.
+
+        >>> ws.send_many([ABNF.create_frame(text, ABNF.OPCODE_TEXT) for text in texts])
+
+        Parameters
+        ----------
+        frames: list of ABNF frames
+            frames created by ABNF.create_frame, sent in this order.
+        compress: bool
+            Compress the text and binary frames with permessage-deflate.
+            They must each hold a whole message.
+
+        Returns the number of bytes sent.
+        """
+        frames = list(frames)
         if self.get_mask_key:
-            frame.get_mask_key = self.get_mask_key
-        data = frame.format()
-        length = len(data)
-        if (isEnabledForTrace()):
-            trace("++Sent raw: " + repr(data))
-            trace("++Sent decoded: " + frame.__str__())
+            for frame in frames:
+                frame.get_mask_key = self.get_mask_key
+        # Compressed messages share a context: they must be sent in the
+        # order they were compressed.
         with self.lock:
-            while data:
-                l = self._send(data)
-                data = data[l:]
+            if compress:
+                for frame in frames:
+                    if frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+                        data = frame.data
+                        if isinstance(data, str):
+                            data = data.encode('latin-1')
+                        frame.data = self.deflate.compress(data)
+                        frame.rsv1 = 1
+            return self._send_frames(frames)
+
+    def _send_frames(self, frames):
+        if len(frames) == 1 and len(frames[0].data) < SEND_COPY_MIN:
+            # Formatting a small frame by itself costs less than going
+            # through the buffer.
+            frame = frames[0]
+            data = frame.format()
+            if isEnabledForTrace():
+                trace("++Sent raw: " + repr(data))
+                trace("++Sent decoded: " + frame.__str__())
+            length = len(data)
+            sent = self._send(data) or 0
+            if sent < length:
+                self._send_buffers([memoryview(data)[sent:]])
+            return length
+
+        length = 0
+        buffer = self._clear_send_buffer()
+        # Unmasked payloads left out of the buffer, and where they go.
+        payloads = []
+        for frame in frames:
+            payload = frame.format_into(buffer, False)
+            if payload is not None:
+                payloads.append((len(buffer), payload))
+            if isEnabledForTrace():
+                trace("++Sent decoded: " + frame.__str__())
+            if len(buffer) >= SEND_BUFFER_MAX:
+                length += self._flush_send_buffer(buffer, payloads)
+                buffer = self._clear_send_buffer()
+                payloads = []
+        if buffer:
+            length += self._flush_send_buffer(buffer, payloads)
+
+        if len(buffer) > SEND_BUFFER_MAX:
+            self.send_buffer = bytearray()
+        return length
 
+    def _clear_send_buffer(self):
+        try:
+            del self.send_buffer[:]
+        except BufferError:
+            # Views of the previous frames are still referenced.
+            self.send_buffer = bytearray()
+        return self.send_buffer
+
+    def _flush_send_buffer(self, buffer, payloads):
+        with memoryview(buffer) as view:
+            parts = []
+            start = 0
+            for end, payload in payloads:
+                parts.append(view[start:end])
+                parts.append(payload)
+                start = end
+            parts.append(view[start:])
+            if isEnabledForTrace():
+                trace("++Sent raw: " + repr(b"".join(parts)))
+            length = self._send_buffers(parts)
+            del parts
         return length
 
     def send_binary(self, payload):
@@ -521,9 +635,17 @@ class WebSocket:
             self.sock = None
             self.connected = False
 
+    def _set_deflate(self, deflate):
+        self.deflate = deflate
+        self.frame_buffer.allow_rsv1 = deflate is not None
+        self.cont_frame.deflate = deflate
+
     def _send(self, data):
         return send(self.sock, data)
 
+    def _send_buffers(self, buffers):
+        return send_buffers(self.sock, buffers)
+
     def _recv(self, bufsize):
         try:
             return recv(self.sock, bufsize)
@@ -534,6 +656,16 @@ class WebSocket:
             self.connected = False
             raise
 
+    def _recv_into(self, buffer):
+        try:
+            return recv_into(self.sock, buffer)
+        except WebSocketConnectionClosedException:
+            if self.sock:
+                self.sock.close()
+            self.sock = None
+            self.connected = False
+            raise
+
 
 def create_connection(url, timeout=None, class_=WebSocket, **options):
     """
@@ -590,8 +722,14 @@ def create_connection(url, timeout=None, class_=WebSocket, **options):
         Optional dict object for ssl socket options. See FAQ for details.
     subprotocols: list
         List of available subprotocols. Default is None.
+    permessage_deflate: bool or dict
+        Offer the permessage-deflate extension, see WebSocket.connect.
     skip_utf8_validation: bool
         Skip utf8 validation.
+    max_message_size: int
+        Largest message accepted, see WebSocket.
+    on_fragment: func
+        Receive messages by fragments, see WebSocket.
     socket: socket
         Pre-initialized stream socket.
     """
@@ -600,10 +738,14 @@ def create_connection(url, timeout=None, class_=WebSocket, **options):
     fire_cont_frame = options.pop("fire_cont_frame", False)
     enable_multithread = options.pop("enable_multithread", True)
     skip_utf8_validation = options.pop("skip_utf8_validation", False)
+    max_message_size = options.pop("max_message_size", None)
+    on_fragment = options.pop("on_fragment", None)
     websock = class_(sockopt=sockopt, sslopt=sslopt,
                      fire_cont_frame=fire_cont_frame,
                      enable_multithread=enable_multithread,
-                     skip_utf8_validation=skip_utf8_validation, **options)
+                     skip_utf8_validation=skip_utf8_validation,
+                     max_message_size=max_message_size,
+                     on_fragment=on_fragment, **options)
     websock.settimeout(timeout if timeout is not None else getdefaulttimeout())
     websock.connect(url, **options)
     return websock
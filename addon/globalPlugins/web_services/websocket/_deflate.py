@@ -0,0 +1,184 @@
+import zlib
+
+from ._exceptions import *
+
+"""
+_deflate.py
+websocket - WebSocket client library for Python
+
+Not part of upstream websocket-client: added to the copy of the package
+bundled with the NVDA Web Services add-on, under the same license as the
+rest of the package.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__all__ = ['PerMessageDeflate']
+
+EXTENSION_NAME = "permessage-deflate"
+# Every message compressed with a sync flush ends with these bytes, which
+# are left out on the wire (RFC 7692, section 7.2.1).
+_SYNC_TRAILER = b"\x00\x00\xff\xff"
+_PARAMETERS = ("client_max_window_bits", "server_max_window_bits",
+               "client_no_context_takeover", "server_no_context_takeover")
+
+
+def _window_bits(name: str, value: str) -> int:
+    try:
+        bits = int(value)
+    except (TypeError, ValueError):
+        bits = 0
+    # zlib cannot produce raw deflate streams with a 256 bytes window.
+    if not 9 <= bits <= 15 and not (bits == 8 and name == "server_max_window_bits"):
+        raise WebSocketException(
+            "Unsupported {name} in permessage-deflate response: {value!r}".format(name=name, value=value))
+    return bits
+
+
+class PerMessageDeflate:
+    """
+    Compression state of a connection using the permessage-deflate
+    extension (RFC 7692).
+
+    The compressor and decompressor keep their context across messages,
+    unless the matching no_context_takeover parameter was negotiated.
+    """
+
+    # Messages shorter than this are sent uncompressed.
+    MIN_SIZE = 64
+    COMPRESS_LEVEL = 6
+
+    def __init__(self, client_max_window_bits: int = 15, server_max_window_bits: int = 15,
+                 client_no_context_takeover: bool = False,
+                 server_no_context_takeover: bool = False) -> None:
+        self.client_max_window_bits = client_max_window_bits
+        self.server_max_window_bits = server_max_window_bits
+        self.client_no_context_takeover = client_no_context_takeover
+        self.server_no_context_takeover = server_no_context_takeover
+        self._compressor = None
+        self._decompressor = None
+
+    @staticmethod
+    def offer(options: dict or bool) -> str:
+        """
+        Value of the Sec-WebSocket-Extensions request header.
+
+        Parameters
+        ----------
+        options: dict or bool
+            True, or a dict which may set client_max_window_bits,
+            server_max_window_bits (9 to 15), client_no_context_takeover
+            and server_no_context_takeover (bool).
+        """
+        if not isinstance(options, dict):
+            options = {}
+        unknown = set(options) - set(_PARAMETERS)
+        if unknown:
+            raise ValueError("Unknown permessage-deflate options: " + ", ".join(sorted(unknown)))
+        params = [EXTENSION_NAME]
+        for name in ("client_max_window_bits", "server_max_window_bits"):
+            bits = options.get(name)
+            if bits is not None and not 9 <= bits <= 15:
+                raise ValueError("{name} must be between 9 and 15".format(name=name))
+        # Without a value, client_max_window_bits only tells the server it
+        # may choose our window size.
+        bits = options.get("client_max_window_bits")
+        params.append("client_max_window_bits" if bits is None else "client_max_window_bits={b}".format(b=bits))
+        bits = options.get("server_max_window_bits")
+        if bits is not None:
+            params.append("server_max_window_bits={b}".format(b=bits))
+        for name in ("client_no_context_takeover", "server_no_context_takeover"):
+            if options.get(name):
+                params.append(name)
+        return "; ".join(params)
+
+    @classmethod
+    def accept(cls, header: str, options: dict or bool) -> 'PerMessageDeflate' or None:
+        """
+        Parse the Sec-WebSocket-Extensions response header answering offer().
+
+        Returns None if the server did not accept the extension, raises
+        WebSocketException if its answer is invalid.
+        """
+        if not header:
+            return None
+        if not isinstance(options, dict):
+            options = {}
+        extensions = [e.strip() for e in header.split(",") if e.strip()]
+        if len(extensions) != 1:
+            raise WebSocketException("Unexpected extensions in handshake response: " + header)
+        params = [p.strip() for p in extensions[0].split(";")]
+        if params[0].lower() != EXTENSION_NAME:
+            raise WebSocketException("Unexpected extensions in handshake response: " + header)
+        values = {}
+        for param in params[1:]:
+            name, _, value = param.partition("=")
+            name = name.strip().lower()
+            value = value.strip().strip('"') or None
+            if name not in _PARAMETERS or name in values:
+                raise WebSocketException("Invalid permessage-deflate response: " + header)
+            values[name] = value
+        for name in ("client_no_context_takeover", "server_no_context_takeover"):
+            if values.get(name, None) is not None:
+                raise WebSocketException("Invalid permessage-deflate response: " + header)
+        if options.get("server_no_context_takeover") and "server_no_context_takeover" not in values:
+            raise WebSocketException("Server did not accept server_no_context_takeover")
+        deflate = cls(client_no_context_takeover="client_no_context_takeover" in values,
+                      server_no_context_takeover="server_no_context_takeover" in values)
+        for name in ("client_max_window_bits", "server_max_window_bits"):
+            offered = options.get(name)
+            if name in values:
+                bits = _window_bits(name, values[name])
+                if offered and bits > offered:
+                    raise WebSocketException("Server exceeded {name}: {bits}".format(name=name, bits=bits))
+                setattr(deflate, name, bits)
+            elif offered:
+                if name == "server_max_window_bits":
+                    raise WebSocketException("Server did not accept server_max_window_bits")
+                deflate.client_max_window_bits = offered
+        return deflate
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        Compress a whole message.
+        """
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(self.COMPRESS_LEVEL, zlib.DEFLATED,
+                                                -self.client_max_window_bits)
+        data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.client_no_context_takeover:
+            self._compressor = None
+        return data[:-len(_SYNC_TRAILER)]
+
+    def decompress(self, data: bytes, fin: int, max_length: int = 0) -> bytes:
+        """
+        Decompress one frame of a compressed message, fin being set on its
+        last frame. If max_length is not 0, WebSocketMessageTooBigException
+        is raised when the frame inflates to more than max_length bytes.
+        """
+        if self._decompressor is None:
+            # A larger window than the server's accepts its data as well.
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            result = self._decompressor.decompress(data, max_length)
+            if self._decompressor.unconsumed_tail:
+                self._decompressor = None
+                raise WebSocketMessageTooBigException(
+                    "Decompressed frame larger than {size} bytes".format(size=max_length))
+            if fin:
+                result += self._decompressor.decompress(_SYNC_TRAILER)
+        except zlib.error as e:
+            raise WebSocketPayloadException("Invalid compressed data: {err}".format(err=e))
+        if fin and self.server_no_context_takeover:
+            self._decompressor = None
+        return result
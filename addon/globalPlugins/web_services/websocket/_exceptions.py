@@ -39,6 +39,14 @@ class WebSocketPayloadException(WebSocketException):
     pass
 
 
+class WebSocketMessageTooBigException(WebSocketException):
+    """
+    If a received message is larger than the maximum message size, this
+    exception will be raised.
+    """
+    pass
+
+
 class WebSocketConnectionClosedException(WebSocketException):
     """
     If remote host closed the connection or some network error happened,
@@ -22,6 +22,7 @@ import os
 from base64 import encodebytes as base64encode
 from http import client as HTTPStatus
 from ._cookiejar import SimpleCookieJar
+from ._deflate import PerMessageDeflate
 from ._exceptions import *
 from ._http import *
 from ._logging import *
@@ -31,6 +32,8 @@ __all__ = ["handshake_response", "handshake", "SUPPORTED_REDIRECT_STATUSES"]
 
 # websocket supported version.
 VERSION = 13
+# Appended to Sec-WebSocket-Key to compute Sec-WebSocket-Accept.
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
 
 SUPPORTED_REDIRECT_STATUSES = (HTTPStatus.MOVED_PERMANENTLY, HTTPStatus.FOUND, HTTPStatus.SEE_OTHER,)
 SUCCESS_STATUSES = SUPPORTED_REDIRECT_STATUSES + (HTTPStatus.SWITCHING_PROTOCOLS,)
@@ -40,10 +43,14 @@ CookieJar = SimpleCookieJar()
 
 class handshake_response:
 
-    def __init__(self, status, headers, subprotocol):
+    def __init__(self, status, headers, subprotocol, deflate=None):
         self.status = status
         self.headers = headers
         self.subprotocol = subprotocol
+        # PerMessageDeflate state, if the extension was negotiated.
+        self.deflate = deflate
+        # Bytes received after the response header: the first frames.
+        self.rest = b""
         CookieJar.add(headers.get("set-cookie"))
 
 
@@ -54,14 +61,30 @@ def handshake(sock, url, hostname, port, resource, **options):
     send(sock, header_str)
     dump("request header", header_str)
 
-    status, resp = _get_resp_headers(sock)
+    rest = bytearray()
+    status, resp = _get_resp_headers(sock, rest=rest)
+    response = _check_response(status, resp, key, options)
+    response.rest = bytes(rest)
+    return response
+
+
+def _check_response(status, resp, key, options):
+    """
+    handshake_response for the server's answer, or WebSocketException if
+    the upgrade was not accepted.
+    """
     if status in SUPPORTED_REDIRECT_STATUSES:
         return handshake_response(status, resp, None)
     success, subproto = _validate(resp, key, options.get("subprotocols"))
     if not success:
         raise WebSocketException("Invalid WebSocket Header")
 
-    return handshake_response(status, resp, subproto)
+    deflate = None
+    if options.get("permessage_deflate"):
+        deflate = PerMessageDeflate.accept(resp.get("sec-websocket-extensions"),
+                                           options["permessage_deflate"])
+
+    return handshake_response(status, resp, subproto, deflate)
 
 
 def _pack_hostname(hostname):
@@ -117,6 +140,10 @@ def _get_handshake_headers(resource, url, host, port, options):
     if subprotocols:
         headers.append("Sec-WebSocket-Protocol: {protocols}".format(protocols=",".join(subprotocols)))
 
+    permessage_deflate = options.get("permessage_deflate")
+    if permessage_deflate:
+        headers.append("Sec-WebSocket-Extensions: {offer}".format(offer=PerMessageDeflate.offer(permessage_deflate)))
+
     header = options.get("header")
     if header:
         if isinstance(header, dict):
@@ -141,10 +168,16 @@ def _get_handshake_headers(resource, url, host, port, options):
     return headers, key
 
 
-def _get_resp_headers(sock, success_statuses=SUCCESS_STATUSES):
-    status, resp_headers, status_message = read_headers(sock)
+def _get_resp_headers(sock, success_statuses=SUCCESS_STATUSES, rest=None):
+    if rest is None:
+        rest = bytearray()
+    status, resp_headers, status_message = read_headers(sock, rest)
     if status not in success_statuses:
-        response_body = sock.recv(int(resp_headers['content-length']))  # read the body of the HTTP error message response and include it in the exception
+        # read the body of the HTTP error message response and include it in the exception
+        response_body = bytes(rest)
+        length = int(resp_headers.get('content-length', 0))
+        if len(response_body) < length:
+            response_body += sock.recv(length - len(response_body))
         raise WebSocketBadStatusException("Handshake status {status} {message} -+-+- {headers} -+-+- {body}".format(status=status, message=status_message, headers=resp_headers, body=response_body), status, status_message, resp_headers, response_body)
     return status, resp_headers
 
@@ -180,8 +213,7 @@ def _validate(headers, key, subprotocols):
     if isinstance(result, str):
         result = result.encode('utf-8')
 
-    value = (key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode('utf-8')
-    hashed = base64encode(hashlib.sha1(value).digest()).strip().lower()
+    hashed = _create_accept_key(key).lower().encode('utf-8')
     success = hmac.compare_digest(hashed, result)
 
     if success:
@@ -190,6 +222,14 @@ def _validate(headers, key, subprotocols):
         return False, None
 
 
+def _create_accept_key(key):
+    """
+    Sec-WebSocket-Accept value answering a Sec-WebSocket-Key.
+    """
+    value = (key + WEBSOCKET_GUID).encode('utf-8')
+    return base64encode(hashlib.sha1(value).digest()).strip().decode('utf-8')
+
+
 def _create_sec_websocket_key():
     randomness = os.urandom(16)
     return base64encode(randomness).decode('utf-8').strip()
@@ -18,8 +18,11 @@ limitations under the License.
 """
 import errno
 import os
+import re
+import selectors
 import socket
 import sys
+import time
 
 from ._exceptions import *
 from ._logging import *
@@ -29,7 +32,22 @@ from ._url import *
 
 from base64 import encodebytes as base64encode
 
-__all__ = ["proxy_info", "connect", "read_headers"]
+__all__ = ["proxy_info", "connect_attempt", "connect", "read_headers", "parse_headers"]
+
+# Largest response header read_headers() accepts.
+MAX_HEADER_SIZE = 65536
+# Bytes read at once while looking for the end of a response header.
+_HEADER_CHUNK = 4096
+# End of a response header: an empty line.
+_HEADER_END = re.compile(b"\r?\n\r?\n")
+
+# Seconds to wait for a connection attempt before starting the next one in
+# parallel, as recommended by RFC 8305.
+CONNECTION_ATTEMPT_DELAY = 0.25
+# connect_ex() results of a non-blocking connection in progress.
+_CONNECT_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN,
+                        getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK)}
+_CONNECTION_REFUSED = (errno.ECONNREFUSED, getattr(errno, "WSAECONNREFUSED", errno.ECONNREFUSED))
 
 try:
     from python_socks.sync import Proxy
@@ -107,7 +125,36 @@ def _start_proxied_socket(url, options, proxy):
     return sock, (hostname, port, resource)
 
 
-def connect(url, options, proxy, socket):
+class connect_attempt:
+    """
+    Timing of one connection attempt made by connect().
+    """
+
+    def __init__(self, address, family, start):
+        self.address = address
+        self.family = family
+        # Seconds between the first attempt and this one.
+        self.start = start
+        # Seconds until it connected, failed or was cancelled.
+        self.elapsed = None
+        self.connected = False
+        # Why it failed, or None.
+        self.error = None
+
+    def __repr__(self):
+        if self.connected:
+            result = "connected"
+        else:
+            result = repr(self.error) if self.error is not None else "cancelled"
+        return "<connect_attempt {address} start={start:.3f}s elapsed={elapsed:.3f}s {result}>".format(
+            address=self.address[0], start=self.start, elapsed=self.elapsed or 0, result=result)
+
+
+def connect(url, options, proxy, socket, attempts=None):
+    """
+    Open a socket to url, through proxy when needed. Timings of the
+    connection attempts are appended to attempts, if it is a list.
+    """
     # Use _start_proxied_socket() only for socks4 or socks5 proxy
     # Use _tunnel() for http proxy
     # TODO: Use python-socks for http protocol also, to standardize flow
@@ -127,7 +174,11 @@ def connect(url, options, proxy, socket):
 
     sock = None
     try:
-        sock = _open_socket(addrinfo_list, options.sockopt, options.timeout)
+        try:
+            sock = _open_socket(addrinfo_list, options.sockopt, options.timeout, attempts)
+        except OSError as error:
+            _forget_addrinfo(hostname, is_secure, proxy, error)
+            raise
         if need_tunnel:
             sock = _tunnel(sock, hostname, port_from_url, auth)
 
@@ -152,7 +203,7 @@ def _get_addrinfo_list(hostname, port, is_secure, proxy):
         # This generates an error exception: `_on_error: exception Socket type must be stream or datagram, not 0`
         # or `OSError: [Errno 22] Invalid argument` when creating socket. Force the socket type to SOCK_STREAM.
         if not phost:
-            addrinfo_list = socket.getaddrinfo(
+            addrinfo_list = _getaddrinfo(
                 hostname, port, 0, socket.SOCK_STREAM, socket.SOL_TCP)
             return addrinfo_list, False, None
         else:
@@ -161,53 +212,154 @@ def _get_addrinfo_list(hostname, port, is_secure, proxy):
             # returns a socktype 0. This generates an error exception:
             # _on_error: exception Socket type must be stream or datagram, not 0
             # Force the socket type to SOCK_STREAM
-            addrinfo_list = socket.getaddrinfo(phost, pport, 0, socket.SOCK_STREAM, socket.SOL_TCP)
+            addrinfo_list = _getaddrinfo(phost, pport, 0, socket.SOCK_STREAM, socket.SOL_TCP)
             return addrinfo_list, True, pauth
     except socket.gaierror as e:
         raise WebSocketAddressException(e)
 
 
-def _open_socket(addrinfo_list, sockopt, timeout):
-    err = None
+def _getaddrinfo(host, port, family, socktype, proto):
+    resolver = getdefaultresolver()
+    if resolver is None:
+        return socket.getaddrinfo(host, port, family, socktype, proto)
+    return resolver.getaddrinfo(host, port, family, socktype, proto)
+
+
+def _forget_addrinfo(hostname, is_secure, proxy, error):
+    """
+    Invalidate the addresses of the host (or proxy) none of which could be
+    reached, unless they refused the connection: the host is there then.
+    """
+    resolver = getdefaultresolver()
+    if resolver is None or isinstance(error, ConnectionRefusedError) or error.errno in _CONNECTION_REFUSED:
+        return
+    phost = get_proxy_info(
+        hostname, is_secure, proxy.proxy_host, proxy.proxy_port, proxy.auth, proxy.no_proxy)[0]
+    resolver.invalidate(phost or hostname)
+
+
+def _interleave_families(addrinfo_list):
+    """
+    Alternate address families, starting with the first one (RFC 8305).
+    """
+    families = {}
     for addrinfo in addrinfo_list:
-        family, socktype, proto = addrinfo[:3]
-        sock = socket.socket(family, socktype, proto)
-        sock.settimeout(timeout)
-        for opts in DEFAULT_SOCKET_OPTION:
-            sock.setsockopt(*opts)
-        for opts in sockopt:
-            sock.setsockopt(*opts)
-
-        address = addrinfo[4]
-        err = None
-        while not err:
-            try:
-                sock.connect(address)
-            except socket.error as error:
-                sock.close()
-                error.remote_ip = str(address[0])
+        families.setdefault(addrinfo[0], []).append(addrinfo)
+    queues = list(families.values())
+    result = []
+    while queues:
+        for queue in queues:
+            result.append(queue.pop(0))
+        queues = [queue for queue in queues if queue]
+    return result
+
+
+def _open_socket(addrinfo_list, sockopt, timeout, attempts=None):
+    """
+    Connect to one of the addresses. Attempts are started one after the
+    other, CONNECTION_ATTEMPT_DELAY apart or as soon as the previous ones
+    failed, alternating address families; the first to connect wins and the
+    others are cancelled. Each attempt may take up to timeout seconds.
+    """
+    if attempts is None:
+        attempts = []
+    pending = _interleave_families(addrinfo_list)
+    # Socket in progress: its attempt and deadline.
+    in_progress = {}
+    sel = selectors.DefaultSelector()
+    started = time.monotonic()
+    next_start = started
+    err = None
+    sock = None
+
+    def fail(sock, attempt, error):
+        attempt.elapsed = time.monotonic() - started - attempt.start
+        attempt.error = error
+        error.remote_ip = str(attempt.address[0])
+        sock.close()
+        return error
+
+    try:
+        while sock is None and (pending or in_progress):
+            now = time.monotonic()
+            if pending and (not in_progress or now >= next_start):
+                family, socktype, proto, canonname, address = pending.pop(0)
+                attempt = connect_attempt(address, family, now - started)
+                attempts.append(attempt)
+                try:
+                    candidate = socket.socket(family, socktype, proto)
+                except OSError as error:
+                    # Address family not supported here.
+                    attempt.elapsed = 0
+                    attempt.error = err = error
+                    continue
                 try:
-                    eConnRefused = (errno.ECONNREFUSED, errno.WSAECONNREFUSED, errno.ENETUNREACH)
-                except AttributeError:
-                    eConnRefused = (errno.ECONNREFUSED, errno.ENETUNREACH)
-                if error.errno in eConnRefused:
-                    err = error
+                    for opts in DEFAULT_SOCKET_OPTION:
+                        candidate.setsockopt(*opts)
+                    for opts in sockopt:
+                        candidate.setsockopt(*opts)
+                    candidate.setblocking(False)
+                    code = candidate.connect_ex(address)
+                except OSError as error:
+                    err = fail(candidate, attempt, error)
                     continue
+                if code == 0:
+                    attempt.elapsed = time.monotonic() - started - attempt.start
+                    attempt.connected = True
+                    sock = candidate
+                elif code in _CONNECT_IN_PROGRESS:
+                    sel.register(candidate, selectors.EVENT_WRITE)
+                    in_progress[candidate] = (attempt, None if timeout is None else now + timeout)
+                    next_start = now + CONNECTION_ATTEMPT_DELAY
                 else:
-                    raise error
-            else:
-                break
-        else:
-            continue
-        break
-    else:
-        if err:
-            raise err
-
+                    err = fail(candidate, attempt, OSError(code, os.strerror(code)))
+                continue
+
+            wake = [deadline for attempt, deadline in in_progress.values() if deadline is not None]
+            if pending:
+                wake.append(next_start)
+            wait = max(0, min(wake) - now) if wake else None
+            for key, events in sel.select(wait):
+                candidate = key.fileobj
+                attempt = in_progress.pop(candidate)[0]
+                sel.unregister(candidate)
+                code = candidate.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code == 0 and sock is None:
+                    attempt.elapsed = time.monotonic() - started - attempt.start
+                    attempt.connected = True
+                    sock = candidate
+                elif code == 0:
+                    # Another attempt connected at the same time.
+                    attempt.elapsed = time.monotonic() - started - attempt.start
+                    candidate.close()
+                else:
+                    err = fail(candidate, attempt, OSError(code, os.strerror(code)))
+                    # Start the next attempt now.
+                    next_start = time.monotonic()
+
+            now = time.monotonic()
+            for candidate, (attempt, deadline) in list(in_progress.items()):
+                if deadline is not None and now >= deadline:
+                    del in_progress[candidate]
+                    sel.unregister(candidate)
+                    err = fail(candidate, attempt, socket.timeout("timed out"))
+                    next_start = now
+    finally:
+        for candidate, (attempt, deadline) in in_progress.items():
+            # Cancelled: another attempt won.
+            attempt.elapsed = time.monotonic() - started - attempt.start
+            candidate.close()
+        sel.close()
+
+    if isEnabledForDebug():
+        debug("connect attempts: " + ", ".join(map(repr, attempts)))
+    if sock is None:
+        raise err
+    sock.settimeout(timeout)
     return sock
 
 
-def _wrap_sni_socket(sock, sslopt, hostname, check_hostname):
+def _ssl_context(sslopt):
     context = sslopt.get('context', None)
     if not context:
         context = ssl.SSLContext(sslopt.get('ssl_version', ssl.PROTOCOL_TLS_CLIENT))
@@ -244,6 +396,12 @@ def _wrap_sni_socket(sock, sslopt, hostname, check_hostname):
         if 'ecdh_curve' in sslopt:
             context.set_ecdh_curve(sslopt['ecdh_curve'])
 
+    return context
+
+
+def _wrap_sni_socket(sock, sslopt, hostname, check_hostname):
+    context = _ssl_context(sslopt)
+
     return context.wrap_socket(
         sock,
         do_handshake_on_connect=sslopt.get('do_handshake_on_connect', True),
@@ -252,7 +410,10 @@ def _wrap_sni_socket(sock, sslopt, hostname, check_hostname):
     )
 
 
-def _ssl_socket(sock, user_sslopt, hostname):
+def _ssl_options(user_sslopt, hostname):
+    """
+    SSL options completed with the defaults, and the host name to check.
+    """
     sslopt = dict(cert_reqs=ssl.CERT_REQUIRED)
     sslopt.update(user_sslopt)
 
@@ -267,6 +428,12 @@ def _ssl_socket(sock, user_sslopt, hostname):
     if sslopt.get('server_hostname', None):
         hostname = sslopt['server_hostname']
 
+    return sslopt, hostname
+
+
+def _ssl_socket(sock, user_sslopt, hostname):
+    sslopt, hostname = _ssl_options(user_sslopt, hostname)
+
     check_hostname = sslopt.get('check_hostname', True)
     sock = _wrap_sni_socket(sock, sslopt, hostname, check_hostname)
 
@@ -302,18 +469,51 @@ def _tunnel(sock, host, port, auth):
     return sock
 
 
-def read_headers(sock):
+def read_headers(sock, rest=None):
+    """
+    Read the status line and headers of an HTTP response, by chunks.
+
+    Bytes received after the headers are appended to rest, a bytearray.
+    Without it, they are an error.
+    """
+    buffer = bytearray()
+    match = None
+    while match is None:
+        if len(buffer) > MAX_HEADER_SIZE:
+            raise WebSocketException("Response header too large")
+        # The terminator may straddle the previous chunk.
+        start = max(0, len(buffer) - 3)
+        buffer += recv(sock, _HEADER_CHUNK)
+        match = _HEADER_END.search(buffer, start)
+
+    if match.end() < len(buffer):
+        if rest is None:
+            raise WebSocketException("Unexpected data after the response header")
+        rest += buffer[match.end():]
+
+    lines = []
+    trace("--- response header ---")
+
+    for line in buffer[:match.start()].decode('utf-8').split("\n"):
+        line = line.strip()
+        trace(line)
+        lines.append(line)
+
+    trace("-----------------------")
+
+    return parse_headers(lines)
+
+
+def parse_headers(lines):
+    """
+    Status, headers and status message of an HTTP response, given its
+    header lines without line ends.
+    """
     status = None
     status_message = None
     headers = {}
-    trace("--- response header ---")
 
-    while True:
-        line = recv_line(sock)
-        line = line.decode('utf-8').strip()
-        if not line:
-            break
-        trace(line)
+    for line in lines:
         if not status:
 
             status_info = line.split(" ", 2)
@@ -331,6 +531,4 @@ def read_headers(sock):
             else:
                 raise WebSocketException("Invalid header")
 
-    trace("-----------------------")
-
     return status, headers, status_message
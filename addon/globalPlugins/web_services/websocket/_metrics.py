@@ -0,0 +1,257 @@
+import collections
+import threading
+import time
+
+"""
+_metrics.py
+websocket - WebSocket client library for Python
+
+Not part of upstream websocket-client: added to the copy of the package
+bundled with the NVDA Web Services add-on, under the same license as the
+rest of the package.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+__all__ = ["connection_metrics"]
+
+# Upper bounds of the round trip time histogram buckets, in seconds. A last
+# bucket counts the longer ones.
+RTT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Round trip times kept.
+RTT_WINDOW = 64
+# Seconds over which message and byte rates are computed.
+RATE_WINDOW = 10
+# Reconnection durations kept.
+RECONNECT_WINDOW = 16
+# Largest payload of a control frame.
+_MAX_PING_PAYLOAD = 125
+
+
+class _rate:
+    """
+    Messages and bytes over the last window seconds, counted by second.
+    """
+
+    def __init__(self, window: int) -> None:
+        self.window = window
+        # [second, messages, bytes], oldest first.
+        self.buckets = collections.deque()
+        self.messages = 0
+        self.bytes = 0
+
+    def add(self, messages: int, size: int, now: float) -> None:
+        self.messages += messages
+        self.bytes += size
+        second = int(now)
+        if self.buckets and self.buckets[-1][0] == second:
+            bucket = self.buckets[-1]
+            bucket[1] += messages
+            bucket[2] += size
+        else:
+            self.buckets.append([second, messages, size])
+            self._expire(now)
+
+    def per_second(self, now: float) -> tuple:
+        self._expire(now)
+        messages = sum(bucket[1] for bucket in self.buckets)
+        size = sum(bucket[2] for bucket in self.buckets)
+        return messages / self.window, size / self.window
+
+    def _expire(self, now: float) -> None:
+        oldest = int(now) - self.window
+        while self.buckets and self.buckets[0][0] <= oldest:
+            self.buckets.popleft()
+
+
+class connection_metrics:
+    """
+    Connection quality of a WebSocketApp: round trip times of its pings,
+    message rates in each direction and reconnections. Services read them
+    with snapshot() or rtt_percentile().
+
+    Each ping carries a sequence number after the ping payload, so that a
+    pong is matched to the ping it answers: unsolicited pongs and pongs to
+    other pings are not taken as round trips. Sizes are payload sizes.
+
+    Parameters
+    ----------
+    rtt_window: int
+        Round trip times kept for the histogram and percentiles.
+    rate_window: int
+        Seconds over which rates are computed.
+    clock: func
+        Returns the current time in seconds.
+    """
+
+    def __init__(self, rtt_window: int = RTT_WINDOW, rate_window: int = RATE_WINDOW,
+                 clock=time.monotonic) -> None:
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.rtts = collections.deque(maxlen=rtt_window)
+        # Send times of the pings not answered yet, by payload.
+        self.pings = collections.OrderedDict()
+        self.ping_sequence = 0
+        self.pings_sent = 0
+        # Pings not answered before a later one was.
+        self.pings_unanswered = 0
+        self.sent = _rate(rate_window)
+        self.received = _rate(rate_window)
+        self.reconnects = 0
+        self.reconnect_durations = collections.deque(maxlen=RECONNECT_WINDOW)
+        self.connected_tm = None
+        self.disconnected_tm = None
+        # Seconds the last connection took to be established, from its
+        # connect attempts, or None.
+        self.connect_time = None
+
+    def ping_sent(self, payload: str or bytes = b"") -> bytes:
+        """
+        Records a ping and returns its payload: payload followed by a
+        sequence number.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self.lock:
+            self.ping_sequence += 1
+            suffix = b"#%d" % self.ping_sequence
+            payload = payload[:_MAX_PING_PAYLOAD - len(suffix)] + suffix
+            self.pings[payload] = self.clock()
+            self.pings_sent += 1
+        return payload
+
+    def pong_received(self, payload: bytes) -> float or None:
+        """
+        Records a pong. Returns the round trip time of the ping it answers,
+        or None if it answers none.
+        """
+        now = self.clock()
+        with self.lock:
+            sent = self.pings.get(payload)
+            if sent is None:
+                return None
+            # Pongs come in order: earlier pings will not be answered.
+            while True:
+                key, value = self.pings.popitem(last=False)
+                if key == payload:
+                    break
+                self.pings_unanswered += 1
+            rtt = now - sent
+            self.rtts.append(rtt)
+        return rtt
+
+    def message_sent(self, size: int) -> None:
+        now = self.clock()
+        with self.lock:
+            self.sent.add(1, size, now)
+
+    def message_received(self, size: int, fin: int = 1) -> None:
+        """
+        Records a message, or a fragment of one if fin is 0.
+        """
+        now = self.clock()
+        with self.lock:
+            self.received.add(1 if fin else 0, size, now)
+
+    def connected(self, attempts: list = None) -> None:
+        """
+        Records a connection, given the connect_attempt list of its socket.
+        """
+        now = self.clock()
+        with self.lock:
+            if self.disconnected_tm is not None:
+                self.reconnects += 1
+                self.reconnect_durations.append(now - self.disconnected_tm)
+                self.disconnected_tm = None
+            self.connected_tm = now
+            self.pings.clear()
+            self.connect_time = None
+            for attempt in attempts or ():
+                if attempt.connected:
+                    self.connect_time = attempt.start + attempt.elapsed
+
+    def disconnected(self) -> None:
+        """
+        Records the loss of the connection. The reconnection duration is
+        counted from the first loss until connected() is called.
+        """
+        now = self.clock()
+        with self.lock:
+            if self.disconnected_tm is None:
+                self.disconnected_tm = now
+            self.connected_tm = None
+            self.pings.clear()
+
+    def rtt_histogram(self) -> list:
+        """
+        Returns the (upper bound, count) pairs of the round trip times kept,
+        the last bound being None.
+        """
+        counts = [0] * (len(RTT_BUCKETS) + 1)
+        with self.lock:
+            rtts = list(self.rtts)
+        for rtt in rtts:
+            for i, bound in enumerate(RTT_BUCKETS):
+                if rtt <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return list(zip(RTT_BUCKETS + (None,), counts))
+
+    def rtt_percentile(self, p: float) -> float or None:
+        """
+        Returns the p percentile (0 to 1) of the round trip times kept, or
+        None before the first pong.
+        """
+        with self.lock:
+            rtts = sorted(self.rtts)
+        if not rtts:
+            return None
+        return rtts[min(len(rtts) - 1, int(len(rtts) * p))]
+
+    def snapshot(self) -> dict:
+        """
+        Returns the metrics as a dict.
+        """
+        now = self.clock()
+        with self.lock:
+            rtts = list(self.rtts)
+            sent_messages, sent_bytes = self.sent.per_second(now)
+            received_messages, received_bytes = self.received.per_second(now)
+            result = {
+                "rtt_last": rtts[-1] if rtts else None,
+                "rtt_min": min(rtts) if rtts else None,
+                "rtt_avg": sum(rtts) / len(rtts) if rtts else None,
+                "rtt_max": max(rtts) if rtts else None,
+                "pings_sent": self.pings_sent,
+                "pings_unanswered": self.pings_unanswered,
+                "pings_pending": len(self.pings),
+                "sent_messages_per_sec": sent_messages,
+                "sent_bytes_per_sec": sent_bytes,
+                "sent_messages": self.sent.messages,
+                "sent_bytes": self.sent.bytes,
+                "received_messages_per_sec": received_messages,
+                "received_bytes_per_sec": received_bytes,
+                "received_messages": self.received.messages,
+                "received_bytes": self.received.bytes,
+                "reconnects": self.reconnects,
+                "reconnect_durations": list(self.reconnect_durations),
+                "connected_for": now - self.connected_tm if self.connected_tm is not None else None,
+                "disconnected_for": now - self.disconnected_tm if self.disconnected_tm is not None else None,
+                "connect_time": self.connect_time,
+            }
+        result["rtt_p50"] = self.rtt_percentile(0.5)
+        result["rtt_p90"] = self.rtt_percentile(0.9)
+        result["rtt_histogram"] = self.rtt_histogram()
+        return result
@@ -36,9 +36,13 @@ if hasattr(socket, "TCP_KEEPCNT"):
     DEFAULT_SOCKET_OPTION.append((socket.SOL_TCP, socket.TCP_KEEPCNT, 3))
 
 _default_timeout = None
+_default_resolver = None
+
+# Most buffers passed to one sendmsg() call: IOV_MAX on Linux.
+_MAX_SEND_BUFFERS = 1024
 
 __all__ = ["DEFAULT_SOCKET_OPTION", "sock_opt", "setdefaulttimeout", "getdefaulttimeout",
-           "recv", "recv_line", "send"]
+           "setdefaultresolver", "getdefaultresolver", "recv", "recv_into", "recv_line", "send", "send_buffers"]
 
 
 class sock_opt:
@@ -78,6 +82,29 @@ def getdefaulttimeout() -> int or float:
     return _default_timeout
 
 
+def setdefaultresolver(resolver) -> None:
+    """
+    Set the resolver used to look up host names when connecting.
+
+    Parameters
+    ----------
+    resolver: object
+        Object with getaddrinfo(host, port, family, type, proto), called
+        like socket.getaddrinfo, and invalidate(host), called when none of
+        the addresses of host could be reached. None resolves every time
+        with socket.getaddrinfo.
+    """
+    global _default_resolver
+    _default_resolver = resolver
+
+
+def getdefaultresolver():
+    """
+    Get the resolver set by setdefaultresolver, or None.
+    """
+    return _default_resolver
+
+
 def recv(sock: socket, bufsize: int) -> bytes:
     if not sock:
         raise WebSocketConnectionClosedException("socket is already closed.")
@@ -125,6 +152,64 @@ def recv(sock: socket, bufsize: int) -> bytes:
     return bytes_
 
 
+def recv_into(sock: socket, buffer, nbytes: int = 0) -> int:
+    """
+    Receive data into a writable buffer, like recv() but without
+    allocating a new bytes object for each read.
+
+    Returns the number of bytes received, never 0.
+    """
+    if not sock:
+        raise WebSocketConnectionClosedException("socket is already closed.")
+
+    if not hasattr(sock, "recv_into"):
+        bytes_ = recv(sock, nbytes or len(buffer))
+        buffer[:len(bytes_)] = bytes_
+        return len(bytes_)
+
+    def _recv_into():
+        try:
+            return sock.recv_into(buffer, nbytes)
+        except SSLWantReadError:
+            pass
+        except socket.error as exc:
+            error_code = extract_error_code(exc)
+            if error_code != errno.EAGAIN and error_code != errno.EWOULDBLOCK:
+                raise
+
+        sel = selectors.DefaultSelector()
+        sel.register(sock, selectors.EVENT_READ)
+
+        r = sel.select(sock.gettimeout())
+        sel.close()
+
+        if r:
+            return sock.recv_into(buffer, nbytes)
+
+    try:
+        if sock.gettimeout() == 0:
+            received = sock.recv_into(buffer, nbytes)
+        else:
+            received = _recv_into()
+    except TimeoutError:
+        raise WebSocketTimeoutException("Connection timed out")
+    except socket.timeout as e:
+        message = extract_err_message(e)
+        raise WebSocketTimeoutException(message)
+    except SSLError as e:
+        message = extract_err_message(e)
+        if isinstance(message, str) and 'timed out' in message:
+            raise WebSocketTimeoutException(message)
+        else:
+            raise
+
+    if not received:
+        raise WebSocketConnectionClosedException(
+            "Connection to remote host was lost.")
+
+    return received
+
+
 def recv_line(sock: socket) -> bytes:
     line = []
     while True:
@@ -139,35 +224,51 @@ def send(sock: socket, data: bytes) -> int:
     if isinstance(data, str):
         data = data.encode('utf-8')
 
-    if not sock:
-        raise WebSocketConnectionClosedException("socket is already closed.")
+    return _send_with(sock, lambda: sock.send(data))
 
-    def _send():
-        try:
-            return sock.send(data)
-        except SSLWantWriteError:
-            pass
-        except socket.error as exc:
-            error_code = extract_error_code(exc)
-            if error_code is None:
-                raise
-            if error_code != errno.EAGAIN and error_code != errno.EWOULDBLOCK:
-                raise
 
-        sel = selectors.DefaultSelector()
-        sel.register(sock, selectors.EVENT_WRITE)
-
-        w = sel.select(sock.gettimeout())
-        sel.close()
+def send_buffers(sock: socket, buffers: list) -> int:
+    """
+    Send all the buffers, in order. They are gathered by one sendmsg() call
+    where the socket supports it (not on Windows nor with SSL), else sent one
+    by one; partial writes go on from a memoryview, without copying.
+    Returns the number of bytes sent.
+    """
+    if not sock:
+        raise WebSocketConnectionClosedException("socket is already closed.")
 
-        if w:
-            return sock.send(data)
+    gather = hasattr(sock, "sendmsg") and not (HAVE_SSL and isinstance(sock, ssl.SSLSocket))
+    views = [view for view in (memoryview(buffer).cast("B") for buffer in buffers) if view.nbytes]
+    total = 0
+    index = 0
+    while index < len(views):
+        if gather:
+            sent = _send_with(sock, lambda: sock.sendmsg(views[index:index + _MAX_SEND_BUFFERS]))
+        else:
+            sent = _send_with(sock, lambda: sock.send(views[index]))
+        if sent is None:
+            # The socket did not become writable within its timeout.
+            raise WebSocketTimeoutException("Connection timed out")
+        if not sent:
+            continue
+        total += sent
+        while index < len(views) and sent >= views[index].nbytes:
+            sent -= views[index].nbytes
+            index += 1
+        if sent:
+            views[index] = views[index][sent:]
+    return total
+
+
+def _send_with(sock: socket, send_fn) -> int:
+    if not sock:
+        raise WebSocketConnectionClosedException("socket is already closed.")
 
     try:
         if sock.gettimeout() == 0:
-            return sock.send(data)
+            return send_fn()
         else:
-            return _send()
+            return _send_or_wait(sock, send_fn)
     except socket.timeout as e:
         message = extract_err_message(e)
         raise WebSocketTimeoutException(message)
@@ -177,3 +278,25 @@ def send(sock: socket, data: bytes) -> int:
             raise WebSocketTimeoutException(message)
         else:
             raise
+
+
+def _send_or_wait(sock: socket, send_fn) -> int:
+    try:
+        return send_fn()
+    except SSLWantWriteError:
+        pass
+    except socket.error as exc:
+        error_code = extract_error_code(exc)
+        if error_code is None:
+            raise
+        if error_code != errno.EAGAIN and error_code != errno.EWOULDBLOCK:
+            raise
+
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_WRITE)
+
+    w = sel.select(sock.gettimeout())
+    sel.close()
+
+    if w:
+        return send_fn()
@@ -16,7 +16,9 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-__all__ = ["NoLock", "validate_utf8", "extract_err_message", "extract_error_code"]
+from codecs import getincrementaldecoder, utf_8_decode
+
+__all__ = ["NoLock", "validate_utf8", "Utf8Validator", "extract_err_message", "extract_error_code"]
 
 
 class NoLock:
@@ -29,57 +31,24 @@ class NoLock:
 
 
 try:
-    # If wsaccel is available we use compiled routines to validate UTF-8
-    # strings.
-    from wsaccel.utf8validator import Utf8Validator
-
-    def _validate_utf8(utfbytes: bytes) -> bool:
-        return Utf8Validator().validate(utfbytes)[0]
-
+    # If wsaccel is available, its compiled validator is the first choice.
+    # Note that wsaccel is unmaintained.
+    from wsaccel.utf8validator import Utf8Validator as _wsaccel_validator
 except ImportError:
-    # UTF-8 validator
-    # python implementation of http://bjoern.hoehrmann.de/utf-8/decoder/dfa/
-
-    _UTF8_ACCEPT = 0
-    _UTF8_REJECT = 12
-
-    _UTF8D = [
-        # The first part of the table maps bytes to character classes that
-        # to reduce the size of the transition table and create bitmasks.
-        0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,  0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
-        0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,  0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
-        0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,  0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
-        0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,  0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
-        1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,  9,9,9,9,9,9,9,9,9,9,9,9,9,9,9,9,
-        7,7,7,7,7,7,7,7,7,7,7,7,7,7,7,7,  7,7,7,7,7,7,7,7,7,7,7,7,7,7,7,7,
-        8,8,2,2,2,2,2,2,2,2,2,2,2,2,2,2,  2,2,2,2,2,2,2,2,2,2,2,2,2,2,2,2,
-        10,3,3,3,3,3,3,3,3,3,3,3,3,4,3,3, 11,6,6,6,5,8,8,8,8,8,8,8,8,8,8,8,
-
-        # The second part is a transition table that maps a combination
-        # of a state of the automaton and a character class to a state.
-        0,12,24,36,60,96,84,12,12,12,48,72, 12,12,12,12,12,12,12,12,12,12,12,12,
-        12, 0,12,12,12,12,12, 0,12, 0,12,12, 12,24,12,12,12,12,12,24,12,24,12,12,
-        12,12,12,12,12,12,12,24,12,12,12,12, 12,24,12,12,12,12,12,12,12,24,12,12,
-        12,12,12,12,12,12,12,36,12,36,12,12, 12,36,12,12,12,12,12,36,12,36,12,12,
-        12,36,12,12,12,12,12,12,12,12,12,12, ]
-
-    def _decode(state, codep, ch) -> tuple:
-        tp = _UTF8D[ch]
-
-        codep = (ch & 0x3f) | (codep << 6) if (
-            state != _UTF8_ACCEPT) else (0xff >> tp) & ch
-        state = _UTF8D[256 + state + tp]
-
-        return state, codep
+    _wsaccel_validator = None
+
 
+if _wsaccel_validator is not None:
     def _validate_utf8(utfbytes: bytes) -> bool:
-        state = _UTF8_ACCEPT
-        codep = 0
-        for i in utfbytes:
-            state, codep = _decode(state, codep, i)
-            if state == _UTF8_REJECT:
-                return False
+        valid, ends_on_codepoint = _wsaccel_validator().validate(utfbytes)[:2]
+        return valid and ends_on_codepoint
 
+else:
+    def _validate_utf8(utfbytes: bytes) -> bool:
+        try:
+            utf_8_decode(utfbytes, "strict", True)
+        except UnicodeDecodeError:
+            return False
         return True
 
 
@@ -92,6 +61,41 @@ def validate_utf8(utfbytes: str) -> bool:
     return _validate_utf8(utfbytes)
 
 
+class Utf8Validator:
+    """
+    Validate an utf8 byte string received in several parts, such as a
+    fragmented text message, without joining them.
+    """
+
+    def __init__(self) -> None:
+        if _wsaccel_validator is not None:
+            self._decoder = _wsaccel_validator()
+        else:
+            self._decoder = getincrementaldecoder("utf-8")()
+
+    def reset(self) -> None:
+        self._decoder.reset()
+
+    def validate(self, utfbytes: bytes, final: bool = False) -> bool:
+        """
+        Check the next part. final must be set for the last one, so that
+        a truncated sequence at the end is refused.
+        return value: false as soon as the bytes received so far cannot
+        start a valid utf8 string.
+        """
+        if _wsaccel_validator is not None:
+            valid, ends_on_codepoint = self._decoder.validate(utfbytes)[:2]
+            if final or not valid:
+                self._decoder.reset()
+            return valid and (ends_on_codepoint or not final)
+        try:
+            self._decoder.decode(utfbytes, final)
+        except UnicodeDecodeError:
+            self._decoder.reset()
+            return False
+        return True
+
+
 def extract_err_message(exception: Exception) -> str or None:
     if exception.args:
         return exception.args[0]
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 #
 import websocket as ws
+from websocket import _abnf
 from websocket._abnf import *
 import unittest
 
@@ -59,6 +60,28 @@ class ABNFTest(unittest.TestCase):
         abnf_str_data = ABNF(0,0,0,0, opcode=ABNF.OPCODE_PING, mask=1, data="a")
         self.assertEqual(abnf_str_data._get_masked(bytes_val), b'aaaa\x00')
 
+    def testMaskSizes(self):
+        mask_key = b"\x5a\xa5\x0f\xf0"
+        for size in (0, 1, 5, 1023, 1024, 1027, 65543, 200003):
+            data = bytes(i % 251 for i in range(size))
+            expected = bytes(b ^ mask_key[i % 4] for i, b in enumerate(data))
+            self.assertEqual(ABNF.mask(mask_key, data), expected)
+            self.assertEqual(ABNF.mask(mask_key, memoryview(bytearray(data))), expected)
+            self.assertEqual(_abnf._mask_python(mask_key, data), expected)
+            buffer = bytearray(data)
+            _abnf._mask_python_inplace(mask_key, buffer)
+            self.assertEqual(buffer, expected)
+            buffer = bytearray(b"--" + data + b"--")
+            ABNF.mask_inplace(mask_key, memoryview(buffer)[2:-2])
+            self.assertEqual(buffer, b"--" + expected + b"--")
+            if _abnf.XorMaskerSimple is not None:
+                self.assertEqual(_abnf._mask_wsaccel(mask_key, data), expected)
+            if _abnf.numpy is not None:
+                self.assertEqual(_abnf._mask_numpy(mask_key, data), expected)
+                buffer = bytearray(data)
+                _abnf._mask_numpy_inplace(mask_key, buffer)
+                self.assertEqual(buffer, expected)
+
     def testFormat(self):
         abnf_bad_rsv_bits = ABNF(2,0,0,0, opcode=ABNF.OPCODE_TEXT)
         self.assertRaises(ValueError, abnf_bad_rsv_bits.format)
@@ -74,6 +97,24 @@ class ABNFTest(unittest.TestCase):
         abnf_no_mask = ABNF(0,0,0,0, opcode=ABNF.OPCODE_TEXT, mask=0, data=b'\x01\x8a\xcc')
         self.assertEqual(b'\x01\x03\x01\x8a\xcc', abnf_no_mask.format())
 
+    def testFormatInto(self):
+        for size in (0, 5, 125, 126, 4096, 65535, 65536, 70001):
+            data = bytes(i % 251 for i in range(size))
+            frame = ABNF(1, 0, 0, 0, ABNF.OPCODE_BINARY, 1, data)
+            frame.get_mask_key = lambda n: b"\x5a\xa5\x0f\xf0"
+            buffer = bytearray(b"--")
+            self.assertIsNone(frame.format_into(buffer))
+            self.assertEqual(buffer, b"--" + frame.format())
+            frame.mask = 0
+            buffer = bytearray()
+            payload = frame.format_into(buffer, False)
+            if size >= 4096:
+                self.assertIs(payload, data)
+                self.assertEqual(buffer + payload, frame.format())
+            else:
+                self.assertIsNone(payload)
+                self.assertEqual(buffer, frame.format())
+
     def testFrameBuffer(self):
         fb = frame_buffer(0, True)
         self.assertEqual(fb.recv, 0)
@@ -84,6 +125,67 @@ class ABNFTest(unittest.TestCase):
         self.assertEqual(fb.mask, None)
         self.assertEqual(fb.has_mask(), False)
 
+    def testFrameBufferFeed(self):
+        frames = [ABNF(1,0,0,0, opcode=ABNF.OPCODE_TEXT, data="a" * 10),
+                  ABNF(1,0,0,0, opcode=ABNF.OPCODE_BINARY, data=b"b" * 300),
+                  ABNF(1,0,0,0, opcode=ABNF.OPCODE_BINARY, data=b"c" * 70000)]
+        wire = b"".join(f.format() for f in frames)
+
+        def no_data(bufsize):
+            raise BlockingIOError
+
+        fb = frame_buffer(no_data, False)
+        received = []
+        for i in range(0, len(wire), 7):
+            fb.feed(wire[i:i + 7])
+            try:
+                while True:
+                    received.append(fb.recv_frame())
+            except BlockingIOError:
+                pass
+        self.assertEqual([f.data for f in received], [b"a" * 10, b"b" * 300, b"c" * 70000])
+        self.assertEqual(fb.pending(), 0)
+
+    def testFrameBufferHasFrame(self):
+        frames = [ABNF(1,0,0,0, opcode=ABNF.OPCODE_TEXT, data="a" * 10),
+                  ABNF(1,0,0,0, opcode=ABNF.OPCODE_BINARY, mask=1, data=b"b" * 300),
+                  ABNF(1,0,0,0, opcode=ABNF.OPCODE_BINARY, data=b"c" * 70000),
+                  ABNF(1,0,0,0, opcode=ABNF.OPCODE_PING, data=b"")]
+        wire = b"".join(f.format() for f in frames)
+
+        def no_data(bufsize):
+            raise BlockingIOError
+
+        fb = frame_buffer(no_data, False)
+        received = []
+        for i in range(0, len(wire), 5):
+            fb.feed(wire[i:i + 5])
+            while True:
+                has_frame = fb.has_frame()
+                try:
+                    received.append(fb.recv_frame())
+                except BlockingIOError:
+                    self.assertFalse(has_frame)
+                    break
+                self.assertTrue(has_frame)
+        self.assertEqual(len(received), 4)
+        self.assertFalse(fb.has_frame())
+
+    def testFrameBufferRecvInto(self):
+        wire = ABNF(1,0,0,0, opcode=ABNF.OPCODE_BINARY, data=b"\x01\x02" * 40000).format()
+        wire += ABNF(1,0,0,0, opcode=ABNF.OPCODE_TEXT, data="end").format()
+        chunks = [wire[i:i + 1000] for i in range(0, len(wire), 1000)]
+
+        def recv_into(buffer):
+            chunk = chunks.pop(0)
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+
+        fb = frame_buffer(None, False, recv_into)
+        self.assertEqual(fb.recv_frame().data, b"\x01\x02" * 40000)
+        self.assertEqual(fb.recv_frame().data, b"end")
+        self.assertEqual(chunks, [])
+
 
 if __name__ == "__main__":
     unittest.main()
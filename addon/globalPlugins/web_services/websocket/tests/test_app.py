@@ -2,10 +2,13 @@
 #
 import os
 import os.path
+import socketserver
 import threading
+import time
 import websocket as ws
 import ssl
 import unittest
+from websocket._handshake import _create_accept_key
 
 """
 test_app.py
@@ -34,6 +37,139 @@ TEST_WITH_LOCAL_SERVER = LOCAL_WS_SERVER_PORT != '-1'
 TRACEABLE = True
 
 
+class EchoHandler(socketserver.BaseRequestHandler):
+    """
+    Echoes messages and answers pings. "bye" drops the connection without
+    closing it.
+    """
+
+    def handle(self):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            data = self.request.recv(4096)
+            if not data:
+                return
+            request += data
+        key = [line.split(": ", 1)[1] for line in request.decode().split("\r\n")
+               if line.lower().startswith("sec-websocket-key")][0]
+        self.request.sendall(("HTTP/1.1 101 Switching Protocols\r\n"
+                              "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                              "Sec-WebSocket-Accept: {accept}\r\n\r\n").format(
+                                  accept=_create_accept_key(key)).encode())
+        frames = ws.frame_buffer(self.recv, True)
+        try:
+            while True:
+                frame = frames.recv_frame()
+                if frame.opcode == ws.ABNF.OPCODE_PING:
+                    self.send(ws.ABNF.OPCODE_PONG, frame.data)
+                elif frame.opcode == ws.ABNF.OPCODE_CLOSE:
+                    self.send(ws.ABNF.OPCODE_CLOSE, frame.data[:2])
+                    return
+                elif frame.data == b"bye":
+                    return
+                else:
+                    self.send(frame.opcode, frame.data)
+        except (OSError, ws.WebSocketException):
+            pass
+
+    def recv(self, bufsize):
+        data = self.request.recv(bufsize)
+        if not data:
+            raise ws.WebSocketConnectionClosedException("closed")
+        return data
+
+    def send(self, opcode, data):
+        self.request.sendall(ws.ABNF(1, 0, 0, 0, opcode, 0, data).format())
+
+
+class EchoServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class MultiplexDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EchoServer(("127.0.0.1", 0), EchoHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "ws://127.0.0.1:%d/" % self.server.server_address[1]
+        self.dispatcher = ws.MultiplexDispatcher()
+        self.dispatcher.start()
+
+    def tearDown(self):
+        self.dispatcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testTimers(self):
+        calls = []
+
+        def repeat():
+            calls.append("repeat")
+            return calls.count("repeat") < 3
+        self.dispatcher.timeout(0.05, repeat)
+        self.dispatcher.timeout(0.01, lambda: calls.append("once"))
+        self.assertTrue(wait_until(lambda: len(calls) == 4))
+        self.assertEqual(calls, ["once", "repeat", "repeat", "repeat"])
+        time.sleep(0.1)
+        self.assertEqual(len(calls), 4)
+
+    def testConnections(self):
+        received = []
+        threads = set()
+
+        def on_open(app):
+            app.send("hello")
+
+        def on_message(app, message):
+            threads.add(threading.current_thread())
+            received.append((app, message))
+            if message == "hello":
+                # Both messages arrive together: the second one waits in
+                # the frame buffer.
+                app.sock.send_many([ws.ABNF.create_frame("one", ws.ABNF.OPCODE_TEXT),
+                                    ws.ABNF.create_frame("two", ws.ABNF.OPCODE_TEXT)])
+
+        apps = [ws.WebSocketApp(self.url, on_open=on_open, on_message=on_message) for i in range(3)]
+        for app in apps:
+            # Returns once connected.
+            app.run_forever(dispatcher=self.dispatcher, ping_interval=0.1, ping_timeout=0.05)
+        self.assertTrue(wait_until(lambda: len(received) == 9))
+        for app in apps:
+            self.assertEqual([message for a, message in received if a is app], ["hello", "one", "two"])
+        self.assertEqual(threads, {self.dispatcher.thread})
+        self.assertTrue(wait_until(lambda: all(app.metrics.snapshot()["rtt_last"] is not None for app in apps)))
+        self.assertTrue(all(app.ping_thread is None for app in apps))
+
+        for app in apps:
+            app.close()
+        # Closed sockets are dropped; only the wakeup socket is left.
+        self.assertTrue(wait_until(lambda: len(self.dispatcher.selector.get_map()) == 1))
+
+    def testReconnect(self):
+        opened = []
+
+        def on_open(app):
+            opened.append(app)
+            if len(opened) == 1:
+                app.send("bye")
+
+        app = ws.WebSocketApp(self.url, on_open=on_open)
+        app.run_forever(dispatcher=self.dispatcher, reconnect=0.05)
+        self.assertTrue(wait_until(lambda: len(opened) == 2))
+        self.assertEqual(app.metrics.reconnects, 1)
+        app.close()
+
+
 class WebSocketAppTest(unittest.TestCase):
 
     class NotSetYet:
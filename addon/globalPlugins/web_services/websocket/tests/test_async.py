@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+#
+import asyncio
+import struct
+import unittest
+import websocket as ws
+from websocket._abnf import ABNF
+from websocket._handshake import _create_accept_key
+
+"""
+test_async.py
+websocket - WebSocket client library for Python
+
+Not part of upstream websocket-client: added to the copy of the package
+bundled with the NVDA Web Services add-on, under the same license as the
+rest of the package.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+def _no_data(bufsize):
+    raise BlockingIOError
+
+
+class ServerConnection:
+    """
+    Server side of a connection, reading the client's frames with the
+    client's own frame_buffer.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.frames = ws.frame_buffer(_no_data, False)
+
+    async def accept(self):
+        request = await self.reader.readuntil(b"\r\n\r\n")
+        headers = dict(line.split(": ", 1) for line in request.decode("utf-8").split("\r\n")[1:] if line)
+        self.writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                           "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                           "Sec-WebSocket-Accept: {accept}\r\n\r\n").format(
+                               accept=_create_accept_key(headers["Sec-WebSocket-Key"])).encode("utf-8"))
+
+    def send(self, data, opcode=ABNF.OPCODE_TEXT, fin=1):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.writer.write(ABNF(fin, 0, 0, 0, opcode, 0, data).format())
+
+    async def recv_frame(self):
+        while True:
+            try:
+                return self.frames.recv_frame()
+            except BlockingIOError:
+                data = await self.reader.read(4096)
+                if not data:
+                    raise ws.WebSocketConnectionClosedException("closed")
+                self.frames.feed(data)
+
+
+def run(scenario, client, **options):
+    """
+    Runs client against a server running scenario.
+    """
+    async def main():
+        async def handle(reader, writer):
+            connection = ServerConnection(reader, writer)
+            await connection.accept()
+            try:
+                await scenario(connection)
+            finally:
+                writer.close()
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            websock = await ws.create_async_connection("ws://127.0.0.1:%d/" % port, **options)
+            return await asyncio.wait_for(client(websock), 5)
+        finally:
+            server.close()
+            await server.wait_closed()
+    return asyncio.run(main())
+
+
+class AsyncWebSocketTest(unittest.TestCase):
+
+    def testEcho(self):
+        async def scenario(server):
+            while True:
+                frame = await server.recv_frame()
+                if frame.opcode == ABNF.OPCODE_CLOSE:
+                    server.send(frame.data, ABNF.OPCODE_CLOSE)
+                    return
+                server.send(frame.data, frame.opcode)
+
+        async def client(websock):
+            await websock.send("Hello, World")
+            self.assertEqual(await websock.recv(), "Hello, World")
+            await websock.send_binary(b"\x00\xff")
+            self.assertEqual(await websock.recv_data(), (ABNF.OPCODE_BINARY, b"\x00\xff"))
+            await websock.close()
+            self.assertFalse(websock.connected)
+            self.assertEqual(websock.close_status, ws.STATUS_NORMAL)
+            with self.assertRaises(ws.WebSocketConnectionClosedException):
+                await websock.send("Too late")
+        run(scenario, client)
+
+    def testIterationAndFragments(self):
+        async def scenario(server):
+            server.send("Brevity is ", fin=0)
+            server.send(b"the soul ", ABNF.OPCODE_PING)
+            server.send("of wit", ABNF.OPCODE_CONT)
+            server.send("second")
+            pong = await server.recv_frame()
+            self.assertEqual((pong.opcode, pong.data), (ABNF.OPCODE_PONG, b"the soul "))
+            server.send(struct.pack("!H", ws.STATUS_GOING_AWAY) + b"bye", ABNF.OPCODE_CLOSE)
+            close = await server.recv_frame()
+            self.assertEqual(close.opcode, ABNF.OPCODE_CLOSE)
+
+        async def client(websock):
+            messages = [message async for message in websock]
+            self.assertEqual(messages, ["Brevity is of wit", "second"])
+            self.assertEqual((websock.close_status, websock.close_reason), (ws.STATUS_GOING_AWAY, b"bye"))
+            with self.assertRaises(ws.WebSocketConnectionClosedException):
+                await websock.recv()
+        run(scenario, client)
+
+    def testInvalidUtf8ClosesConnection(self):
+        async def scenario(server):
+            server.send(b"\xce\xba\xed\xa0\x80")
+            close = await server.recv_frame()
+            self.assertEqual(struct.unpack("!H", close.data[:2])[0], ws.STATUS_INVALID_PAYLOAD)
+
+        async def client(websock):
+            with self.assertRaises(ws.WebSocketPayloadException):
+                await websock.recv()
+            self.assertFalse(websock.connected)
+        run(scenario, client)
+
+    def testMaxMessageSizeAndFragments(self):
+        async def scenario(server):
+            server.send("Brevity is ", fin=0)
+            server.send("the soul of wit", ABNF.OPCODE_CONT)
+            server.send(b"x" * 100, ABNF.OPCODE_BINARY)
+            close = await server.recv_frame()
+            self.assertEqual(struct.unpack("!H", close.data[:2])[0], ws.STATUS_MESSAGE_TOO_BIG)
+
+        fragments = []
+
+        async def client(websock):
+            with self.assertRaises(ws.WebSocketMessageTooBigException):
+                await websock.recv()
+            self.assertFalse(websock.connected)
+        run(scenario, client, max_message_size=64, on_fragment=lambda *args: fragments.append(args))
+        self.assertEqual(fragments, [(ABNF.OPCODE_TEXT, b"Brevity is ", 0),
+                                     (ABNF.OPCODE_TEXT, b"the soul of wit", 1)])
+
+    def testPingTimeout(self):
+        async def scenario(server):
+            frame = await server.recv_frame()
+            self.assertEqual((frame.opcode, frame.data), (ABNF.OPCODE_PING, b"keepalive"))
+            # Never answered: the client gives up.
+            await server.reader.read()
+
+        async def client(websock):
+            with self.assertRaises(ws.WebSocketTimeoutException):
+                await websock.recv()
+            self.assertGreater(websock.last_ping_tm, 0)
+        run(scenario, client, ping_interval=0.2, ping_timeout=0.1, ping_payload="keepalive")
+
+    def testBadStatus(self):
+        async def main():
+            async def handle(reader, writer):
+                await reader.readuntil(b"\r\n\r\n")
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 4\r\n\r\nnope")
+                writer.close()
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                with self.assertRaises(ws.WebSocketBadStatusException) as context:
+                    await ws.create_async_connection("ws://127.0.0.1:%d/" % port)
+                self.assertEqual(context.exception.status_code, 404)
+                self.assertEqual(context.exception.resp_body, b"nope")
+            finally:
+                server.close()
+                await server.wait_closed()
+        asyncio.run(main())
+
+    def testPingTimeoutMustBeShorter(self):
+        self.assertRaises(ws.WebSocketException, ws.AsyncWebSocket, ping_interval=1, ping_timeout=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
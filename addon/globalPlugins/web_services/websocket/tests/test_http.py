@@ -3,9 +3,12 @@
 import os
 import os.path
 import websocket as ws
-from websocket._http import proxy_info, read_headers, _start_proxied_socket, _tunnel, _get_addrinfo_list, connect
+from websocket._http import proxy_info, read_headers, _start_proxied_socket, _tunnel, _get_addrinfo_list, connect, \
+    _interleave_families, _open_socket
 import unittest
+import select
 import ssl
+from unittest import mock
 import websocket
 import socket
 
@@ -95,6 +98,108 @@ class HttpTest(unittest.TestCase):
         # header02.txt is intentionally malformed
         self.assertRaises(ws.WebSocketException, read_headers, HeaderSockMock("data/header02.txt"))
 
+    def testReadHeaderChunks(self):
+        with open(os.path.join(os.path.dirname(__file__), "data/header01.txt"), "rb") as f:
+            header = f.read()
+        # The header end is split between packets, and followed by a frame.
+        s = SockMock()
+        s.add_packet(header[:-3])
+        s.add_packet(header[-3:] + b"\x81\x02Hi")
+        rest = bytearray()
+        status, headers, status_message = read_headers(s, rest)
+        self.assertEqual(status, 101)
+        self.assertEqual(headers["sec-websocket-accept"], "Kxep+hNu9n51529fGidYu7a3wO0=")
+        self.assertEqual(rest, b"\x81\x02Hi")
+        s = SockMock()
+        s.add_packet(header + b"\x81\x02Hi")
+        self.assertRaises(ws.WebSocketException, read_headers, s)
+        s = SockMock()
+        s.add_packet(b"HTTP/1.1 101 Switching Protocols\r\n" + b"X-Padding: 0123456789abcdef\r\n" * 4096)
+        self.assertRaises(ws.WebSocketException, read_headers, s)
+
+    def testResolver(self):
+        class Resolver:
+            def __init__(self, addresses):
+                self.addresses = addresses
+                self.invalidated = []
+
+            def getaddrinfo(self, host, port, family, socktype, proto):
+                return [(socket.AF_INET, socket.SOCK_STREAM, socket.SOL_TCP, "", (self.addresses[host], port))]
+
+            def invalidate(self, host):
+                self.invalidated.append(host)
+
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        resolver = Resolver({"refused.test": "127.0.0.1", "unreachable.test": "192.0.2.1"})
+        opts = OptsList()
+        opts.timeout = 0.2
+        ws.setdefaultresolver(resolver)
+        try:
+            self.assertEqual(_get_addrinfo_list("refused.test", port, False, proxy_info())[0][0][4],
+                             ("127.0.0.1", port))
+            # The host answered: its address is kept.
+            self.assertRaises(ConnectionRefusedError, connect, "ws://refused.test:%d/" % port, opts, proxy_info(), None)
+            self.assertEqual(resolver.invalidated, [])
+            with mock.patch("websocket._http._open_socket", side_effect=socket.timeout("timed out")):
+                self.assertRaises(socket.timeout, connect, "ws://unreachable.test:%d/" % port, opts, proxy_info(), None)
+            self.assertEqual(resolver.invalidated, ["unreachable.test"])
+        finally:
+            ws.setdefaultresolver(None)
+
+    def testInterleaveFamilies(self):
+        v6 = [(socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("::%d" % i, 80, 0, 0)) for i in range(3)]
+        v4 = [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("10.0.0.%d" % i, 80)) for i in range(2)]
+        self.assertEqual(_interleave_families(v6 + v4), [v6[0], v4[0], v6[1], v4[1], v6[2]])
+
+    def testOpenSocketFallback(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        refused_port = closed.getsockname()[1]
+        closed.close()
+        # With a backlog of 0 and one connection pending, connections hang.
+        stalled = socket.socket()
+        stalled.bind(("127.0.0.1", 0))
+        stalled.listen(0)
+        filler = socket.create_connection(stalled.getsockname())
+        probe = socket.socket()
+        probe.setblocking(False)
+        probe.connect_ex(stalled.getsockname())
+        try:
+            addrinfo = lambda address: (socket.AF_INET, socket.SOCK_STREAM, socket.SOL_TCP, "", address)
+            attempts = []
+            sock = _open_socket([addrinfo(("127.0.0.1", refused_port)), addrinfo(listener.getsockname())], [], 5, attempts)
+            sock.close()
+            self.assertIsInstance(attempts[0].error, ConnectionRefusedError)
+            self.assertTrue(attempts[1].connected)
+            # The refused attempt did not delay the next one.
+            self.assertLess(attempts[1].start, 0.2)
+
+            if select.select([], [probe], [], 0.05)[1]:
+                self.skipTest("connections to a full backlog do not hang here")
+            attempts = []
+            sock = _open_socket([addrinfo(stalled.getsockname()), addrinfo(listener.getsockname())], [], 5, attempts)
+            sock.close()
+            self.assertFalse(attempts[0].connected)
+            self.assertIsNone(attempts[0].error)
+            self.assertTrue(attempts[1].connected)
+            self.assertGreaterEqual(attempts[1].start, ws._http.CONNECTION_ATTEMPT_DELAY)
+            self.assertLess(attempts[1].start, 2)
+
+            attempts = []
+            self.assertRaises(socket.timeout, _open_socket, [addrinfo(stalled.getsockname())], [], 0.1, attempts)
+            self.assertIsInstance(attempts[0].error, socket.timeout)
+        finally:
+            probe.close()
+            filler.close()
+            stalled.close()
+            listener.close()
+
     def testTunnel(self):
         self.assertRaises(ws.WebSocketProxyException, _tunnel, HeaderSockMock("data/header01.txt"), "example.com", 80, ("username", "password"))
         self.assertRaises(ws.WebSocketProxyException, _tunnel, HeaderSockMock("data/header02.txt"), "example.com", 80, ("username", "password"))
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+import unittest
+import websocket as ws
+from websocket._http import connect_attempt
+
+"""
+test_metrics.py
+websocket - WebSocket client library for Python
+
+Not part of upstream websocket-client: added to the copy of the package
+bundled with the NVDA Web Services add-on, under the same license as the
+rest of the package.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ConnectionMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.metrics = ws.connection_metrics(rate_window=10, clock=self.clock)
+
+    def testRtt(self):
+        metrics = self.metrics
+        first = metrics.ping_sent("keepalive")
+        second = metrics.ping_sent("keepalive")
+        self.assertEqual((first, second), (b"keepalive#1", b"keepalive#2"))
+        self.clock.now += 0.02
+        # Unsolicited pongs are ignored.
+        self.assertIsNone(metrics.pong_received(b"keepalive"))
+        # The second ping is answered: the first one will not be.
+        self.assertAlmostEqual(metrics.pong_received(second), 0.02)
+        self.assertIsNone(metrics.pong_received(first))
+        third = metrics.ping_sent(b"keepalive")
+        self.clock.now += 0.3
+        self.assertAlmostEqual(metrics.pong_received(third), 0.3)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual((snapshot["pings_sent"], snapshot["pings_unanswered"], snapshot["pings_pending"]),
+                         (3, 1, 0))
+        self.assertAlmostEqual(snapshot["rtt_last"], 0.3)
+        self.assertAlmostEqual(snapshot["rtt_avg"], 0.16)
+        self.assertAlmostEqual(metrics.rtt_percentile(0), 0.02)
+        self.assertAlmostEqual(metrics.rtt_percentile(0.9), 0.3)
+        histogram = dict(metrics.rtt_histogram())
+        self.assertEqual((histogram[0.025], histogram[0.5], histogram[None]), (1, 1, 0))
+        self.assertEqual(sum(histogram.values()), 2)
+
+        # Payloads stay within the size of a control frame.
+        self.assertEqual(len(metrics.ping_sent("x" * 200)), 125)
+
+    def testRates(self):
+        metrics = self.metrics
+        for i in range(20):
+            metrics.message_sent(100)
+            self.clock.now += 0.5
+        metrics.message_received(1000, 0)
+        metrics.message_received(1000, 1)
+        snapshot = metrics.snapshot()
+        self.assertEqual((snapshot["sent_messages"], snapshot["sent_bytes"]), (20, 2000))
+        self.assertEqual((snapshot["received_messages"], snapshot["received_bytes"]), (1, 2000))
+        self.assertAlmostEqual(snapshot["sent_messages_per_sec"], 2, delta=0.2)
+        self.assertAlmostEqual(snapshot["received_bytes_per_sec"], 200)
+        self.clock.now += 60
+        snapshot = metrics.snapshot()
+        self.assertEqual((snapshot["sent_messages_per_sec"], snapshot["received_bytes_per_sec"]), (0, 0))
+        self.assertEqual(snapshot["sent_messages"], 20)
+
+    def testReconnects(self):
+        metrics = self.metrics
+        attempt = connect_attempt(("127.0.0.1", 4455), None, 0.25)
+        attempt.elapsed = 0.01
+        attempt.connected = True
+        metrics.connected([connect_attempt(("::1", 4455), None, 0), attempt])
+        self.assertAlmostEqual(metrics.connect_time, 0.26)
+        pending = metrics.ping_sent()
+        self.clock.now += 5
+        metrics.disconnected()
+        self.clock.now += 3
+        # Failed attempts do not restart the count.
+        metrics.disconnected()
+        self.clock.now += 3
+        metrics.connected()
+        self.assertIsNone(metrics.pong_received(pending))
+        snapshot = metrics.snapshot()
+        self.assertEqual((snapshot["reconnects"], snapshot["reconnect_durations"]), (1, [6]))
+        self.assertEqual(snapshot["connected_for"], 0)
+        self.assertIsNone(snapshot["disconnected_for"])
+        self.assertIsNone(snapshot["connect_time"])
+
+    def testWebSocketApp(self):
+        app = ws.WebSocketApp("ws://127.0.0.1:4455/")
+        self.assertIsInstance(app.metrics, ws.connection_metrics)
+        self.assertIsNone(app.metrics.snapshot()["rtt_last"])
+
+
+if __name__ == "__main__":
+    unittest.main()
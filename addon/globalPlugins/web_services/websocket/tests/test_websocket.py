@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
 #
+import errno
 import os
 import os.path
 import socket
+import threading
 import websocket as ws
 import unittest
-from websocket._handshake import _create_sec_websocket_key, \
+import zlib
+from websocket._deflate import PerMessageDeflate
+from websocket._handshake import _create_accept_key, _create_sec_websocket_key, \
     _validate as _validate_header
 from websocket._http import read_headers
-from websocket._utils import validate_utf8
+from websocket._utils import validate_utf8, Utf8Validator
 from base64 import decodebytes as base64decode
 
 """
@@ -180,6 +184,86 @@ class WebSocketTest(unittest.TestCase):
 
         self.assertEqual(sock.send_binary(b'1111111111101'), 19)
 
+    def testSendMany(self):
+        sock = ws.WebSocket()
+        sock.set_mask_key(create_mask_key)
+        s = sock.sock = SockMock()
+        frames = [ws.ABNF.create_frame("Hello", ws.ABNF.OPCODE_TEXT),
+                  ws.ABNF.create_frame(b"\x00" * 70000, ws.ABNF.OPCODE_BINARY)]
+        for frame in frames:
+            frame.get_mask_key = create_mask_key
+        expected = frames[0].format() + frames[1].format()
+        self.assertEqual(sock.send_many(frames), len(expected))
+        self.assertEqual(len(s.sent), 1)
+        self.assertEqual(s.sent[0], expected)
+        # The buffer of the previous frames is still referenced by the mock.
+        sock.send("Hello")
+        self.assertEqual(s.sent[1], b'\x81\x85abcd)\x07\x0f\x08\x0e')
+
+    def testSendBuffersPartial(self):
+        class PartialSockMock(SockMock):
+            def send(self, data):
+                SockMock.send(self, bytes(data[:7]))
+                return min(len(data), 7)
+
+        s = PartialSockMock()
+        self.assertEqual(ws.send_buffers(s, [b"0123456789", b"", bytearray(b"abc"), memoryview(b"xyz")]), 16)
+        self.assertEqual(b"".join(s.sent), b"0123456789abcxyz")
+
+        a, b = socket.socketpair()
+        try:
+            buffers = [bytes([i]) * (i * 997) for i in range(40)]
+            a.setblocking(True)
+            b.settimeout(5)
+            expected = b"".join(buffers)
+            received = bytearray()
+
+            def reader():
+                while len(received) < len(expected):
+                    received.extend(b.recv(65536))
+            thread = threading.Thread(target=reader)
+            thread.start()
+            self.assertEqual(ws.send_buffers(a, buffers), len(expected))
+            thread.join(5)
+            self.assertEqual(received, expected)
+        finally:
+            a.close()
+            b.close()
+
+    def testSendBuffersTimeout(self):
+        class FullSockMock:
+            """Socket whose send buffer stays full."""
+            def __init__(self, sock):
+                self.sock = sock
+
+            def fileno(self):
+                return self.sock.fileno()
+
+            def gettimeout(self):
+                return 0.05
+
+            def send(self, data):
+                raise BlockingIOError(errno.EAGAIN, "Resource temporarily unavailable")
+
+        class FullGatherSockMock(FullSockMock):
+            def sendmsg(self, buffers):
+                raise BlockingIOError(errno.EAGAIN, "Resource temporarily unavailable")
+
+        a, b = socket.socketpair()
+        try:
+            a.setblocking(False)
+            try:
+                while True:
+                    a.send(b"x" * 65536)
+            except BlockingIOError:
+                pass
+            for cls in (FullSockMock, FullGatherSockMock):
+                with self.assertRaises(ws.WebSocketTimeoutException):
+                    ws.send_buffers(cls(a), [b"abc", b"def"])
+        finally:
+            a.close()
+            b.close()
+
     def testRecv(self):
         # TODO: add longer frame data
         sock = ws.WebSocket()
@@ -225,6 +309,24 @@ class WebSocketTest(unittest.TestCase):
         with self.assertRaises(ws.WebSocketConnectionClosedException):
             sock.frame_buffer.recv_strict(1)
 
+    def testHandshakeRest(self):
+        class HandshakeSockMock(SockMock):
+            def send(self, data):
+                headers = dict(line.split(": ", 1) for line in bytes(data).decode().split("\r\n")[1:] if line)
+                self.add_packet(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                                 "Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").format(
+                                     accept=_create_accept_key(headers["Sec-WebSocket-Key"])).encode()
+                                + b"\x81\x05Hello\x81\x05World")
+                return SockMock.send(self, data)
+
+        sock = ws.WebSocket()
+        s = HandshakeSockMock()
+        sock.connect("ws://example.com/", socket=s)
+        # Both frames came in the packet of the response header.
+        self.assertEqual(sock.recv(), "Hello")
+        self.assertEqual(sock.recv(), "World")
+        self.assertEqual(s.data, [])
+
     def testRecvTimeout(self):
         sock = ws.WebSocket()
         s = sock.sock = SockMock()
@@ -292,6 +394,22 @@ class WebSocketTest(unittest.TestCase):
         sock.recv()
         self.assertEqual(sock.connected, False)
 
+    def testRecvInvalidUtf8Fragment(self):
+        sock = ws.WebSocket()
+        s = sock.sock = SockMock()
+        # The first fragment is refused before the next one is read.
+        s.add_packet(ws.ABNF(0, 0, 0, 0, ws.ABNF.OPCODE_TEXT, 0, b'ok \xed\xa0\x80').format())
+        s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_CONT, 0, b'more').format())
+        self.assertRaises(ws.WebSocketPayloadException, sock.recv)
+        self.assertEqual(len(s.data), 1)
+
+        # A character split between fragments is accepted.
+        sock = ws.WebSocket(fire_cont_frame=True)
+        s = sock.sock = SockMock()
+        s.add_packet(ws.ABNF(0, 0, 0, 0, ws.ABNF.OPCODE_TEXT, 0, b'\xe3\x81').format())
+        s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_CONT, 0, b'\x93').format())
+        self.assertEqual(sock.recv_data()[1] + sock.recv_data()[1], "こ".encode())
+
     def testRecvContFragmentation(self):
         sock = ws.WebSocket()
         s = sock.sock = SockMock()
@@ -333,6 +451,127 @@ class WebSocketTest(unittest.TestCase):
             s.sent[0],
             b'\x8a\x90abcd1\x0e\x06\x05\x12\x07C4.,$D\x15\n\n\x17')
 
+    def testRecvManyFragments(self):
+        sock = ws.WebSocket()
+        s = sock.sock = SockMock()
+        s.add_packet(ws.ABNF(0, 0, 0, 0, ws.ABNF.OPCODE_BINARY, 0, b'\x00' * 10).format())
+        for i in range(1, 99):
+            s.add_packet(ws.ABNF(0, 0, 0, 0, ws.ABNF.OPCODE_CONT, 0, bytes([i]) * 10).format())
+        s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_CONT, 0, b'\x63' * 10).format())
+        self.assertEqual(sock.recv_data(), (ws.ABNF.OPCODE_BINARY, b''.join(bytes([i]) * 10 for i in range(100))))
+
+    def testRecvMaxMessageSize(self):
+        # A frame larger than the limit is refused before its payload is read.
+        sock = ws.WebSocket(max_message_size=16)
+        s = sock.sock = SockMock()
+        s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_TEXT, 0, b'x' * 17).format()[:2])
+        self.assertRaises(ws.WebSocketMessageTooBigException, sock.recv)
+
+        # So is the fragment which takes a message over the limit.
+        sock = ws.WebSocket(max_message_size=16)
+        s = sock.sock = SockMock()
+        s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_TEXT, 0, b'x' * 16).format())
+        s.add_packet(ws.ABNF(0, 0, 0, 0, ws.ABNF.OPCODE_TEXT, 0, b'x' * 10).format())
+        s.add_packet(ws.ABNF(0, 0, 0, 0, ws.ABNF.OPCODE_CONT, 0, b'x' * 10).format())
+        s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_CONT, 0, b'x' * 10).format())
+        self.assertEqual(sock.recv(), 'x' * 16)
+        self.assertRaises(ws.WebSocketMessageTooBigException, sock.recv)
+        self.assertEqual(len(s.data), 1)
+
+        # Compressed messages are limited once inflated.
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        payload = (compressor.compress(b'x' * 1000) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+        sock = ws.WebSocket(max_message_size=100)
+        s = sock.sock = SockMock()
+        sock._set_deflate(PerMessageDeflate())
+        s.add_packet(ws.ABNF(1, 1, 0, 0, ws.ABNF.OPCODE_TEXT, 0, payload).format())
+        self.assertRaises(ws.WebSocketMessageTooBigException, sock.recv)
+
+    def testRecvOnFragment(self):
+        fragments = []
+        sock = ws.WebSocket(on_fragment=lambda *args: fragments.append(args))
+        s = sock.sock = SockMock()
+        s.add_packet(ws.ABNF(0, 0, 0, 0, ws.ABNF.OPCODE_TEXT, 0, b'Brevity is ').format())
+        s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_PING, 0, b'ping').format())
+        s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_CONT, 0, b'the soul of wit').format())
+        s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_BINARY, 0, b'\x00').format())
+        s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_PONG, 0, b'pong').format())
+        self.assertEqual(sock.recv_data(True), (ws.ABNF.OPCODE_PING, b'ping'))
+        self.assertEqual(fragments, [(ws.ABNF.OPCODE_TEXT, b'Brevity is ', 0)])
+        self.assertEqual(sock.recv_data(True), (ws.ABNF.OPCODE_PONG, b'pong'))
+        self.assertEqual(fragments[1:], [(ws.ABNF.OPCODE_TEXT, b'the soul of wit', 1),
+                                         (ws.ABNF.OPCODE_BINARY, b'\x00', 1)])
+
+    def testPerMessageDeflateNegotiation(self):
+        self.assertEqual(PerMessageDeflate.offer(True), "permessage-deflate; client_max_window_bits")
+        self.assertEqual(PerMessageDeflate.offer({"client_max_window_bits": 10, "server_no_context_takeover": True}),
+                         "permessage-deflate; client_max_window_bits=10; server_no_context_takeover")
+        self.assertRaises(ValueError, PerMessageDeflate.offer, {"server_max_window_bits": 20})
+
+        self.assertIsNone(PerMessageDeflate.accept(None, True))
+        deflate = PerMessageDeflate.accept("permessage-deflate; client_max_window_bits=12; client_no_context_takeover", True)
+        self.assertEqual(deflate.client_max_window_bits, 12)
+        self.assertTrue(deflate.client_no_context_takeover)
+        self.assertFalse(deflate.server_no_context_takeover)
+        deflate = PerMessageDeflate.accept("permessage-deflate", {"client_max_window_bits": 11})
+        self.assertEqual(deflate.client_max_window_bits, 11)
+
+        for header in ("x-webkit-deflate-frame", "permessage-deflate, permessage-deflate",
+                       "permessage-deflate; unknown", "permessage-deflate; client_max_window_bits=16",
+                       "permessage-deflate; client_max_window_bits=8",
+                       "permessage-deflate; server_no_context_takeover=1"):
+            self.assertRaises(ws.WebSocketException, PerMessageDeflate.accept, header, True)
+        self.assertRaises(ws.WebSocketException, PerMessageDeflate.accept,
+                          "permessage-deflate", {"server_no_context_takeover": True})
+        self.assertRaises(ws.WebSocketException, PerMessageDeflate.accept,
+                          "permessage-deflate; client_max_window_bits=12", {"client_max_window_bits": 10})
+
+    def testSendPerMessageDeflate(self):
+        sock = ws.WebSocket()
+        sock.set_mask_key(create_mask_key)
+        s = sock.sock = SockMock()
+        sock._set_deflate(PerMessageDeflate())
+        message = '{"sceneName": "Scene"}' * 20
+        sock.send(message)
+        sock.send(message)
+        sock.send("short")
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        for i in range(2):
+            fb = ws.frame_buffer(None, False)
+            fb.allow_rsv1 = True
+            fb.feed(s.sent[i])
+            frame = fb.recv_frame()
+            self.assertEqual(frame.rsv1, 1)
+            self.assertEqual(decompressor.decompress(frame.data + b"\x00\x00\xff\xff"), message.encode())
+        # The second message reuses the first one's context.
+        self.assertLess(len(s.sent[1]), len(s.sent[0]))
+        self.assertEqual(s.sent[2], b'\x81\x85abcd\x12\n\x0c\x16\x15')
+
+    def testRecvPerMessageDeflate(self):
+        message = b"Brevity is the soul of wit. " * 10
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        payload = (compressor.compress(message) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+        for fire_cont_frame in (False, True):
+            sock = ws.WebSocket(fire_cont_frame=fire_cont_frame)
+            s = sock.sock = SockMock()
+            sock._set_deflate(PerMessageDeflate())
+            half = len(payload) // 2
+            s.add_packet(ws.ABNF(0, 1, 0, 0, ws.ABNF.OPCODE_TEXT, 0, payload[:half]).format())
+            s.add_packet(ws.ABNF(1, 0, 0, 0, ws.ABNF.OPCODE_CONT, 0, payload[half:]).format())
+            if fire_cont_frame:
+                data = sock.recv_data()[1] + sock.recv_data()[1]
+            else:
+                data = sock.recv()
+                self.assertIsInstance(data, str)
+                data = data.encode()
+            self.assertEqual(data, message)
+
+        # Compressed frames are refused when the extension is not in use.
+        sock = ws.WebSocket()
+        s = sock.sock = SockMock()
+        s.add_packet(ws.ABNF(1, 1, 0, 0, ws.ABNF.OPCODE_TEXT, 0, payload).format())
+        self.assertRaises(ws.WebSocketProtocolException, sock.recv)
+
     @unittest.skipUnless(TEST_WITH_LOCAL_SERVER, "Tests using local websocket server are disabled")
     def testWebSocket(self):
         s = ws.create_connection("ws://127.0.0.1:" + LOCAL_WS_SERVER_PORT)
@@ -414,6 +653,31 @@ class UtilsTest(unittest.TestCase):
         state = validate_utf8(b'')
         self.assertEqual(state, True)
 
+    def testUtf8Edges(self):
+        for data in (b'\x7f', b'\xc2\x80', b'\xef\xbf\xbf', b'\xed\x9f\xbf', b'\xf4\x8f\xbf\xbf'):
+            self.assertTrue(validate_utf8(data), data)
+        # Overlong forms, surrogates, code points over U+10FFFF, stray and
+        # truncated sequences.
+        for data in (b'\xc0\xaf', b'\xe0\x80\xaf', b'\xed\xa0\x80', b'\xf4\x90\x80\x80',
+                     b'\xf5\x80\x80\x80', b'\x80', b'\xff', b'a\xe2\x82'):
+            self.assertFalse(validate_utf8(data), data)
+        self.assertTrue(validate_utf8(memoryview(bytearray(b'\xce\xba'))))
+
+    def testUtf8ValidatorIncremental(self):
+        validator = Utf8Validator()
+        # A sequence may be split between parts.
+        self.assertTrue(validator.validate(b'\xce\xba\xe1'))
+        self.assertTrue(validator.validate(b'\xbd'))
+        self.assertTrue(validator.validate(b'\xb9', True))
+        # A truncated sequence is only refused at the end.
+        self.assertTrue(validator.validate(b'\xf0\x90'))
+        self.assertFalse(validator.validate(b'\x80', True))
+        # Invalid bytes are refused at once.
+        validator.reset()
+        self.assertFalse(validator.validate(b'abc\xed\xa0\x80'))
+        validator.reset()
+        self.assertTrue(validator.validate(b'', True))
+
 
 class HandshakeTest(unittest.TestCase):
     @unittest.skipUnless(TEST_WITH_INTERNET, "Internet-requiring tests are disabled")
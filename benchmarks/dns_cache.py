@@ -0,0 +1,101 @@
+#dns_cache.py
+#
+# Measures the host name resolution cache (dnscache.Resolver) shared by the
+# websocket package and the urllib requests of the add-on.
+#
+# "resolve" compares socket.getaddrinfo() with a cache hit. "reconnect"
+# times websocket.create_connection() attempts against a closed port, as
+# the OBS service does every 3 seconds while OBS Studio is closed, with and
+# without the cache. "urlopen" fetches from a local HTTP server through
+# dnscache.urlopen() and urllib.request.urlopen(). The resolver counters
+# are printed at the end.
+#
+# Hosts are resolved by the system resolver: with names served by DNS
+# rather than the hosts file, the gap is wider than with localhost.
+#
+# Usage: python benchmarks/dns_cache.py [-n ATTEMPTS] [--host HOST ...]
+
+import argparse
+import http.server
+import socket
+import threading
+import time
+import urllib.request
+
+import headless
+import dnscache
+import websocket
+
+
+def perCall(fn, count):
+    start = time.perf_counter()
+    for i in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+
+def closedPort():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def reconnect(host, port):
+    try:
+        websocket.create_connection("ws://%s:%d/" % (host, port), timeout=1)
+    except OSError:
+        pass
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b'{"obs_control": []}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DNS cache benchmark")
+    parser.add_argument("-n", "--attempts", type=int, default=500, help="calls per measurement")
+    parser.add_argument("--host", nargs="*", default=["localhost", socket.gethostname()],
+                        help="host names to resolve")
+    args = parser.parse_args()
+    resolver = dnscache.resolver
+    print(f"{'measure':>10} {'host':>24} {'uncached us':>12} {'cached us':>10}")
+    for host in args.host:
+        uncached = perCall(lambda: socket.getaddrinfo(host, 4455, 0, socket.SOCK_STREAM, socket.SOL_TCP),
+                           args.attempts)
+        cached = perCall(lambda: resolver.getaddrinfo(host, 4455, 0, socket.SOCK_STREAM, socket.SOL_TCP),
+                         args.attempts)
+        print(f"{'resolve':>10} {host:>24} {uncached * 1e6:12.1f} {cached * 1e6:10.1f}")
+
+    port = closedPort()
+    for host in args.host:
+        websocket.setdefaultresolver(None)
+        uncached = perCall(lambda: reconnect(host, port), args.attempts)
+        websocket.setdefaultresolver(resolver)
+        cached = perCall(lambda: reconnect(host, port), args.attempts)
+        print(f"{'reconnect':>10} {host:>24} {uncached * 1e6:12.1f} {cached * 1e6:10.1f}")
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://localhost:%d/nvda" % server.server_address[1]
+    try:
+        count = max(1, args.attempts // 5)
+        uncached = perCall(lambda: urllib.request.urlopen(url).read(), count)
+        cached = perCall(lambda: dnscache.urlopen(url).read(), count)
+        print(f"{'urlopen':>10} {'localhost':>24} {uncached * 1e6:12.1f} {cached * 1e6:10.1f}")
+    finally:
+        server.shutdown()
+    print("resolver:", resolver.stats())
+
+
+if __name__ == "__main__":
+    main()
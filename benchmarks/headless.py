@@ -0,0 +1,89 @@
+#headless.py
+#
+# Runs the netservice server outside of NVDA, for benchmarks, load tests and
+# the unit tests.
+#
+# NVDA-only modules used by netservice (logHandler, addonHandler) are replaced
+# by minimal stand-ins when they cannot be imported.
+
+import builtins
+import logging
+import os
+import sys
+import types
+
+ADDON_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir,
+                                         "addon", "globalPlugins", "web_services"))
+
+
+def _installNVDAModules():
+    """Provides the few NVDA modules netservice needs."""
+    if not hasattr(builtins, "_"):
+        builtins._ = lambda msg: msg
+    try:
+        import logHandler
+    except ImportError:
+        logHandler = types.ModuleType("logHandler")
+        logHandler.log = logging.getLogger("nvda")
+        sys.modules["logHandler"] = logHandler
+    try:
+        import addonHandler
+    except ImportError:
+        addonHandler = types.ModuleType("addonHandler")
+        addonHandler.initTranslation = lambda: None
+        sys.modules["addonHandler"] = addonHandler
+
+
+_installNVDAModules()
+if ADDON_DIR not in sys.path:
+    sys.path.insert(0, ADDON_DIR)
+
+import netservice
+
+# Rate limits high enough not to be what a benchmark measures.
+UNLIMITED = {opClass: (1e9, 1e9) for opClass in netservice.RATE_LIMITS}
+
+
+class HeadlessPlugin:
+    """Stands in for GlobalPlugin: keeps track of registered services.
+
+    Services are registered and unregistered right away, in the calling
+    thread. Also used by the tests, through tests/nvdastubs.py."""
+
+    def __init__(self):
+        self._services = []
+
+    def registerService(self, service):
+        self._services.append(service)
+
+    def unregisterService(self, service):
+        if service in self._services:
+            self._services.remove(service)
+
+
+def startServer(port=0, unixPath=None, rateLimits=netservice.RATE_LIMITS, wsPort=None):
+    """Starts a netservice server in a daemon thread.
+
+    Returns the server and the TCP port it actually listens on. The
+    WebSocket endpoint is only enabled when wsPort is given; its port is
+    then server._wsSock.getsockname()[1]."""
+    gp = HeadlessPlugin()
+    server = netservice.Server(gp, port, unixPath=unixPath, rateLimits=rateLimits,
+                               wsPort=wsPort)
+    server.daemon = True
+    server.start()
+    return server, server._sock.getsockname()[1]
+
+
+def stopServer(server):
+    """Asks the server thread to exit and waits for it."""
+    server._shouldQuit = True
+    server.join()
+
+
+def percentile(values, pct):
+    """Returns the pct-th percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[idx]
@@ -0,0 +1,142 @@
+#netservice_compression.py
+#
+# Measures bytes on the wire and CPU cost of netservice message compression
+# for menu item lists of growing sizes, to pick COMPRESS_THRESHOLD.
+#
+# Columns:
+#   raw       encoded JSON size
+#   plain     raw deflate, new stream per message, no dictionary
+#   dict      raw deflate, new stream per message, preset dictionary
+#   stream    preset dictionary and context kept across messages (what
+#             netservice does), averaged over the run
+#   comp/dec  microseconds per message to compress/decompress in stream mode
+#
+# Then a mixed stream of typical requests, replies and notifications, with
+# random names and texts, is sent through netcodec.Codec with several
+# thresholds: total bytes on the wire and time to encode the stream.
+
+import argparse
+import json
+import random
+import string
+import time
+import zlib
+
+import headless
+import netcodec
+
+
+def menuItems(count, variant):
+    """A menuItemAdd-like message carrying count items."""
+    return {"op": "6", "menu": "scenes", "version": variant,
+            "items": [{"id": f"i{i}", "name": f"Item {i} {variant}",
+                       "action": "switchScene",
+                       "actionData": {"index": i, "sceneName": f"Scene {i}"}}
+                      for i in range(count)]}
+
+
+def frameSize(compressor, data):
+    payload = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return netcodec._frameHeader.size + len(payload) - len(netcodec._SYNC_TRAILER)
+
+
+def measure(count, rounds):
+    messages = [json.dumps(menuItems(count, v)).encode("utf-8") for v in range(rounds)]
+    raw = sum(len(m) for m in messages) / rounds
+    plain = sum(frameSize(zlib.compressobj(netcodec.COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS), m)
+                for m in messages) / rounds
+    withDict = sum(frameSize(zlib.compressobj(netcodec.COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                              zdict=netcodec.COMPRESS_DICTIONARY), m)
+                   for m in messages) / rounds
+
+    compressor = zlib.compressobj(netcodec.COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                  zdict=netcodec.COMPRESS_DICTIONARY)
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=netcodec.COMPRESS_DICTIONARY)
+    payloads = []
+    start = time.perf_counter()
+    for m in messages:
+        payloads.append(compressor.compress(m) + compressor.flush(zlib.Z_SYNC_FLUSH))
+    compTime = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for p in payloads:
+        decompressor.decompress(p)
+    decTime = (time.perf_counter() - start) / rounds
+    stream = sum(netcodec._frameHeader.size + len(p) - len(netcodec._SYNC_TRAILER)
+                 for p in payloads) / rounds
+    return raw, plain, withDict, stream, compTime, decTime
+
+
+def randomText(rand, words):
+    return " ".join("".join(rand.choice(string.ascii_lowercase) for i in range(rand.randint(2, 9)))
+                    for w in range(words))
+
+
+def mixedStream(count, seed=0):
+    """Typical traffic: item adds and updates, their replies, notifications,
+    pings and a few large item adds."""
+    rand = random.Random(seed)
+    messages = []
+    for reqId in range(count):
+        kind = rand.random()
+        menu = f"menu{rand.randint(0, 4)}"
+        itemId = rand.randint(0, 500)
+        if kind < 0.35:
+            msg = {"op": "8", "menu": menu, "id": itemId, "name": randomText(rand, 3), "req_id": reqId}
+            reply = {"op": "8", "req_id": reqId, "status": "ok", "position": itemId, "version": reqId}
+        elif kind < 0.7:
+            msg = {"op": "6", "menu": menu, "id": itemId, "name": randomText(rand, 3),
+                   "action": "select", "actionData": {"value": randomText(rand, 1)}, "req_id": reqId}
+            reply = {"op": "6", "req_id": reqId, "status": "ok", "position": itemId, "version": reqId}
+        elif kind < 0.85:
+            msg = {"op": "9", "message": randomText(rand, rand.randint(3, 30)), "req_id": reqId}
+            reply = {"op": "9", "req_id": reqId, "status": "ok"}
+        elif kind < 0.97:
+            msg = {"op": "0", "ping_id": reqId}
+            reply = {"op": "0", "req_id": reqId, "time": time.time(), "pong_id": reqId}
+        else:
+            msg = {"op": "6", "menu": menu, "id": itemId, "name": randomText(rand, 5), "action": "open",
+                   "actionData": {randomText(rand, 1): randomText(rand, 8) for i in range(20)},
+                   "req_id": reqId}
+            reply = {"op": "6", "req_id": reqId, "status": "error", "error": "Duplicate item id"}
+        messages.append(json.dumps(msg).encode("utf-8"))
+        messages.append(json.dumps(reply).encode("utf-8"))
+    return messages
+
+
+def measureThreshold(messages, threshold):
+    """Returns the bytes on the wire and the time to frame messages."""
+    codec = netcodec.Codec()
+    if threshold is not None:
+        codec.enableCompression("deflate", threshold)
+    start = time.perf_counter()
+    size = sum(len(codec.frame(m)) for m in messages)
+    return size, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="netservice compression benchmark")
+    parser.add_argument("-r", "--rounds", type=int, default=200, help="messages per size")
+    parser.add_argument("--items", type=int, nargs="*", default=[0, 1, 2, 5, 10, 20, 50, 100, 500, 2000],
+                        help="item counts to measure")
+    parser.add_argument("--mixed", type=int, default=20000, help="requests in the mixed stream")
+    parser.add_argument("--thresholds", type=int, nargs="*", default=[0, 64, 128, 256, 512, 1024, 4096],
+                        help="thresholds tried on the mixed stream")
+    args = parser.parse_args()
+    print(f"threshold={netcodec.COMPRESS_THRESHOLD} level={netcodec.COMPRESS_LEVEL}")
+    print(f"{'items':>6} {'raw':>9} {'plain':>9} {'dict':>9} {'stream':>9} {'ratio':>6} {'comp':>9} {'dec':>9}")
+    for count in args.items:
+        raw, plain, withDict, stream, compTime, decTime = measure(count, args.rounds)
+        print(f"{count:6} {raw:9.0f} {plain:9.0f} {withDict:9.0f} {stream:9.0f} "
+              f"{stream / raw:6.2f} {compTime * 1e6:8.1f}us {decTime * 1e6:8.1f}us")
+    messages = mixedStream(args.mixed)
+    print(f"\nmixed stream: {len(messages)} messages")
+    print(f"{'threshold':>9} {'bytes':>10} {'ratio':>6} {'time':>9}")
+    raw, rawTime = measureThreshold(messages, None)
+    print(f"{'none':>9} {raw:10} {1:6.2f} {rawTime / len(messages) * 1e6:7.2f}us")
+    for threshold in args.thresholds:
+        size, elapsed = measureThreshold(messages, threshold)
+        print(f"{threshold:9} {size:10} {size / raw:6.2f} {elapsed / len(messages) * 1e6:7.2f}us")
+
+
+if __name__ == "__main__":
+    main()
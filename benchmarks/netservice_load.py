@@ -0,0 +1,298 @@
+#netservice_load.py
+#
+# Load generator for the netservice protocol.
+#
+# Spins up N simulated clients that identify, create menus, stream item
+# updates at a fixed rate and send pings, then reports throughput, ping
+# round-trip percentiles, memory growth and dropped messages.
+#
+# By default a headless server is started in this process, which allows
+# reporting its memory use and per-client counters. Use --connect or --unix to
+# target a server running elsewhere (e.g. inside NVDA).
+
+import argparse
+import json
+import os
+import selectors
+import socket
+import time
+
+import headless
+
+
+def rssBytes():
+    """Resident set size of this process, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class SimClient:
+    """A simulated netservice client driven by the load generator."""
+
+    def __init__(self, idx, sock, args):
+        self.idx = idx
+        self.sock = sock
+        self.args = args
+        self.out_buf = bytearray()
+        self.in_buf = bytearray()
+        self.sent = 0
+        self.sentBytes = 0
+        self.received = 0
+        self.receivedBytes = 0
+        self.errors = 0
+        self.pings = {}
+        self.rtts = []
+        self.closed = False
+        # Events the selector currently watches for this client's socket
+        self.events = 0
+        self.flooder = idx < args.flooders
+        self._pingId = 0
+        self._updateSeq = 0
+        now = time.perf_counter()
+        self._nextUpdate = now
+        self._nextPing = now + args.ping_interval
+        self.handshake()
+
+    def queue(self, msg):
+        data = (json.dumps(msg) + "\n").encode("utf-8")
+        self.out_buf += data
+        self.sent += 1
+        self.sentBytes += len(data)
+
+    def handshake(self):
+        """Identifies and creates the initial menus and items."""
+        self.queue({"op": "1", "service-name": f"load{self.idx}",
+                    "display-name": f"Load client {self.idx}",
+                    "version": "1.0", "author": "netservice_load"})
+        for m in range(self.args.menus):
+            self.queue({"op": "3", "id": f"m{m}", "name": f"Menu {m}"})
+            for i in range(self.args.items):
+                self.queue({"op": "6", "menu": f"m{m}", "id": f"i{i}",
+                            "name": f"Item {i}", "action": "noop",
+                            "actionData": {"index": i}})
+
+    def tick(self, now):
+        """Schedules updates and pings that are due."""
+        if self.flooder:
+            # Keep the socket buffer full, ignoring the configured rate.
+            for i in range(256):
+                if len(self.out_buf) >= 65536:
+                    break
+                self._updateSeq += 1
+                self.queue({"op": "9", "message": f"flood {self._updateSeq}"})
+        elif self.args.rate > 0:
+            interval = 1.0 / self.args.rate
+            while self._nextUpdate <= now:
+                self._updateSeq += 1
+                m = self._updateSeq % max(1, self.args.menus)
+                i = self._updateSeq % max(1, self.args.items)
+                self.queue({"op": "8", "menu": f"m{m}", "id": f"i{i}",
+                            "name": f"Item {i} update {self._updateSeq}"})
+                self._nextUpdate += interval
+        if now >= self._nextPing:
+            self._pingId += 1
+            self.pings[self._pingId] = now
+            self.queue({"op": "0", "ping_id": self._pingId})
+            self._nextPing = now + self.args.ping_interval
+
+    def on_read(self, now):
+        try:
+            data = self.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.closed = True
+            return
+        self.receivedBytes += len(data)
+        self.in_buf += data
+        lines = self.in_buf.split(b"\n")
+        self.in_buf = lines.pop()
+        for line in lines:
+            if not line:
+                continue
+            self.received += 1
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                self.errors += 1
+                continue
+            if msg.get("status") == "error":
+                self.errors += 1
+            if msg.get("op") == "0" and "ping_id" in msg:
+                # Heartbeat from the server.
+                self.queue({"op": "0", "pong_id": msg["ping_id"]})
+                continue
+            pongId = msg.get("pong_id", None)
+            if msg.get("op") == "0" and pongId in self.pings:
+                self.rtts.append(now - self.pings.pop(pongId))
+
+    def on_write(self):
+        if not self.out_buf:
+            return
+        try:
+            sent = self.sock.send(self.out_buf)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.closed = True
+            return
+        del self.out_buf[:sent]
+
+
+def watch(sel, client):
+    """Registers a client for writing only while it has something to send,
+    so that select() does not return at once and the generator does not spin
+    in the process it shares with the headless server."""
+    if client.closed:
+        if client.events:
+            sel.unregister(client.sock)
+            client.events = 0
+        return
+    events = selectors.EVENT_READ
+    if client.out_buf:
+        events |= selectors.EVENT_WRITE
+    if events != client.events:
+        if client.events:
+            sel.modify(client.sock, events, client)
+        else:
+            sel.register(client.sock, events, client)
+        client.events = events
+
+
+def connect(args, port):
+    if args.unix:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(args.unix)
+    else:
+        host, _, tcpPort = (args.connect or f"127.0.0.1:{port}").rpartition(":")
+        sock = socket.create_connection((host, int(tcpPort)))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setblocking(False)
+    return sock
+
+
+def run(args):
+    server = None
+    port = None
+    if not args.connect and not args.unix:
+        server, port = headless.startServer()
+    rssStart = rssBytes()
+    sel = selectors.DefaultSelector()
+    clients = []
+    for idx in range(args.clients):
+        client = SimClient(idx, connect(args, port), args)
+        clients.append(client)
+        watch(sel, client)
+
+    start = time.perf_counter()
+    end = start + args.duration
+    now = start
+    while now < end:
+        for client in clients:
+            if not client.closed:
+                client.tick(now)
+                watch(sel, client)
+        for key, mask in sel.select(0.01):
+            client = key.data
+            if mask & selectors.EVENT_READ:
+                client.on_read(time.perf_counter())
+            if mask & selectors.EVENT_WRITE:
+                client.on_write()
+            watch(sel, client)
+        now = time.perf_counter()
+    # Give in-flight pings a chance to come back before reporting.
+    drainEnd = now + args.drain
+    while now < drainEnd and any(c.pings for c in clients if not c.closed):
+        for key, mask in sel.select(0.01):
+            client = key.data
+            if mask & selectors.EVENT_READ:
+                client.on_read(time.perf_counter())
+            if mask & selectors.EVENT_WRITE:
+                client.on_write()
+            watch(sel, client)
+        now = time.perf_counter()
+    elapsed = time.perf_counter() - start
+    rssEnd = rssBytes()
+
+    serverStats = None
+    if server is not None:
+        stats = server.getStats().values()
+        throttled = {}
+        for clientStats in stats:
+            for opClass, count in clientStats["throttled"].items():
+                throttled[opClass] = throttled.get(opClass, 0) + count
+        serverStats = {
+            "clients": len(server._clients),
+            "throttled": throttled,
+            "ops": server.getOpStats(),
+            "droppedEvents": sum(c.droppedEvents for c in server._clients.values()),
+            "pendingBytes": sum(c._outSize for c in server._clients.values()),
+        }
+    for client in clients:
+        client.sock.close()
+    if server is not None:
+        headless.stopServer(server)
+    report(args, clients, elapsed, rssStart, rssEnd, serverStats)
+
+
+def report(args, clients, elapsed, rssStart, rssEnd, serverStats):
+    sent = sum(c.sent for c in clients)
+    sentBytes = sum(c.sentBytes for c in clients)
+    received = sum(c.received for c in clients)
+    receivedBytes = sum(c.receivedBytes for c in clients)
+    rtts = sorted(rtt for c in clients if not c.flooder for rtt in c.rtts)
+    floodRtts = sorted(rtt for c in clients if c.flooder for rtt in c.rtts)
+    lostPings = sum(len(c.pings) for c in clients)
+    unsent = sum(len(c.out_buf) for c in clients)
+    print(f"clients={args.clients} duration={elapsed:.2f}s rate={args.rate}/s/client")
+    print(f"sent     {sent:9} msg {sent / elapsed:10.0f} msg/s {sentBytes / elapsed / 1e6:8.2f} MB/s")
+    print(f"received {received:9} msg {received / elapsed:10.0f} msg/s {receivedBytes / elapsed / 1e6:8.2f} MB/s")
+    if rtts:
+        print(f"ping     n={len(rtts)} p50={headless.percentile(rtts, 50) * 1e3:.2f}ms "
+              f"p90={headless.percentile(rtts, 90) * 1e3:.2f}ms "
+              f"p99={headless.percentile(rtts, 99) * 1e3:.2f}ms max={rtts[-1] * 1e3:.2f}ms")
+    if floodRtts:
+        print(f"flooders n={len(floodRtts)} p50={headless.percentile(floodRtts, 50) * 1e3:.2f}ms "
+              f"p99={headless.percentile(floodRtts, 99) * 1e3:.2f}ms max={floodRtts[-1] * 1e3:.2f}ms")
+    print(f"dropped  pings={lostPings} unsent_bytes={unsent} "
+          f"errors={sum(c.errors for c in clients)} "
+          f"disconnected={sum(1 for c in clients if c.closed)}")
+    if rssStart is not None and rssEnd is not None:
+        print(f"memory   rss {rssStart / 1e6:.1f}MB -> {rssEnd / 1e6:.1f}MB "
+              f"({(rssEnd - rssStart) / 1e6:+.1f}MB)")
+    if serverStats is not None:
+        print(f"server   clients={serverStats['clients']} "
+              f"dropped_events={serverStats['droppedEvents']} "
+              f"pending_bytes={serverStats['pendingBytes']} "
+              f"throttled={serverStats['throttled']}")
+        for name, op in sorted(serverStats["ops"].items()):
+            count = max(1, op["count"])
+            print(f"  op {name:18} n={op['count']:8} rejected={op['rejected']:6} "
+                  f"parse={op['parseTime'] / count * 1e6:6.2f}us "
+                  f"validate={op['validateTime'] / count * 1e6:6.2f}us "
+                  f"handle={op['handleTime'] / count * 1e6:7.2f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="netservice load generator")
+    parser.add_argument("-c", "--clients", type=int, default=50, help="number of simulated clients")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="test duration, in seconds")
+    parser.add_argument("-r", "--rate", type=float, default=20.0, help="item updates per second per client")
+    parser.add_argument("--ping-interval", type=float, default=0.5, help="seconds between pings")
+    parser.add_argument("--menus", type=int, default=3, help="menus created by each client")
+    parser.add_argument("--items", type=int, default=20, help="items created in each menu")
+    parser.add_argument("--flooders", type=int, default=0,
+                        help="clients sending notifications as fast as possible")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for pending pings")
+    parser.add_argument("--connect", metavar="HOST:PORT", help="connect to an existing TCP server")
+    parser.add_argument("--unix", metavar="PATH", help="connect to an existing AF_UNIX server")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
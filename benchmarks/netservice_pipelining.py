@@ -0,0 +1,75 @@
+#netservice_pipelining.py
+#
+# Compares lockstep request/response with pipelined requests matched by
+# req_id, for pings and menu item updates, using the netclient library.
+#
+# Usage: python benchmarks/netservice_pipelining.py [-n COUNT] [-w WINDOW ...]
+
+import argparse
+import itertools
+import time
+
+import headless
+import netclient
+
+# Items of the benchmark menu; more than the largest window, so that the
+# updates of a batch are not merged by the client.
+ITEMS = 1000
+# Every update sets a name never used before, in both modes: an update
+# leaving an item unchanged would not be sent at all.
+_updateNumbers = itertools.count()
+
+
+def lockstep(client, request, count):
+    """Sends each request once the previous one has been answered. Returns
+    the elapsed time."""
+    start = time.perf_counter()
+    for i in range(count):
+        request(client, i)
+    return time.perf_counter() - start
+
+
+def pipelined(client, request, count, window):
+    """Sends requests in batches of window, written together and matched by
+    req_id. Returns the elapsed time."""
+    start = time.perf_counter()
+    for first in range(0, count, window):
+        with client.batch():
+            for i in range(first, min(first + window, count)):
+                request(client, i)
+    return time.perf_counter() - start
+
+
+def ping(client, i):
+    client.request("0", ping_id=i)
+
+
+def itemUpdate(client, i):
+    client.updateItem("bench", i % ITEMS, name=f"item {next(_updateNumbers)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lockstep versus pipelined netservice requests.")
+    parser.add_argument("-n", "--count", type=int, default=20000, help="requests per run")
+    parser.add_argument("-w", "--window", type=int, nargs="*", default=[1, 8, 64, 256],
+                        help="requests in flight when pipelining")
+    args = parser.parse_args()
+
+    server, port = headless.startServer(rateLimits=headless.UNLIMITED)
+    try:
+        client = netclient.NetClient("pipelining", port=port)
+        client.connect()
+        client.addMenu("bench", "Bench", [{"id": i, "name": f"item {i}"} for i in range(ITEMS)])
+        for name, request in (("ping", ping), ("update", itemUpdate)):
+            elapsed = lockstep(client, request, args.count)
+            print(f"{name:6} lockstep      {args.count / elapsed:9.0f} req/s")
+            for window in args.window:
+                elapsed = pipelined(client, request, args.count, window)
+                print(f"{name:6} window={window:<6} {args.count / elapsed:9.0f} req/s")
+        client.close()
+    finally:
+        headless.stopServer(server)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#netservice_shm.py
+#
+# Compares publishing high-frequency status updates over the TCP connection
+# (one menuItemUpdate message per update) and through a shared memory ring
+# negotiated with shmOpen (latest value per key). Both rename the items of a
+# "status" menu.
+#
+# Reports producer time per update, including reading the replies to TCP
+# updates, and end-to-end time until the server has applied the last update.
+
+import argparse
+import json
+import socket
+import struct
+import time
+
+import headless
+import netservice
+import shmring
+
+# Updates sent over TCP before waiting for the replies to the oldest ones.
+TCP_WINDOW = 256
+
+
+def request(sock, reader, msg):
+    sock.sendall((json.dumps(msg) + "\n").encode("utf-8"))
+    return json.loads(reader.readline())
+
+
+def createStatusMenu(sock, reader, keys):
+    """Creates the "status" menu and its k<i> items."""
+    replies = [request(sock, reader, {"op": "3", "id": "status", "name": "Status"})]
+    for i in range(keys):
+        replies.append(request(sock, reader, {"op": "6", "menu": "status", "id": f"k{i}",
+                                              "name": "idle"}))
+    failed = [reply for reply in replies if reply.get("status") != "ok"]
+    assert not failed, f"cannot create the status menu: {failed}"
+
+
+def readReplies(reader, count):
+    """Reads count replies and returns how many are not "ok"."""
+    failed = 0
+    for i in range(count):
+        if json.loads(reader.readline()).get("status") != "ok":
+            failed += 1
+    return failed
+
+
+def benchTcp(port, count, keys):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    reader = sock.makefile("rb")
+    request(sock, reader, {"op": "1", "service-name": "bench-tcp"})
+    createStatusMenu(sock, reader, keys)
+    start = time.perf_counter()
+    # Every update is answered: replies are read as updates are sent, so that
+    # they do not pile up on the server, which drops clients not reading.
+    failed = 0
+    unanswered = 0
+    for i in range(count):
+        sock.sendall((json.dumps({"op": "8", "menu": "status", "id": f"k{i % keys}",
+                                  "name": f"value {i}"}) + "\n").encode("utf-8"))
+        unanswered += 1
+        if unanswered >= 2 * TCP_WINDOW:
+            failed += readReplies(reader, TCP_WINDOW)
+            unanswered -= TCP_WINDOW
+    producer = time.perf_counter() - start
+    # Messages are handled in order: the pong means every update was applied.
+    sock.sendall(b'{"op": "0", "ping_id": "end"}\n')
+    failed += readReplies(reader, unanswered)
+    assert json.loads(reader.readline()).get("pong_id") == "end"
+    assert failed == 0, f"{failed} updates failed"
+    total = time.perf_counter() - start
+    sock.close()
+    return producer, total
+
+
+def benchShm(server, port, count, keys, capacity):
+    sock = socket.create_connection(("127.0.0.1", port))
+    reader = sock.makefile("rb")
+    request(sock, reader, {"op": "1", "service-name": "bench-shm"})
+    createStatusMenu(sock, reader, keys)
+    reply = request(sock, reader, {"op": "13", "size": capacity})
+    ring = shmring.RingBuffer.attach(reply["name"], reply["capacity"])
+    doorbell = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    doorbell.connect(("127.0.0.1", reply["doorbell"]))
+    token = struct.pack(">Q", reply["token"])
+    client = [c for c in server._clients.values() if c._ring is not None][0]
+    last = f"value {count - 1}"
+    lastItem = client._service.getRemoteMenu("status").get(f"k{(count - 1) % keys}")
+    start = time.perf_counter()
+    for i in range(count):
+        while not ring.write(f"status/k{i % keys}", f"value {i}".encode("utf-8")):
+            # Full: let the consumer catch up.
+            doorbell.send(token)
+            time.sleep(0)
+        if ring.consumerWaiting():
+            doorbell.send(token)
+    producer = time.perf_counter() - start
+    while lastItem["name"] != last:
+        time.sleep(0)
+    total = time.perf_counter() - start
+    ring.close()
+    doorbell.close()
+    sock.close()
+    return producer, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TCP versus shared memory status updates")
+    parser.add_argument("-n", "--count", type=int, default=100000, help="updates to publish")
+    parser.add_argument("-k", "--keys", type=int, default=8, help="distinct keys")
+    parser.add_argument("--capacity", type=int, default=shmring.DEFAULT_CAPACITY, help="ring size, in bytes")
+    args = parser.parse_args()
+    server, port = headless.startServer(rateLimits={})
+    try:
+        for name, (producer, total) in (("tcp", benchTcp(port, args.count, args.keys)),
+                                        ("shm", benchShm(server, port, args.count, args.keys, args.capacity))):
+            print(f"{name}  producer={producer / args.count * 1e6:6.2f}us/update "
+                  f"end-to-end={total:7.3f}s ({args.count / total:9.0f} updates/s)")
+    finally:
+        headless.stopServer(server)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#netservice_transports.py
+#
+# Compares ping round-trip latency over loopback TCP and AF_UNIX sockets.
+#
+# Usage: python benchmarks/netservice_transports.py [-n COUNT] [-s PAYLOAD_SIZE]
+
+import argparse
+import os
+import socket
+import tempfile
+import time
+
+import headless
+import netclient
+
+
+def pingLoop(client, count, payloadSize):
+    """Sends count pings one after the other and returns sorted RTTs in seconds."""
+    padding = "x" * payloadSize
+    rtts = []
+    for i in range(count):
+        start = time.perf_counter()
+        client.request("0", ping_id=i, padding=padding)
+        rtts.append(time.perf_counter() - start)
+    rtts.sort()
+    return rtts
+
+
+def report(name, rtts):
+    total = sum(rtts)
+    print(f"{name:6} n={len(rtts):6} mean={total / len(rtts) * 1e6:8.1f}us "
+          f"p50={headless.percentile(rtts, 50) * 1e6:8.1f}us "
+          f"p90={headless.percentile(rtts, 90) * 1e6:8.1f}us "
+          f"p99={headless.percentile(rtts, 99) * 1e6:8.1f}us "
+          f"rate={len(rtts) / total:9.0f} msg/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares ping latency over TCP and AF_UNIX sockets.")
+    parser.add_argument("-n", "--count", type=int, default=5000, help="pings per transport")
+    parser.add_argument("-s", "--size", type=int, default=64, help="padding bytes per ping")
+    args = parser.parse_args()
+
+    unixPath = None
+    if hasattr(socket, "AF_UNIX"):
+        unixPath = os.path.join(tempfile.mkdtemp(), "bench.sock")
+    server, port = headless.startServer(unixPath=unixPath, rateLimits=headless.UNLIMITED)
+    try:
+        client = netclient.NetClient("tcp", port=port, compression=False)
+        client.connect()
+        pingLoop(client, 100, args.size)
+        report("tcp", pingLoop(client, args.count, args.size))
+        client.close()
+        if unixPath is None:
+            print("unix   not supported on this platform")
+            return
+        client = netclient.NetClient("unix", unixPath=unixPath, compression=False)
+        client.connect()
+        pingLoop(client, 100, args.size)
+        report("unix", pingLoop(client, args.count, args.size))
+        client.close()
+    finally:
+        headless.stopServer(server)
+
+
+if __name__ == "__main__":
+    main()
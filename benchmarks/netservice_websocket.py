@@ -0,0 +1,96 @@
+#netservice_websocket.py
+#
+# Compares the netservice WebSocket endpoint with the raw TCP transport:
+# lockstep ping latency and windowed message throughput.
+#
+# The WebSocket side uses the bundled websocket client, so client-side
+# masking cost is included.
+
+import argparse
+import json
+import socket
+import time
+
+import headless
+import websocket
+
+
+class TcpConnection:
+    def __init__(self, port):
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+
+    def send(self, text):
+        self.sock.sendall(text.encode("utf-8") + b"\n")
+
+    def recv(self):
+        return self.reader.readline()
+
+    def close(self):
+        self.sock.close()
+
+
+class WsConnection:
+    def __init__(self, port):
+        self.ws = websocket.create_connection(f"ws://127.0.0.1:{port}/")
+        self.ws.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, text):
+        self.ws.send(text)
+
+    def recv(self):
+        return self.ws.recv()
+
+    def close(self):
+        self.ws.close()
+
+
+def run(conn, count, window, size):
+    padding = "x" * size
+    conn.send(json.dumps({"op": "1", "service-name": "bench"}))
+    conn.recv()
+    rtts = []
+    for i in range(min(count, 2000)):
+        start = time.perf_counter()
+        conn.send(json.dumps({"op": "0", "ping_id": i, "padding": padding}))
+        conn.recv()
+        rtts.append(time.perf_counter() - start)
+    rtts.sort()
+    start = time.perf_counter()
+    sent = 0
+    while sent < count:
+        batch = min(window, count - sent)
+        for i in range(batch):
+            conn.send(json.dumps({"op": "0", "ping_id": sent + i, "padding": padding}))
+        for i in range(batch):
+            conn.recv()
+        sent += batch
+    elapsed = time.perf_counter() - start
+    return rtts, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="netservice WebSocket versus TCP")
+    parser.add_argument("-n", "--count", type=int, default=20000, help="messages for the throughput test")
+    parser.add_argument("-w", "--window", type=int, default=100, help="messages in flight")
+    parser.add_argument("-s", "--sizes", type=int, nargs="*", default=[16, 1024, 16384], help="padding bytes")
+    args = parser.parse_args()
+    server, port = headless.startServer(rateLimits={}, wsPort=0)
+    wsPort = server._wsSock.getsockname()[1]
+    try:
+        for size in args.sizes:
+            for name, factory, p in (("tcp", TcpConnection, port), ("ws", WsConnection, wsPort)):
+                conn = factory(p)
+                rtts, elapsed = run(conn, args.count, args.window, size)
+                conn.close()
+                print(f"{name:4} size={size:6} p50={headless.percentile(rtts, 50) * 1e6:7.1f}us "
+                      f"p99={headless.percentile(rtts, 99) * 1e6:7.1f}us "
+                      f"throughput={args.count / elapsed:8.0f} msg/s "
+                      f"{args.count * size / elapsed / 1e6:7.2f} MB/s")
+    finally:
+        headless.stopServer(server)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#websocket_connect.py
+#
+# Measures opening the TCP connection of the websocket package when the
+# first addresses a host name resolves to cannot be reached, as when
+# localhost resolves to ::1 first while OBS Studio only listens on IPv4.
+#
+# "previous" tries the addresses one after the other, as _open_socket did;
+# "staggered" is the current _open_socket. Scenarios give the address
+# list: "refused" starts with a closed port, "stalled" with an address
+# which never answers (a listener whose backlog is full), "both" with one
+# of each; the last address always accepts. The attempts of the last
+# staggered connection are printed for each scenario.
+#
+# Usage: python benchmarks/websocket_connect.py [-n CONNECTIONS] [-t TIMEOUT]
+
+import argparse
+import errno
+import socket
+import time
+
+import headless
+from websocket._http import DEFAULT_SOCKET_OPTION, _open_socket
+
+
+def previousOpenSocket(addrinfo_list, sockopt, timeout):
+    err = None
+    for addrinfo in addrinfo_list:
+        family, socktype, proto = addrinfo[:3]
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(timeout)
+        for opts in DEFAULT_SOCKET_OPTION:
+            sock.setsockopt(*opts)
+        for opts in sockopt:
+            sock.setsockopt(*opts)
+        try:
+            sock.connect(addrinfo[4])
+        except OSError as error:
+            sock.close()
+            if error.errno in (errno.ECONNREFUSED, errno.ENETUNREACH):
+                err = error
+                continue
+            raise
+        return sock
+    raise err
+
+
+def addrinfo(address):
+    return (socket.AF_INET, socket.SOCK_STREAM, socket.SOL_TCP, "", address)
+
+
+def closedPort():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def stalledListener():
+    """Returns a listener to which connections hang, and its pending connection."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(0)
+    filler = socket.create_connection(sock.getsockname())
+    return sock, filler
+
+
+def run(openSocket, addresses, timeout, count):
+    """Returns the median time per connection and how many failed."""
+    times = []
+    failures = 0
+    for i in range(count):
+        start = time.perf_counter()
+        try:
+            sock = openSocket([addrinfo(a) for a in addresses], [], timeout)
+        except OSError:
+            failures += 1
+        else:
+            sock.close()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="websocket connection attempts benchmark")
+    parser.add_argument("-n", "--connections", type=int, default=5, help="connections per path")
+    parser.add_argument("-t", "--timeout", type=float, default=2, help="socket timeout in seconds")
+    args = parser.parse_args()
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(128)
+    stalled, filler = stalledListener()
+    refused = ("127.0.0.1", closedPort())
+    working = listener.getsockname()
+    scenarios = [("refused", [refused, working]),
+                 ("stalled", [stalled.getsockname(), working]),
+                 ("both", [stalled.getsockname(), refused, working])]
+    print(f"{'scenario':>9} {'path':>10} {'median ms':>10} {'failed':>7}")
+    try:
+        for scenario, addresses in scenarios:
+            for name, openSocket in (("previous", previousOpenSocket), ("staggered", _open_socket)):
+                elapsed, failures = run(openSocket, addresses, args.timeout, args.connections)
+                print(f"{scenario:>9} {name:>10} {elapsed * 1e3:10.1f} {failures:7}")
+            attempts = []
+            _open_socket([addrinfo(a) for a in addresses], [], args.timeout, attempts).close()
+            for attempt in attempts:
+                print(" " * 10, attempt)
+    finally:
+        filler.close()
+        stalled.close()
+        listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#websocket_deflate.py
+#
+# Bytes saved and CPU cost of permessage-deflate on typical OBS WebSocket
+# (protocol v5) messages, through the websocket package's PerMessageDeflate.
+#
+# Each payload kind is sent repeatedly, as the OBS service does when it
+# polls. "takeover" keeps the compression context between messages (the
+# default), "no takeover" starts each message afresh, as negotiated with
+# client_no_context_takeover. Times are per message: compressing on one
+# side and decompressing on the other.
+#
+# Usage: python benchmarks/websocket_deflate.py [-n MESSAGES] [-s SCENES]
+
+import argparse
+import json
+import time
+
+import headless
+from websocket._deflate import PerMessageDeflate
+
+
+def response(requestType, requestId, responseData):
+    return {"op": 7, "d": {"requestType": requestType, "requestId": str(requestId),
+                           "requestStatus": {"result": True, "code": 100},
+                           "responseData": responseData}}
+
+
+def sceneList(scenes, requestId):
+    return response("GetSceneList", requestId, {
+        "currentProgramSceneName": "Scene 1",
+        "currentPreviewSceneName": None,
+        "scenes": [{"sceneIndex": i, "sceneName": f"Scene {i}"} for i in range(scenes)]})
+
+
+def sceneItemList(scenes, requestId):
+    return response("GetSceneItemList", requestId, {"sceneItems": [{
+        "inputKind": kind, "isGroup": None, "sceneItemBlendMode": "OBS_BLEND_NORMAL",
+        "sceneItemEnabled": i % 3 != 0, "sceneItemId": i + 1, "sceneItemIndex": i,
+        "sceneItemLocked": False,
+        "sceneItemTransform": {"alignment": 5, "boundsAlignment": 0, "boundsHeight": 0.0,
+                               "boundsType": "OBS_BOUNDS_NONE", "boundsWidth": 0.0,
+                               "cropBottom": 0, "cropLeft": 0, "cropRight": 0, "cropTop": 0,
+                               "height": 1080.0, "positionX": 0.0, "positionY": 0.0,
+                               "rotation": 0.0, "scaleX": 1.0, "scaleY": 1.0,
+                               "sourceHeight": 1080.0, "sourceWidth": 1920.0, "width": 1920.0},
+        "sourceName": f"{kind} {i}", "sourceType": "OBS_SOURCE_TYPE_INPUT"}
+        for i, kind in enumerate(["browser_source", "dshow_input", "wasapi_input_capture",
+                                  "image_source", "text_gdiplus_v2"] * max(1, scenes // 5))]})
+
+
+def streamStatus(scenes, requestId):
+    return response("GetStreamStatus", requestId, {
+        "outputActive": True, "outputBytes": 1234567890 + requestId * 65536,
+        "outputCongestion": 0.0, "outputDuration": 3600000 + requestId * 2000,
+        "outputReconnecting": False, "outputSkippedFrames": 12,
+        "outputTimecode": "01:00:%02d.000" % (requestId % 60), "outputTotalFrames": 216000 + requestId * 60})
+
+
+def sceneChanged(scenes, requestId):
+    return {"op": 5, "d": {"eventIntent": 4, "eventType": "CurrentProgramSceneChanged",
+                           "eventData": {"sceneName": f"Scene {requestId % max(1, scenes)}"}}}
+
+
+PAYLOADS = [("GetSceneList", sceneList), ("GetSceneItemList", sceneItemList),
+            ("GetStreamStatus", streamStatus), ("SceneChanged event", sceneChanged)]
+
+
+def run(make, scenes, count, takeover):
+    """Returns the raw and compressed sizes and the compression and
+    decompression times of count messages."""
+    sender = PerMessageDeflate(client_no_context_takeover=not takeover)
+    receiver = PerMessageDeflate(server_no_context_takeover=not takeover)
+    messages = [json.dumps(make(scenes, i)).encode("utf-8") for i in range(count)]
+    raw = sum(map(len, messages))
+    start = time.perf_counter()
+    compressed = [sender.compress(m) for m in messages]
+    compressTime = time.perf_counter() - start
+    start = time.perf_counter()
+    for i, data in enumerate(compressed):
+        assert receiver.decompress(data, 1) == messages[i]
+    decompressTime = time.perf_counter() - start
+    return raw, sum(map(len, compressed)), compressTime, decompressTime
+
+
+def main():
+    parser = argparse.ArgumentParser(description="permessage-deflate benchmark on OBS payloads")
+    parser.add_argument("-n", "--messages", type=int, default=500, help="messages per payload kind")
+    parser.add_argument("-s", "--scenes", type=int, nargs="*", default=[10, 50],
+                        help="scene (and scene item) counts")
+    args = parser.parse_args()
+    print(f"{'payload':>20} {'scenes':>6} {'context':>11} {'bytes':>7} {'wire':>7} {'saved':>6} "
+          f"{'compress':>9} {'inflate':>8}")
+    for scenes in args.scenes:
+        for name, make in PAYLOADS:
+            for takeover in (True, False):
+                raw, wire, compressTime, decompressTime = run(make, scenes, args.messages, takeover)
+                print(f"{name:>20} {scenes:6} {'takeover' if takeover else 'no takeover':>11} "
+                      f"{raw // args.messages:7} {wire // args.messages:7} {1 - wire / raw:6.1%} "
+                      f"{compressTime / args.messages * 1e6:7.1f}us {decompressTime / args.messages * 1e6:6.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#websocket_dispatcher.py
+#
+# Measures many WebSocketApp connections to a local echo server, run with
+# a thread each (run_forever, plus its ping thread) or together by one
+# MultiplexDispatcher.
+#
+# Each round, every connection sends a message and the round ends when all
+# of them have been echoed. Rows give the threads the client uses, the
+# median round time and the median ping round trip time measured by the
+# apps. The server is an asyncio one, in a thread of its own.
+#
+# Usage: python benchmarks/websocket_dispatcher.py [-c CONNECTIONS ...]
+#        [-r ROUNDS] [-p PING_INTERVAL]
+
+import argparse
+import asyncio
+import threading
+import time
+
+import headless
+import websocket
+from websocket._abnf import ABNF
+from websocket._handshake import _create_accept_key
+
+
+def noData(bufsize):
+    raise BlockingIOError
+
+
+async def handle(reader, writer):
+    request = await reader.readuntil(b"\r\n\r\n")
+    headers = dict(line.split(": ", 1) for line in request.decode().split("\r\n")[1:] if line)
+    writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                  "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                  "Sec-WebSocket-Accept: {accept}\r\n\r\n").format(
+                      accept=_create_accept_key(headers["Sec-WebSocket-Key"])).encode())
+    frames = websocket.frame_buffer(noData, True)
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            frames.feed(data)
+            while True:
+                try:
+                    frame = frames.recv_frame()
+                except BlockingIOError:
+                    break
+                opcode = ABNF.OPCODE_PONG if frame.opcode == ABNF.OPCODE_PING else frame.opcode
+                writer.write(ABNF(1, 0, 0, 0, opcode, 0, frame.data[:2] if opcode == ABNF.OPCODE_CLOSE
+                                  else frame.data).format())
+                if opcode == ABNF.OPCODE_CLOSE:
+                    return
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def startServer():
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    result = {}
+
+    async def main():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=1024)
+        result["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+        await server.serve_forever()
+    threading.Thread(target=loop.run_until_complete, args=(main(),), daemon=True).start()
+    ready.wait()
+    return result["port"]
+
+
+class Round:
+    def __init__(self, count):
+        self.count = count
+        self.received = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def onMessage(self, app, message):
+        with self.lock:
+            self.received += 1
+            if self.received == self.count:
+                self.done.set()
+
+
+def run(port, count, rounds, pingInterval, multiplexed):
+    before = threading.active_count()
+    opened = threading.Semaphore(0)
+    current = Round(count)
+    apps = [websocket.WebSocketApp("ws://127.0.0.1:%d/" % port,
+                                   on_open=lambda app: opened.release(),
+                                   on_message=lambda app, message: current.onMessage(app, message))
+            for i in range(count)]
+    dispatcher = None
+    if multiplexed:
+        dispatcher = websocket.MultiplexDispatcher()
+        dispatcher.start()
+        for app in apps:
+            app.run_forever(dispatcher=dispatcher, ping_interval=pingInterval)
+    else:
+        for app in apps:
+            threading.Thread(target=app.run_forever, kwargs={"ping_interval": pingInterval},
+                             daemon=True).start()
+    for app in apps:
+        opened.acquire()
+    threads = threading.active_count() - before
+    times = []
+    for i in range(rounds):
+        current = Round(count)
+        start = time.perf_counter()
+        for app in apps:
+            app.send("status")
+        current.done.wait(10)
+        times.append(time.perf_counter() - start)
+    time.sleep(pingInterval * 2.5)
+    rtts = sorted(rtt for app in apps for rtt in app.metrics.rtts)
+    for app in apps:
+        app.close()
+    if dispatcher is not None:
+        dispatcher.close()
+    times.sort()
+    rtt = rtts[len(rtts) // 2] if rtts else float("nan")
+    return threads, times[len(times) // 2], rtt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocketApp dispatcher benchmark")
+    parser.add_argument("-c", "--connections", type=int, nargs="*", default=[10, 50, 200],
+                        help="numbers of connections")
+    parser.add_argument("-r", "--rounds", type=int, default=50, help="rounds of messages")
+    parser.add_argument("-p", "--ping-interval", type=float, default=0.2, help="seconds between pings")
+    args = parser.parse_args()
+    port = startServer()
+    print(f"{'connections':>11} {'dispatcher':>12} {'threads':>8} {'round ms':>9} {'rtt ms':>7}")
+    for count in args.connections:
+        for name, multiplexed in (("threads", False), ("multiplexed", True)):
+            threads, roundTime, rtt = run(port, count, args.rounds, args.ping_interval, multiplexed)
+            print(f"{count:11} {name:>12} {threads:8} {roundTime * 1e3:9.2f} {rtt * 1e3:7.2f}")
+            time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#websocket_frames.py
+#
+# Measures the websocket package's frame receive path: frames written by a
+# thread to a socket pair are read back with frame_buffer.recv_frame().
+#
+# "list" is the previous frame_buffer, which kept received chunks in a list
+# and joined them for every header field and payload; "bytearray" is the
+# current one, reading with recv_into() in a reused buffer. peak is the
+# largest amount of memory allocated while receiving, in KB.
+#
+# Usage: python benchmarks/websocket_frames.py [-s SIZE ...] [-m MEGABYTES]
+
+import argparse
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+
+import headless
+from websocket._abnf import ABNF, frame_buffer
+
+
+class ListFrameBuffer(frame_buffer):
+    """The frame_buffer receive path before the bytearray buffer."""
+
+    def __init__(self, recv_fn, skip_utf8_validation):
+        super().__init__(recv_fn, skip_utf8_validation)
+        self.chunks = []
+
+    def recv_header(self):
+        header = self.recv_strict(2)
+        b1 = header[0]
+        b2 = header[1]
+        self.header = (b1 >> 7 & 1, b1 >> 6 & 1, b1 >> 5 & 1, b1 >> 4 & 1, b1 & 0xf,
+                       b2 >> 7 & 1, b2 & 0x7f)
+
+    def recv_length(self):
+        length_bits = self.header[frame_buffer._HEADER_LENGTH_INDEX]
+        if length_bits == 0x7e:
+            self.length = struct.unpack("!H", self.recv_strict(2))[0]
+        elif length_bits == 0x7f:
+            self.length = struct.unpack("!Q", self.recv_strict(8))[0]
+        else:
+            self.length = length_bits
+
+    def recv_strict(self, bufsize):
+        shortage = bufsize - sum(map(len, self.chunks))
+        while shortage > 0:
+            bytes_ = self.recv(min(16384, shortage))
+            self.chunks.append(bytes_)
+            shortage -= len(bytes_)
+        unified = b"".join(self.chunks)
+        if shortage == 0:
+            self.chunks = []
+            return unified
+        self.chunks = [unified[bufsize:]]
+        return unified[:bufsize]
+
+
+def makeReader(kind, sock):
+    if kind == "list":
+        return ListFrameBuffer(sock.recv, True)
+    return frame_buffer(sock.recv, True, sock.recv_into)
+
+
+def run(kind, size, count, traced):
+    """Receives count binary frames of size bytes. Returns the elapsed time
+    and the peak of traced memory."""
+    frame = ABNF(1, 0, 0, 0, ABNF.OPCODE_BINARY, 0, b"x" * size).format()
+    reader, writer = socket.socketpair()
+
+    def write():
+        batch = frame * max(1, 65536 // len(frame))
+        perBatch = len(batch) // len(frame)
+        sent = 0
+        while sent < count:
+            n = min(perBatch, count - sent)
+            writer.sendall(batch if n == perBatch else frame * n)
+            sent += n
+
+    thread = threading.Thread(target=write, daemon=True)
+    buf = makeReader(kind, reader)
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    thread.start()
+    for i in range(count):
+        buf.recv_frame()
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if traced:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    thread.join()
+    reader.close()
+    writer.close()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="websocket frame receive benchmark")
+    parser.add_argument("-s", "--sizes", type=int, nargs="*",
+                        default=[16, 125, 1024, 16384, 65536, 1024 * 1024, 16 * 1024 * 1024],
+                        help="frame payload sizes")
+    parser.add_argument("-m", "--megabytes", type=float, default=64.0,
+                        help="payload received per size and implementation")
+    args = parser.parse_args()
+    print(f"{'size':>9} {'impl':>9} {'frames/s':>10} {'MB/s':>9} {'peak':>9}")
+    for size in args.sizes:
+        count = max(1, min(200000, int(args.megabytes * 1024 * 1024 / size)))
+        for kind in ("list", "bytearray"):
+            elapsed, peak = run(kind, size, count, False)
+            tracedCount = max(1, min(count, 2000))
+            tracedElapsed, peak = run(kind, size, tracedCount, True)
+            print(f"{size:9} {kind:>9} {count / elapsed:10.0f} {count * size / elapsed / 1e6:9.1f} "
+                  f"{peak / 1024:7.0f}KB")
+
+
+if __name__ == "__main__":
+    main()
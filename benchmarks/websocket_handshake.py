@@ -0,0 +1,147 @@
+#websocket_handshake.py
+#
+# Measures reading the HTTP upgrade response of the websocket package, over
+# loopback TCP, against a server answering like OBS WebSocket: the response
+# header, then its Hello message in the same packet.
+#
+# "previous" reads the header one byte per recv() call, as read_headers did
+# through recv_line; "buffered" is the current read_headers. Both send the
+# same request on a fresh connection. "connect" rows time a whole
+# websocket.create_connection() followed by receiving the Hello message,
+# with either way of reading the header.
+#
+# Usage: python benchmarks/websocket_handshake.py [-n CONNECTIONS]
+
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+import headless
+import websocket
+from websocket import _handshake
+from websocket._abnf import ABNF
+from websocket._handshake import _create_accept_key, _get_handshake_headers
+from websocket._http import parse_headers, read_headers
+from websocket._socket import recv
+
+HELLO = (b'{"d":{"authentication":null,"obsWebSocketVersion":"5.0.1",'
+         b'"rpcVersion":1},"op":0}')
+
+
+class Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            data = self.request.recv(4096)
+            if not data:
+                return
+            request += data
+        key = [line.split(": ", 1)[1] for line in request.decode().split("\r\n")
+               if line.lower().startswith("sec-websocket-key")][0]
+        response = ("HTTP/1.1 101 Switching Protocols\r\n"
+                    "Upgrade: websocket\r\n"
+                    "Connection: Upgrade\r\n"
+                    "Sec-WebSocket-Accept: {accept}\r\n"
+                    "Sec-WebSocket-Protocol: obswebsocket.json\r\n"
+                    "Server: WebSocket++/0.8.2\r\n\r\n").format(accept=_create_accept_key(key))
+        self.request.sendall(response.encode() + ABNF(1, 0, 0, 0, ABNF.OPCODE_TEXT, 0, HELLO).format())
+        try:
+            while self.request.recv(4096):
+                pass
+        except OSError:
+            # Clients close without reading the Hello message.
+            pass
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def recvLine(sock):
+    line = []
+    while True:
+        c = recv(sock, 1)
+        line.append(c)
+        if c == b'\n':
+            break
+    return b''.join(line)
+
+
+def previousReadHeaders(sock):
+    lines = []
+    while True:
+        line = recvLine(sock).decode('utf-8').strip()
+        if not line:
+            break
+        lines.append(line)
+    return parse_headers(lines)
+
+
+def bufferedReadHeaders(sock, rest=None):
+    if rest is None:
+        rest = bytearray()
+    return read_headers(sock, rest)
+
+
+def previousConnectHeaders(sock, rest=None):
+    return previousReadHeaders(sock)
+
+
+def readResponse(port, readHeaders):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        url = "ws://127.0.0.1:%d/" % port
+        headers, key = _get_handshake_headers("/", url, "127.0.0.1", port, {})
+        sock.sendall("\r\n".join(headers).encode())
+        start = time.perf_counter()
+        status = readHeaders(sock)[0]
+        elapsed = time.perf_counter() - start
+        assert status == 101
+        return elapsed
+    finally:
+        sock.close()
+
+
+def connect(port, readHeaders):
+    _handshake.read_headers = readHeaders
+    start = time.perf_counter()
+    ws = websocket.create_connection("ws://127.0.0.1:%d/" % port)
+    assert ws.recv().encode() == HELLO
+    elapsed = time.perf_counter() - start
+    ws.close(timeout=0)
+    return elapsed
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="websocket handshake response benchmark")
+    parser.add_argument("-n", "--connections", type=int, default=300, help="connections per path")
+    args = parser.parse_args()
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    try:
+        paths = [("previous", lambda: readResponse(port, previousReadHeaders)),
+                 ("buffered", lambda: readResponse(port, bufferedReadHeaders))]
+        print(f"{'path':>17} {'median us':>10} {'p90 us':>8}")
+        for name, fn in paths:
+            times = [fn() for i in range(args.connections)]
+            print(f"{name:>17} {percentile(times, 0.5) * 1e6:10.1f} {percentile(times, 0.9) * 1e6:8.1f}")
+        for name, readHeaders in (("previous", previousConnectHeaders), ("buffered", read_headers)):
+            times = [connect(port, readHeaders) for i in range(args.connections)]
+            print(f"{'connect ' + name:>17} {percentile(times, 0.5) * 1e6:10.1f} "
+                  f"{percentile(times, 0.9) * 1e6:8.1f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#websocket_mask.py
+#
+# Measures the masking paths of the websocket package (ABNF.mask), from
+# 10 bytes to 16 MB payloads. Used to pick _MASK_INT_MAX.
+#
+# "bigint" is the previous implementation: the payload and the repeated mask
+# converted to integers through array.array. "int" is the same without the
+# array copies, used below _MASK_INT_MAX; "python" the chunked bytes.translate
+# path and "numpy" the NumPy one, used above it. "wsaccel" is wsaccel's
+# compiled masker, used for every size when installed. "inplace" rows mask a
+# bytearray in place (ABNF.mask_inplace). "mask" is ABNF.mask itself.
+#
+# Usage: python benchmarks/websocket_mask.py [-s SIZE ...]
+
+import argparse
+import array
+import os
+import sys
+import timeit
+
+import headless
+from websocket import _abnf
+from websocket._abnf import ABNF
+
+
+def bigint(mask_key, data):
+    mask_value = array.array("B", mask_key)
+    data_value = array.array("B", data)
+    return _abnf._mask_int(mask_value, data_value)
+
+
+def paths():
+    result = [("bigint", bigint), ("int", _abnf._mask_int), ("python", _abnf._mask_python)]
+    if _abnf.numpy is not None:
+        result.append(("numpy", _abnf._mask_numpy))
+    if _abnf.XorMaskerSimple is not None:
+        result.append(("wsaccel", _abnf._mask_wsaccel))
+    result.append(("mask", ABNF.mask))
+    result.append(("python inplace", _abnf._mask_python_inplace))
+    if _abnf.numpy is not None:
+        result.append(("numpy inplace", _abnf._mask_numpy_inplace))
+    return result
+
+
+def measure(fn, mask_key, data):
+    """Returns the best time of one call, in seconds."""
+    number = max(1, 2000000 // (len(data) + 500))
+    return min(timeit.repeat(lambda: fn(mask_key, data), number=number, repeat=5)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="websocket masking benchmark")
+    parser.add_argument("-s", "--sizes", type=int, nargs="*",
+                        default=[10, 125, 512, 1024, 4096, 16384, 65536, 262144,
+                                 1024 * 1024, 16 * 1024 * 1024],
+                        help="payload sizes")
+    args = parser.parse_args()
+    if _abnf.numpy is None:
+        print("NumPy is not installed: numpy rows are skipped", file=sys.stderr)
+    if _abnf.XorMaskerSimple is None:
+        print("wsaccel is not installed: wsaccel rows are skipped", file=sys.stderr)
+    mask_key = os.urandom(4)
+    print(f"{'size':>9} {'path':>15} {'us/call':>10} {'MB/s':>9}")
+    for size in args.sizes:
+        data = os.urandom(size)
+        expected = bigint(mask_key, data)
+        timings = []
+        for name, fn in paths():
+            if name.endswith("inplace"):
+                buffer = bytearray(data)
+                fn(mask_key, buffer)
+                assert buffer == expected, name
+                elapsed = measure(fn, mask_key, buffer)
+            else:
+                assert fn(mask_key, data) == expected, name
+                elapsed = measure(fn, mask_key, data)
+            timings.append((elapsed, name))
+            print(f"{size:9} {name:>15} {elapsed * 1e6:10.1f} {size / elapsed / 1e6:9.1f}")
+        copying = [t for t in timings if not t[1].endswith("inplace") and t[1] != "mask"]
+        print(f"{size:9} {'fastest':>15} {min(copying)[1]:>10}")
+
+
+if __name__ == "__main__":
+    main()
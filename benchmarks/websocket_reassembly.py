@@ -0,0 +1,98 @@
+#websocket_reassembly.py
+#
+# Measures the reassembly of fragmented messages by the websocket package's
+# continuous_frame, as used by WebSocket.recv() and by the WebSocket
+# clients of the add-on's network services.
+#
+# "previous" adds each fragment to the message received so far
+# (cont_data[1] += data), copying it every time; "joined" is the current
+# continuous_frame, joining the fragments once; "streamed" hands them to an
+# on_fragment callback without reassembling them. Text messages are
+# validated as UTF-8 by all paths.
+#
+# Usage: python benchmarks/websocket_reassembly.py [-s SIZE ...] [-f FRAGMENT]
+#        [--text]
+
+import argparse
+import time
+
+import headless
+from websocket._abnf import ABNF, continuous_frame
+
+
+class PreviousContinuousFrame(continuous_frame):
+    def add(self, frame):
+        if frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+            self.validating = frame.opcode == ABNF.OPCODE_TEXT and not self.skip_utf8_validation
+            if self.validating:
+                self.utf8_validator.reset()
+        if self.validating:
+            if not self.utf8_validator.validate(frame.data, frame.fin):
+                raise ValueError("invalid UTF-8")
+            if frame.fin:
+                self.validating = False
+        if self.cont_data:
+            self.cont_data[1] += frame.data
+        else:
+            if frame.opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+                self.recving_frames = frame.opcode
+            self.cont_data = [frame.opcode, frame.data]
+        if frame.fin:
+            self.recving_frames = None
+
+    def extract(self, frame):
+        data = self.cont_data
+        self.cont_data = None
+        frame.data = data[1]
+        return [data[0], frame]
+
+
+def fragments(size, fragmentSize, opcode):
+    data = b"0123456789abcdef" * (fragmentSize // 16)
+    count = max(1, size // fragmentSize)
+    frames = [ABNF(0, 0, 0, 0, ABNF.OPCODE_CONT, 0, data) for i in range(count)]
+    frames[0].opcode = opcode
+    frames[-1].fin = 1
+    return frames
+
+
+def receive(cont, frames):
+    """Returns the seconds taken and the size of the message."""
+    size = 0
+    start = time.perf_counter()
+    for frame in frames:
+        cont.validate(frame)
+        cont.add(frame)
+        if cont.is_fire(frame):
+            opcode, message = cont.extract(frame)
+            size = len(message.data)
+    return time.perf_counter() - start, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="websocket message reassembly benchmark")
+    parser.add_argument("-s", "--sizes", type=int, nargs="*", default=[1024 * 1024, 10 * 1024 * 1024],
+                        help="message sizes")
+    parser.add_argument("-f", "--fragment", type=int, default=4096, help="fragment size")
+    parser.add_argument("--text", action="store_true", help="text messages, validated as UTF-8")
+    args = parser.parse_args()
+    opcode = ABNF.OPCODE_TEXT if args.text else ABNF.OPCODE_BINARY
+    print(f"{'size':>9} {'fragments':>9} {'path':>9} {'ms':>9} {'MB/s':>8}")
+    for size in args.sizes:
+        received = []
+        paths = [("previous", PreviousContinuousFrame(False, False)),
+                 ("joined", continuous_frame(False, False)),
+                 ("streamed", continuous_frame(False, False,
+                                               on_fragment=lambda opcode, data, fin: received.append(len(data))))]
+        for name, cont in paths:
+            frames = fragments(size, args.fragment, opcode)
+            elapsed, messageSize = receive(cont, frames)
+            if name == "streamed":
+                messageSize = sum(received)
+            assert messageSize == len(frames) * len(frames[0].data)
+            print(f"{messageSize:9} {len(frames):9} {name:>9} {elapsed * 1e3:9.1f} "
+                  f"{messageSize / elapsed / 1e6:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
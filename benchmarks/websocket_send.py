@@ -0,0 +1,185 @@
+#websocket_send.py
+#
+# Measures the send path of the websocket package's WebSocket: many small
+# frames, and one large frame written by partial sends.
+#
+# "previous" formats frames as before (header built from chr() pieces, mask
+# key and masked payload concatenated) and sends them with data = data[l:]
+# after each partial write. "send_frame" is the current path, one call per
+# frame; "send_many" sends all the frames of a batch at once.
+#
+# The socket is a sink counting system calls. It accepts at most --limit
+# bytes per call, like a socket whose send buffer is full, and offers
+# sendmsg() unless --no-sendmsg is given (as on Windows or with SSL).
+# With --socket, frames are written to a real socket pair instead, read by
+# a thread; system calls are not counted then.
+#
+# Usage: python benchmarks/websocket_send.py [-n FRAMES] [-s SIZE ...]
+#        [-L SIZE ...] [-l LIMIT] [--no-sendmsg | --socket]
+
+import argparse
+import socket
+import struct
+import threading
+import time
+
+import headless
+import websocket
+from websocket._abnf import ABNF
+from websocket._socket import send
+
+
+class Sink:
+    def __init__(self, limit):
+        self.limit = limit
+        self.calls = 0
+        self.bytes = 0
+
+    def gettimeout(self):
+        return None
+
+    def send(self, data):
+        self.calls += 1
+        sent = min(len(data), self.limit)
+        self.bytes += sent
+        return sent
+
+    def close(self):
+        pass
+
+
+class GatherSink(Sink):
+    def sendmsg(self, buffers):
+        self.calls += 1
+        sent = min(sum(memoryview(b).nbytes for b in buffers), self.limit)
+        self.bytes += sent
+        return sent
+
+
+class SocketPair:
+    """A connected socket whose other end is read by a thread."""
+
+    def __init__(self, limit):
+        self.sock, self.peer = socket.socketpair()
+        self.calls = 0
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        buffer = bytearray(1 << 20)
+        try:
+            while self.peer.recv_into(buffer):
+                pass
+        except OSError:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def close(self):
+        self.sock.close()
+        self.thread.join()
+        self.peer.close()
+
+
+def previousFormat(frame):
+    if any(x not in (0, 1) for x in [frame.fin, frame.rsv1, frame.rsv2, frame.rsv3]):
+        raise ValueError("not 0 or 1")
+    if frame.opcode not in ABNF.OPCODES:
+        raise ValueError("Invalid OPCODE")
+    length = len(frame.data)
+    if length >= ABNF.LENGTH_63:
+        raise ValueError("data is too long")
+    frame_header = chr(frame.fin << 7 | frame.rsv1 << 6 | frame.rsv2 << 5 | frame.rsv3 << 4 |
+                       frame.opcode).encode('latin-1')
+    if length < ABNF.LENGTH_7:
+        frame_header += chr(frame.mask << 7 | length).encode('latin-1')
+    elif length < ABNF.LENGTH_16:
+        frame_header += chr(frame.mask << 7 | 0x7e).encode('latin-1')
+        frame_header += struct.pack("!H", length)
+    else:
+        frame_header += chr(frame.mask << 7 | 0x7f).encode('latin-1')
+        frame_header += struct.pack("!Q", length)
+    mask_key = frame.get_mask_key(4)
+    return frame_header + mask_key + ABNF.mask(mask_key, frame.data)
+
+
+def previous(ws, frames):
+    for frame in frames:
+        if ws.get_mask_key:
+            frame.get_mask_key = ws.get_mask_key
+        data = previousFormat(frame)
+        with ws.lock:
+            while data:
+                l = send(ws.sock, data)
+                data = data[l:]
+
+
+def sendFrame(ws, frames):
+    for frame in frames:
+        ws.send_frame(frame)
+
+
+def sendMany(ws, frames):
+    ws.send_many(frames)
+
+
+def run(fn, payload, count, sinkClass, limit):
+    """Returns the time and system calls per frame."""
+    ws = websocket.WebSocket(enable_multithread=True)
+    ws.sock = sinkClass(limit)
+    best = None
+    repeat = max(3, 200000 // (count * (len(payload) + 100)))
+    for i in range(repeat):
+        frames = [ABNF.create_frame(payload, ABNF.OPCODE_BINARY) for j in range(count)]
+        ws.sock.calls = 0
+        start = time.perf_counter()
+        fn(ws, frames)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    ws.sock.close()
+    ws.sock = None
+    if sinkClass is SocketPair:
+        return best / count, None
+    return best / count, calls(ws, fn, payload, count, sinkClass, limit)
+
+
+def calls(ws, fn, payload, count, sinkClass, limit):
+    ws.sock = sinkClass(limit)
+    fn(ws, [ABNF.create_frame(payload, ABNF.OPCODE_BINARY) for j in range(count)])
+    result = ws.sock.calls / count
+    ws.sock = None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="websocket send path benchmark")
+    parser.add_argument("-n", "--frames", type=int, default=1000, help="small frames per batch")
+    parser.add_argument("-s", "--sizes", type=int, nargs="*", default=[16, 128, 1024],
+                        help="small frame payload sizes")
+    parser.add_argument("-L", "--large", type=int, nargs="*", default=[1024 * 1024, 16 * 1024 * 1024],
+                        help="large frame payload sizes")
+    parser.add_argument("-l", "--limit", type=int, default=65536, help="bytes accepted per system call")
+    parser.add_argument("--no-sendmsg", action="store_true", help="sink without sendmsg()")
+    parser.add_argument("--socket", action="store_true", help="write to a real socket pair")
+    args = parser.parse_args()
+    if args.socket:
+        sinkClass = SocketPair
+    else:
+        sinkClass = Sink if args.no_sendmsg else GatherSink
+    paths = [("previous", previous), ("send_frame", sendFrame), ("send_many", sendMany)]
+    print(f"{'frames':>6} {'size':>9} {'path':>10} {'us/frame':>10} {'calls/frame':>12} {'MB/s':>9}")
+    for count, sizes in ((args.frames, args.sizes), (1, args.large)):
+        for size in sizes:
+            payload = bytes(range(256)) * (size // 256) + bytes(size % 256)
+            for name, fn in paths:
+                if count == 1 and name == "send_many":
+                    continue
+                elapsed, perFrame = run(fn, payload, count, sinkClass, args.limit)
+                perFrame = "-" if perFrame is None else f"{perFrame:.3f}"
+                print(f"{count:6} {size:9} {name:>10} {elapsed * 1e6:10.2f} {perFrame:>12} "
+                      f"{size / elapsed / 1e6:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
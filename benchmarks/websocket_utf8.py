@@ -0,0 +1,135 @@
+#websocket_utf8.py
+#
+# Measures UTF-8 validation of websocket text messages.
+#
+# "dfa" is the previous pure Python validator (Bjoern Hoehrmann's DFA, byte
+# by byte); "codec" is validate_utf8(), which uses the C UTF-8 codec, or
+# wsaccel's compiled validator when it is installed;
+# "incremental" validates the message in 4 KB fragments with
+# Utf8Validator, as continuous_frame does for fragmented messages.
+#
+# Before timing, the DFA and the codec validators are checked to take the
+# same decision on every test vector and on random and mutated byte strings.
+# The only difference is deliberate: data ending with a truncated sequence
+# used to be accepted, it is now refused.
+#
+# Usage: python benchmarks/websocket_utf8.py [-s SIZE ...] [-f FRAGMENT]
+
+import argparse
+import random
+import time
+
+import headless
+from websocket._utils import Utf8Validator, validate_utf8
+
+_UTF8_ACCEPT = 0
+_UTF8_REJECT = 12
+
+_UTF8D = [
+    0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,  0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
+    0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,  0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
+    0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,  0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
+    0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,  0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,
+    1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,  9,9,9,9,9,9,9,9,9,9,9,9,9,9,9,9,
+    7,7,7,7,7,7,7,7,7,7,7,7,7,7,7,7,  7,7,7,7,7,7,7,7,7,7,7,7,7,7,7,7,
+    8,8,2,2,2,2,2,2,2,2,2,2,2,2,2,2,  2,2,2,2,2,2,2,2,2,2,2,2,2,2,2,2,
+    10,3,3,3,3,3,3,3,3,3,3,3,3,4,3,3, 11,6,6,6,5,8,8,8,8,8,8,8,8,8,8,8,
+    0,12,24,36,60,96,84,12,12,12,48,72, 12,12,12,12,12,12,12,12,12,12,12,12,
+    12, 0,12,12,12,12,12, 0,12, 0,12,12, 12,24,12,12,12,12,12,24,12,24,12,12,
+    12,12,12,12,12,12,12,24,12,12,12,12, 12,24,12,12,12,12,12,12,12,24,12,12,
+    12,12,12,12,12,12,12,36,12,36,12,12, 12,36,12,12,12,12,12,36,12,36,12,12,
+    12,36,12,12,12,12,12,12,12,12,12,12, ]
+
+
+def dfaState(utfbytes):
+    state = _UTF8_ACCEPT
+    codep = 0
+    for ch in utfbytes:
+        tp = _UTF8D[ch]
+        codep = (ch & 0x3f) | (codep << 6) if state != _UTF8_ACCEPT else (0xff >> tp) & ch
+        state = _UTF8D[256 + state + tp]
+        if state == _UTF8_REJECT:
+            break
+    return state
+
+
+def dfa(utfbytes):
+    """The previous validator. It accepted a sequence truncated at the end
+    of the data."""
+    return dfaState(utfbytes) != _UTF8_REJECT
+
+
+def incremental(data, fragment):
+    validator = Utf8Validator()
+    with memoryview(data) as view:
+        for start in range(0, len(data), fragment):
+            end = start + fragment
+            if not validator.validate(view[start:end], end >= len(data)):
+                return False
+    return validator.validate(b"", True)
+
+
+def checkDecisions(count):
+    """Compares the decisions of dfa and validate_utf8. Returns the number
+    of byte strings checked."""
+    rng = random.Random(42)
+    vectors = [b"\xf0\x90\x80\x80", b"\xce\xba\xe1\xbd\xb9\xcf\x83\xce\xbc\xce\xb5\xed\xa0\x80edited", b"",
+               b"\xc0\xaf", b"\xe0\x80\xaf", b"\xed\xa0\x80", b"\xf4\x90\x80\x80", b"\xef\xbf\xbf"]
+    text = "Scène 1 – 日本語 🎬 ".encode("utf-8")
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            data = bytes(rng.randrange(256) for _ in range(rng.randrange(1, 8)))
+        else:
+            data = bytearray(text * rng.randrange(1, 4))
+            data[rng.randrange(len(data))] = rng.randrange(256)
+            data = bytes(data)
+        vectors.append(data)
+    for data in vectors:
+        # Truncated sequences are compared as the DFA's final state: the
+        # previous validator ignored it.
+        expected = dfaState(data) == _UTF8_ACCEPT
+        assert validate_utf8(data) == expected, data
+        assert incremental(data, 3) == expected, data
+    return len(vectors)
+
+
+def measure(fn, data):
+    number = max(1, 4000000 // (len(data) + 100))
+    best = None
+    for i in range(3):
+        start = time.perf_counter()
+        for j in range(number):
+            fn(data)
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="websocket UTF-8 validation benchmark")
+    parser.add_argument("-s", "--sizes", type=int, nargs="*", default=[16, 1024, 65536, 1024 * 1024],
+                        help="message sizes")
+    parser.add_argument("-f", "--fragment", type=int, default=4096, help="fragment size of the incremental run")
+    args = parser.parse_args()
+    print(f"decisions match on {checkDecisions(20000)} byte strings")
+    samples = {"ascii": b'{"sceneName": "Scene 1", "sceneIndex": 1} ',
+               "multilingual": "Scène – 日本語 – Ελληνικά 🎬 ".encode("utf-8")}
+    print(f"{'size':>9} {'text':>12} {'path':>11} {'us/msg':>10} {'MB/s':>9}")
+    for size in args.sizes:
+        for name, sample in samples.items():
+            data = (sample * (size // len(sample) + 1))[:size]
+            while not validate_utf8(data):
+                data = data[:-1]
+            paths = [("dfa", dfa), ("codec", validate_utf8),
+                     ("incremental", lambda d: incremental(d, args.fragment))]
+            for path, fn in paths:
+                if path == "dfa" and size > 65536:
+                    continue
+                assert fn(data)
+                elapsed = measure(fn, data)
+                print(f"{size:9} {name:>12} {path:>11} {elapsed * 1e6:10.1f} {len(data) / elapsed / 1e6:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
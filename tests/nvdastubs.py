@@ -0,0 +1,17 @@
+#nvdastubs.py
+#
+# Lets the add-on modules be imported by the tests, outside of NVDA.
+#
+# The NVDA-only modules are replaced by the stand-ins of benchmarks/headless.py,
+# which also puts the add-on directory on sys.path and provides HeadlessPlugin.
+# Run the tests from the repository root with
+# python -m unittest discover -s tests
+
+import os
+import sys
+
+BENCHMARKS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "benchmarks"))
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+from headless import ADDON_DIR, HeadlessPlugin
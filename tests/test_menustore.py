@@ -0,0 +1,165 @@
+#test_menustore.py
+#
+# Tests of the network service menu store.
+
+import random
+import unittest
+
+import nvdastubs
+import menustore
+
+
+class ItemListTest(unittest.TestCase):
+
+    def setUp(self):
+        # Small blocks, so that a few items split and empty them.
+        self._blockSize = menustore.BLOCK_SIZE
+        menustore.BLOCK_SIZE = 4
+
+    def tearDown(self):
+        menustore.BLOCK_SIZE = self._blockSize
+
+    def checkList(self, items, expected):
+        self.assertEqual(list(items), expected)
+        self.assertEqual(len(items), len(expected))
+        for position, itemId in enumerate(expected):
+            self.assertIn(itemId, items)
+            self.assertEqual(items.position(itemId), position)
+            self.assertEqual(items.idAt(position), itemId)
+        for index, block in enumerate(items._blocks):
+            self.assertEqual(block.index, index)
+            self.assertLessEqual(len(block.ids), 2 * menustore.BLOCK_SIZE)
+            if len(items._blocks) > 1:
+                self.assertTrue(block.ids)
+
+    def testInitialContent(self):
+        items = menustore.ItemList(range(10))
+        self.assertEqual(len(items._blocks), 3)
+        self.checkList(items, list(range(10)))
+        self.checkList(menustore.ItemList(), [])
+
+    def testSplit(self):
+        items = menustore.ItemList()
+        expected = []
+        for i in range(40):
+            self.assertEqual(items.append(i), i)
+            expected.append(i)
+        self.checkList(items, expected)
+        self.assertGreater(len(items._blocks), 40 // (2 * menustore.BLOCK_SIZE))
+        # Inserting at the same place keeps splitting the same block.
+        for i in range(100, 120):
+            self.assertEqual(items.insert(5, i), 5)
+            expected.insert(5, i)
+        self.checkList(items, expected)
+
+    def testInsertClamped(self):
+        items = menustore.ItemList(range(3))
+        self.assertEqual(items.insert(-5, "first"), 0)
+        self.assertEqual(items.insert(50, "last"), 4)
+        self.checkList(items, ["first", 0, 1, 2, "last"])
+        with self.assertRaises(ValueError):
+            items.insert(0, 1)
+        with self.assertRaises(IndexError):
+            items.idAt(5)
+
+    def testEmptiedBlocks(self):
+        items = menustore.ItemList(range(12))
+        # Empty the middle block, then the first and the last ones.
+        for itemId, position in ((4, 4), (5, 4), (6, 4), (7, 4)):
+            self.assertEqual(items.remove(itemId), position)
+        self.assertEqual(len(items._blocks), 2)
+        self.checkList(items, [0, 1, 2, 3, 8, 9, 10, 11])
+        for itemId in (0, 1, 2, 3, 11, 10, 9):
+            items.remove(itemId)
+        self.checkList(items, [8])
+        items.remove(8)
+        self.checkList(items, [])
+        self.assertEqual(len(items._blocks), 1)
+        self.assertEqual(items.append("again"), 0)
+        self.checkList(items, ["again"])
+
+    def testRandomOperations(self):
+        rand = random.Random(1234)
+        items = menustore.ItemList()
+        expected = []
+        for step in range(2000):
+            if expected and rand.random() < 0.45:
+                itemId = rand.choice(expected)
+                self.assertEqual(items.remove(itemId), expected.index(itemId))
+                expected.remove(itemId)
+            else:
+                position = rand.randint(0, len(expected))
+                self.assertEqual(items.insert(position, step), position)
+                expected.insert(position, step)
+            if step % 100 == 0:
+                self.checkList(items, expected)
+        self.checkList(items, expected)
+
+
+class MenuTest(unittest.TestCase):
+
+    def setUp(self):
+        self.menu = menustore.Menu("m", "Menu")
+
+    def testDeltas(self):
+        self.assertIsNone(self.menu.takeChanges())
+        self.assertEqual(self.menu.addItem({"id": "a", "name": "A"}), 0)
+        self.assertEqual(self.menu.addItem({"id": "b", "name": "B"}), 1)
+        self.assertEqual(self.menu.addItem({"id": "c", "name": "C"}, 0), 0)
+        delta = self.menu.takeChanges()
+        self.assertEqual(delta, {"id": "m", "base": 0, "version": 3,
+                                 "changes": [["add", 0, {"id": "a", "name": "A"}],
+                                             ["add", 1, {"id": "b", "name": "B"}],
+                                             ["add", 0, {"id": "c", "name": "C"}]]})
+        self.assertEqual(self.menu.updateItem("b", {"name": "B2", "action": "x"}), 2)
+        self.assertEqual(self.menu.removeItem("c"), 0)
+        delta = self.menu.takeChanges()
+        self.assertEqual(delta, {"id": "m", "base": 3, "version": 5,
+                                 "changes": [["update", 2, {"id": "b", "name": "B2", "action": "x"}],
+                                             ["del", 0]]})
+        self.assertIsNone(self.menu.takeChanges())
+        self.assertEqual(self.menu.items(), [{"id": "a", "name": "A"},
+                                             {"id": "b", "name": "B2", "action": "x"}])
+
+    def testDeltasReplayed(self):
+        # Applying the deltas to a snapshot gives the current content.
+        for i in range(300):
+            self.menu.addItem({"id": i, "name": str(i)}, (i * 7) % (i + 1))
+        snapshot = self.menu.snapshot()
+        self.menu.takeChanges()
+        for i in range(0, 300, 3):
+            self.menu.removeItem(i)
+            self.menu.updateItem(i + 1, {"name": f"{i + 1}!"})
+            self.menu.addItem({"id": -i, "name": "new"}, i // 2)
+        delta = self.menu.takeChanges()
+        self.assertEqual(delta["base"], snapshot["version"])
+        items = snapshot["items"]
+        for change in delta["changes"]:
+            if change[0] == "add":
+                items.insert(change[1], change[2])
+            elif change[0] == "update":
+                items[change[1]] = change[2]
+            else:
+                del items[change[1]]
+        self.assertEqual(items, self.menu.items())
+        self.assertEqual(delta["version"], self.menu.version)
+
+    def testSnapshotIsACopy(self):
+        self.menu.addItem({"id": 1, "name": "one"})
+        snapshot = self.menu.snapshot()
+        self.menu.updateItem(1, {"name": "uno"})
+        self.assertEqual(snapshot["items"], [{"id": 1, "name": "one"}])
+        self.assertEqual((snapshot["id"], snapshot["name"], snapshot["version"]), ("m", "Menu", 1))
+
+    def testLookups(self):
+        for i in range(5):
+            self.menu.addItem({"id": i, "name": str(i)})
+        self.assertEqual(len(self.menu), 5)
+        self.assertEqual(self.menu.itemAt(3), {"id": 3, "name": "3"})
+        self.assertIsNone(self.menu.get(10))
+        with self.assertRaises(ValueError):
+            self.menu.addItem({"id": 1, "name": "again"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+#test_netclient.py
+#
+# Tests of the netclient library's request queueing, without a connection:
+# the requests queued in the outbox are checked.
+
+import unittest
+
+import nvdastubs
+import netclient
+
+
+class QueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = netclient.NetClient("test")
+        self.client._addMenu("m", "Menu", [])
+        self.client._outbox = []
+
+    def outbox(self):
+        return [{key: value for key, value in msg.items() if key != "req_id"}
+                for msg in self.client._outbox]
+
+    def testUpdatesMerged(self):
+        self.client._addItem("m", {"id": 1, "name": "one"})
+        first = self.client._updateItem("m", 1, {"name": "two"})
+        second = self.client._updateItem("m", 1, {"action": "play"})
+        self.assertEqual(first, second)
+        self.assertEqual(self.outbox(), [
+            {"op": "6", "menu": "m", "id": 1, "name": "one"},
+            {"op": "8", "menu": "m", "id": 1, "name": "two", "action": "play"},
+        ])
+
+    def testUpdatesNotMergedAcrossRemoveAndAdd(self):
+        self.client._addItem("m", {"id": 1, "name": "one"})
+        first = self.client._updateItem("m", 1, {"name": "two"})
+        self.client._removeItem("m", 1)
+        self.client._addItem("m", {"id": 1, "name": "three"})
+        second = self.client._updateItem("m", 1, {"name": "four"})
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.outbox(), [
+            {"op": "6", "menu": "m", "id": 1, "name": "one"},
+            {"op": "8", "menu": "m", "id": 1, "name": "two"},
+            {"op": "7", "menu": "m", "id": 1},
+            {"op": "6", "menu": "m", "id": 1, "name": "three"},
+            {"op": "8", "menu": "m", "id": 1, "name": "four"},
+        ])
+        self.assertEqual(self.client.menu("m"), [{"id": 1, "name": "four"}])
+
+    def testUpdatesNotMergedAcrossMenuRemoval(self):
+        self.client._addItem("m", {"id": 1, "name": "one"})
+        self.client._updateItem("m", 1, {"name": "two"})
+        self.client._removeMenu("m")
+        self.client._addMenu("m", "Menu", [{"id": 1, "name": "three"}])
+        self.client._updateItem("m", 1, {"name": "four"})
+        self.assertEqual([msg["op"] for msg in self.outbox()], ["6", "8", "4", "3", "6", "8"])
+        self.assertEqual(self.outbox()[-1]["name"], "four")
+
+
+class SetMenuTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = netclient.NetClient("test")
+        self.items = [{"id": i, "name": f"item {i}"} for i in range(6)]
+        self.client._setMenu("m", "Menu", self.items)
+
+    def requests(self, name, items):
+        """Returns the requests turning the published menu into items, without req_ids."""
+        self.client._outbox = []
+        self.client._setMenu("m", name, items)
+        self.assertEqual(self.client.menu("m"), items)
+        return [{key: value for key, value in msg.items() if key != "req_id"}
+                for msg in self.client._outbox]
+
+    def testNewMenu(self):
+        self.assertEqual([msg["op"] for msg in self.client._outbox], ["3"] + ["6"] * 6)
+        self.assertEqual(self.client.menu("m"), self.items)
+
+    def testUnchanged(self):
+        self.assertEqual(self.requests("Menu", [dict(item) for item in self.items]), [])
+
+    def testRenameAndUpdates(self):
+        items = [dict(item) for item in self.items]
+        items[2]["name"] = "two"
+        items[4]["action"] = "play"
+        self.assertEqual(self.requests("Renamed", items), [
+            {"op": "5", "id": "m", "name": "Renamed"},
+            {"op": "8", "menu": "m", "id": 2, "name": "two"},
+            {"op": "8", "menu": "m", "id": 4, "action": "play"},
+        ])
+
+    def testAddAndRemove(self):
+        items = self.items[:1] + [{"id": "new", "name": "new"}] + self.items[1:4] + self.items[5:]
+        self.assertEqual(self.requests("Menu", items), [
+            {"op": "7", "menu": "m", "id": 4},
+            {"op": "6", "menu": "m", "id": "new", "name": "new", "position": 1},
+        ])
+        # Appended items need no position.
+        self.assertEqual(self.requests("Menu", items + [{"id": "last", "name": "last"}]), [
+            {"op": "6", "menu": "m", "id": "last", "name": "last"},
+        ])
+
+    def testMovesAreMinimal(self):
+        # Moving one item to the front only removes and re-adds that item.
+        items = self.items[5:] + self.items[:5]
+        self.assertEqual(self.requests("Menu", items), [
+            {"op": "7", "menu": "m", "id": 5},
+            {"op": "6", "menu": "m", "id": 5, "name": "item 5", "position": 0},
+        ])
+        # Reversed: only one item can stay.
+        requests = self.requests("Menu", list(reversed(items)))
+        self.assertEqual([msg["op"] for msg in requests], ["7"] * 5 + ["6"] * 5)
+
+    def testDuplicateIds(self):
+        with self.assertRaises(ValueError):
+            self.client._setMenu("m", "Menu", self.items + self.items[:1])
+
+    def testStableIds(self):
+        oldPos = {itemId: pos for pos, itemId in enumerate("abcdefg")}
+        self.assertEqual(netclient._stableIds(list("abcdefg"), oldPos), set("abcdefg"))
+        self.assertEqual(netclient._stableIds(list("gabcdef"), oldPos), set("abcdef"))
+        self.assertEqual(len(netclient._stableIds(list("gfedcba"), oldPos)), 1)
+        stable = netclient._stableIds(list("bdaecgf"), oldPos)
+        self.assertEqual(len(stable), 4)
+        kept = [itemId for itemId in "bdaecgf" if itemId in stable]
+        self.assertEqual(kept, sorted(kept))
+        self.assertEqual(netclient._stableIds([], oldPos), set())
+
+
+class ConnectionLostTest(unittest.TestCase):
+
+    def testPendingRequestsAnswered(self):
+        client = netclient.NetClient("test")
+        menuId = client._queue("3", {"id": "m", "name": "Menu"})
+        pingId = client._queue("0", {"ping_id": 1})
+        client._connectionLost()
+        self.assertEqual(client._replies[menuId]["resynced"], True)
+        self.assertIsNone(client._replies[pingId])
+        self.assertEqual(client._outbox, [])
+        self.assertEqual(client._inFlight, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+#test_netcodec.py
+#
+# Tests of the netservice wire format.
+
+import json
+import unittest
+import zlib
+
+import nvdastubs
+import netcodec
+
+
+def menuItems(count):
+    return {"op": "6", "status": "ok",
+            "items": [{"id": i, "name": f"Item {i}", "action": "select",
+                       "actionData": {"index": i}} for i in range(count)]}
+
+
+def unframeAll(codec, buf):
+    messages = []
+    pos = 0
+    while True:
+        line, pos = codec.unframe(buf, pos)
+        if line is None:
+            return messages, buf[pos:]
+        messages.append(json.loads(line))
+
+
+class CodecTest(unittest.TestCase):
+
+    def pair(self, compression=None):
+        sender, receiver = netcodec.Codec(), netcodec.Codec()
+        if compression is not None:
+            sender.enableCompression(compression)
+            receiver.enableCompression(compression)
+        return sender, receiver
+
+    def testJsonLines(self):
+        sender, receiver = self.pair()
+        msgs = [{"op": "0", "ping_id": 1}, menuItems(50)]
+        data = b"".join(sender.encode(msg) for msg in msgs)
+        self.assertEqual(data.count(b"\n"), 2)
+        self.assertEqual(unframeAll(receiver, data), (msgs, b""))
+
+    def testIncompleteMessages(self):
+        sender, receiver = self.pair("deflate")
+        msgs = [{"op": "0", "ping_id": 1}, menuItems(50), {"op": "9", "message": "é"}]
+        data = b"".join(sender.encode(msg) for msg in msgs)
+        received = []
+        rest = b""
+        # Byte by byte, across frame headers and payloads
+        for i in range(len(data)):
+            decoded, rest = unframeAll(receiver, rest + data[i:i + 1])
+            received.extend(decoded)
+        self.assertEqual(received, msgs)
+        self.assertEqual(rest, b"")
+
+    def testCompressedAboveThreshold(self):
+        sender, receiver = self.pair("deflate")
+        small = sender.encode({"op": "0", "ping_id": 1})
+        self.assertEqual(small[-1:], b"\n")
+        self.assertNotEqual(small[0], netcodec.COMPRESSED_MARKER)
+        large = sender.encode(menuItems(50))
+        self.assertEqual(large[0], netcodec.COMPRESSED_MARKER)
+        self.assertLess(len(large), len(json.dumps(menuItems(50))) // 4)
+        self.assertEqual(unframeAll(receiver, small + large)[0],
+                         [{"op": "0", "ping_id": 1}, menuItems(50)])
+
+    def testContextTakeover(self):
+        sender, receiver = self.pair("deflate")
+        first = sender.encode(menuItems(50))
+        second = sender.encode(menuItems(50))
+        self.assertLess(len(second), len(first) // 2)
+        self.assertEqual(unframeAll(receiver, first + second)[0], [menuItems(50)] * 2)
+
+    def testPresetDictionary(self):
+        sender, receiver = self.pair("deflate")
+        msg = menuItems(8)
+        frame = sender.encode(msg)
+        self.assertEqual(frame[0], netcodec.COMPRESSED_MARKER)
+        payload = frame[netcodec._frameHeader.size:] + netcodec._SYNC_TRAILER
+        withoutDictionary = zlib.compressobj(netcodec.COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        plain = withoutDictionary.compress(json.dumps(msg).encode("utf-8"))
+        plain += withoutDictionary.flush(zlib.Z_SYNC_FLUSH)
+        self.assertLess(len(payload), len(plain))
+        # The frame refers to the dictionary: it cannot be inflated without it.
+        with self.assertRaises(zlib.error):
+            zlib.decompressobj(-zlib.MAX_WBITS).decompress(payload)
+        self.assertEqual(unframeAll(receiver, frame)[0], [msg])
+
+    def testCompressedFrameWithoutCompression(self):
+        sender = self.pair("deflate")[0]
+        frame = sender.encode(menuItems(50))
+        with self.assertRaises(ValueError):
+            netcodec.Codec().unframe(frame)
+
+    def testSizeLimits(self):
+        codec = netcodec.Codec()
+        codec.enableCompression("deflate")
+        header = netcodec._frameHeader.pack(netcodec.COMPRESSED_MARKER, netcodec.MAX_MESSAGE_SIZE + 1)
+        with self.assertRaises(ValueError):
+            codec.unframe(header)
+        with self.assertRaises(ValueError):
+            codec.unframe(b"x" * (netcodec.MAX_MESSAGE_SIZE + 1))
+        # A bomb inflating above the limit
+        compressor = zlib.compressobj(netcodec.COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zdict=netcodec.COMPRESS_DICTIONARY)
+        payload = compressor.compress(b" " * (netcodec.MAX_MESSAGE_SIZE + 1))
+        payload += compressor.flush(zlib.Z_SYNC_FLUSH)
+        payload = payload[:-len(netcodec._SYNC_TRAILER)]
+        with self.assertRaises(ValueError):
+            codec.unframe(netcodec._frameHeader.pack(netcodec.COMPRESSED_MARKER, len(payload)) + payload)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,763 @@
+#test_netservice.py
+#
+# Tests of the netservice server, driven without its thread: clients are fed
+# data and their output queue is read back.
+
+import json
+import os
+import socket
+import stat
+import tempfile
+import time
+import unittest
+
+from nvdastubs import HeadlessPlugin
+import events
+import netservice
+import shmring
+from websocket._abnf import ABNF, frame_buffer
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        # 8 slots of 0.5s: the wheel turns every 4 seconds.
+        self.wheel = netservice.TimerWheel(tick=0.5, slots=8, now=0.0)
+
+    def testExpiry(self):
+        self.wheel.schedule("a", 1.0)
+        self.wheel.schedule("b", 1.2)
+        self.wheel.schedule("c", 10.0)
+        self.assertEqual(len(self.wheel), 3)
+        self.assertEqual(self.wheel.advance(0.9), [])
+        self.assertEqual(sorted(self.wheel.advance(1.3)), ["a", "b"])
+        # c shares a slot with deadlines of the current turn but is not due.
+        self.assertEqual(self.wheel.advance(6.0), [])
+        self.assertEqual(self.wheel.advance(10.0), ["c"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def testPastDeadlineExpiresOnNextTick(self):
+        self.wheel.schedule("a", -5.0)
+        self.assertEqual(self.wheel.advance(0.4), [])
+        self.assertEqual(self.wheel.advance(0.5), ["a"])
+
+    def testRescheduleAndCancel(self):
+        self.wheel.schedule("a", 1.0)
+        self.wheel.schedule("a", 3.0)
+        self.wheel.schedule("b", 1.0)
+        self.wheel.cancel("b")
+        self.wheel.cancel("unknown")
+        self.assertEqual(self.wheel.advance(2.0), [])
+        self.assertEqual(self.wheel.advance(3.0), ["a"])
+
+    def testLongStall(self):
+        for i in range(20):
+            self.wheel.schedule(i, i)
+        self.assertEqual(sorted(self.wheel.advance(1000.0)), list(range(20)))
+        self.assertEqual(len(self.wheel), 0)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def testRefill(self):
+        bucket = netservice.TokenBucket(10, 20, now=0.0)
+        self.assertTrue(bucket.consume(15, 0.0))
+        self.assertFalse(bucket.consume(10, 0.0))
+        self.assertAlmostEqual(bucket.delay(10, 0.0), 0.5)
+        self.assertTrue(bucket.consume(10, 0.5))
+        # Never more than the capacity
+        self.assertAlmostEqual(bucket.delay(20, 100.0), 0.0)
+        self.assertTrue(bucket.consume(20, 100.0))
+        self.assertFalse(bucket.consume(1, 100.0))
+
+    def testLargerThanCapacity(self):
+        bucket = netservice.TokenBucket(10, 20, now=0.0)
+        self.assertTrue(bucket.consume(1, 0.0))
+        self.assertFalse(bucket.consume(50, 0.0))
+        self.assertAlmostEqual(bucket.delay(50, 0.0), 0.1)
+        # A full bucket grants it, and the debt delays what follows.
+        self.assertTrue(bucket.consume(50, 0.1))
+        self.assertAlmostEqual(bucket.delay(1, 0.1), 3.1)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def testMessagesAndBytes(self):
+        limiter = netservice.RateLimiter({"menu": (2, 1000)}, burst=1.0)
+        self.assertTrue(limiter.allow("menu", 10, 0.0))
+        self.assertTrue(limiter.allow("menu", 10, 0.0))
+        self.assertFalse(limiter.allow("menu", 10, 0.0))
+        self.assertAlmostEqual(limiter.delay("menu", 10, 0.0), 0.5)
+        self.assertTrue(limiter.allow("menu", 900, 0.5))
+        # One message allowed again, but not that many bytes
+        self.assertFalse(limiter.allow("menu", 900, 1.0))
+        self.assertAlmostEqual(limiter.delay("menu", 900, 1.0), 0.3)
+        # A refused message takes no tokens.
+        self.assertTrue(limiter.allow("menu", 10, 1.0))
+
+    def testUnlimitedClass(self):
+        limiter = netservice.RateLimiter({"menu": (1, 1000)}, burst=1.0)
+        for i in range(100):
+            self.assertTrue(limiter.allow("control", 100000, 0.0))
+        self.assertEqual(limiter.delay("control", 100000, 0.0), 0.0)
+
+
+class ValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.validate = netservice.compileValidator(netservice.NET_OPS["6"])
+
+    def testValid(self):
+        self.assertIsNone(self.validate({"op": "6", "menu": "m", "id": 1, "name": "Item"}))
+        self.assertIsNone(self.validate({"op": "6", "menu": 2, "id": "i", "name": "Item",
+                                         "action": "a", "actionData": {}, "position": 0,
+                                         "req_id": "r1", "unknown": [1]}))
+
+    def testMissing(self):
+        self.assertEqual(self.validate({"menu": "m", "id": 1}), "missing name")
+        self.assertEqual(self.validate({"menu": "m", "id": None, "name": "x"}), "missing id")
+
+    def testInvalidTypes(self):
+        for msg, error in (({"menu": "m", "id": 1.5, "name": "x"}, "invalid id"),
+                           ({"menu": "m", "id": True, "name": "x"}, "invalid id"),
+                           ({"menu": [], "id": 1, "name": "x"}, "invalid menu"),
+                           ({"menu": "m", "id": 1, "name": 3}, "invalid name"),
+                           ({"menu": "m", "id": 1, "name": "x", "position": "1"}, "invalid position"),
+                           ({"menu": "m", "id": 1, "name": "x", "position": False}, "invalid position"),
+                           ({"menu": "m", "id": 1, "name": "x", "actionData": []}, "invalid actionData"),
+                           ({"menu": "m", "id": 1, "name": "x", "req_id": {}}, "invalid req_id"),
+                           # Optional fields may be left out, but not null.
+                           ({"menu": "m", "id": 1, "name": "x", "position": None}, "invalid position"),
+                           ({"menu": "m", "id": 1, "name": "x", "action": None}, "invalid action"),
+                           ({"menu": "m", "id": 1, "name": "x", "req_id": None}, "invalid req_id")):
+            self.assertEqual(self.validate(msg), error, msg)
+
+    def testEveryOpCompiled(self):
+        self.assertEqual(set(netservice.OP_TABLE), set(netservice.NET_OPS))
+        for code, entry in netservice.OP_TABLE.items():
+            self.assertEqual(entry.method, f"on_{netservice.NET_OPS[code]['name']}")
+            self.assertIs(entry.handler, getattr(netservice.Client, entry.method, None))
+            self.assertIn(entry.opClass, ("control", "menu", "notification"))
+
+
+class ServerTestCase(unittest.TestCase):
+    """Creates a server which is not started, and clients on socket pairs."""
+    rateLimits = {}
+
+    def setUp(self):
+        self.gp = HeadlessPlugin()
+        self.server = netservice.Server(self.gp, 0, unixPath=None, rateLimits=self.rateLimits,
+                                        wsPort=None)
+        self.peers = []
+
+    def tearDown(self):
+        for client in list(self.server._clients.values()):
+            self.server.removeClient(client)
+        for sock in self.server._listeners + self.peers:
+            sock.close()
+        self.server._wakeupSock.close()
+        self.server._wakeupSender.close()
+        if self.server._doorbell is not None:
+            self.server._doorbell.close()
+
+    def connect(self, cls=netservice.Client):
+        sock, peer = socket.socketpair()
+        sock.setblocking(False)
+        self.peers.append(peer)
+        client = cls(self.server, sock, ("127.0.0.1", 1))
+        self.server._clients[sock] = client
+        return client
+
+    def request(self, client, msg):
+        """Handles one request and returns the messages sent meanwhile."""
+        client.feed((json.dumps(msg) + "\n").encode("utf-8"))
+        client.process(netservice.MAX_PENDING_MESSAGES, time.monotonic())
+        return self.output(client)
+
+    def output(self, client):
+        """Returns and discards the messages queued for a client."""
+        data = b"".join(bytes(chunk) for chunk in client._outQueue)
+        client._consume(len(data))
+        return [json.loads(line) for line in data.splitlines()]
+
+    def identify(self, client, name="test"):
+        reply, = self.request(client, {"op": "1", "service-name": name})
+        self.assertEqual(reply["status"], "ok")
+        return client._service
+
+    def postedEvents(self, service):
+        posted = []
+        while not service._outqueue.empty():
+            posted.append(service._outqueue.get_nowait())
+        return posted
+
+
+class OutputTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.connect()
+        self.peer = self.peers[-1]
+
+    def testPartialWrites(self):
+        self.client._enqueue(b"abc")
+        self.client._enqueue(b"defgh")
+        self.client._consume(4)
+        self.assertEqual(self.client._outSize, 4)
+        self.assertEqual([bytes(chunk) for chunk in self.client._outQueue], [b"efgh"])
+        self.assertTrue(self.client.on_write())
+        self.assertFalse(self.client.hasPendingOutput())
+        self.assertEqual(self.peer.recv(100), b"efgh")
+
+    def testChunksWrittenTogether(self):
+        for i in range(netservice.OUT_MAX_CHUNKS + 10):
+            self.client.send("0", {"pong_id": i})
+        self.assertTrue(self.client.on_write())
+        self.assertEqual(len(self.client._outQueue), 10)
+        self.assertTrue(self.client.on_write())
+        self.assertFalse(self.client.hasPendingOutput())
+        received = b""
+        while received.count(b"\n") < netservice.OUT_MAX_CHUNKS + 10:
+            received += self.peer.recv(65536)
+        self.assertEqual([json.loads(line)["pong_id"] for line in received.splitlines()],
+                         list(range(netservice.OUT_MAX_CHUNKS + 10)))
+
+    def testCongestion(self):
+        self.client._enqueue(b"x" * (netservice.OUT_HIGH_WATER + 1))
+        self.assertTrue(self.client.isCongested())
+        self.assertFalse(self.client.sendEvent("12", {"event": "quit"}))
+        self.assertEqual(self.client.droppedEvents, 1)
+        now = time.monotonic()
+        self.assertFalse(self.client.isStalled(now))
+        self.assertFalse(self.client.isStalled(now + netservice.OUT_STALL_TIMEOUT / 2))
+        self.assertTrue(self.client.isStalled(now + netservice.OUT_STALL_TIMEOUT + 1))
+        # Draining below the high-water mark resets the stall timer.
+        self.client._consume(2)
+        self.assertFalse(self.client.isStalled(now + 2 * netservice.OUT_STALL_TIMEOUT))
+        self.assertTrue(self.client.sendEvent("12", {"event": "quit"}))
+
+    def testHardLimit(self):
+        self.client._enqueue(b"x" * (netservice.OUT_HARD_LIMIT + 1))
+        self.assertTrue(self.client.isStalled(time.monotonic()))
+        self.server.checkSlowClients()
+        self.assertNotIn(self.client._sock, self.server._clients)
+        self.assertTrue(self.client._closed)
+
+
+class RejectionTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.connect()
+
+    def testInvalidRequests(self):
+        for msg, op, error in (({"op": "6", "menu": "m", "id": 1}, "6", "missing name"),
+                               ({"op": "3", "id": 1, "name": None}, "3", "missing name"),
+                               ({"op": "9", "message": 42}, "9", "invalid message"),
+                               ({"op": "12", "event": "quit"}, "12", "unsupported op"),
+                               ({"op": "99"}, "99", "unknown op"),
+                               ({"op": 1}, "unknown", "unknown op"),
+                               ({"no": "op"}, "unknown", "unknown op"),
+                               ([1, 2], "unknown", "unknown op")):
+            reply, = self.request(self.client, msg)
+            self.assertEqual((reply["op"], reply["status"], reply["error"]), (op, "error", error), msg)
+        stats = self.server.getOpStats()
+        self.assertEqual(stats["menuItemAdd"]["rejected"], 1)
+        self.assertEqual(stats["menuAdd"]["rejected"], 1)
+        self.assertEqual(stats["userNotification"]["rejected"], 1)
+        self.assertEqual(stats["invalid"]["rejected"], 4)
+
+    def testInvalidJson(self):
+        self.client.feed(b'{"op": \n{"op": "0", "ping_id": 1}\n')
+        self.client.process(10, time.monotonic())
+        error, pong = self.output(self.client)
+        self.assertEqual((error["op"], error["error"]), ("unknown", "invalid JSON"))
+        self.assertEqual(pong["pong_id"], 1)
+
+    def testNullFields(self):
+        reply, = self.request(self.client, {"op": "1", "service-name": "x", "display-name": None})
+        self.assertEqual((reply["status"], reply["error"]), ("error", "invalid display-name"))
+        self.assertIsNone(self.client._service)
+        self.assertEqual(self.gp._services, [])
+        service = self.identify(self.client)
+        self.request(self.client, {"op": "3", "id": "m", "name": "Menu"})
+        self.request(self.client, {"op": "6", "menu": "m", "id": "a", "name": "A"})
+        for msg, error in (({"op": "5", "id": "m", "name": None}, "invalid name"),
+                           ({"op": "6", "menu": "m", "id": "b", "name": "B", "action": None}, "invalid action"),
+                           ({"op": "8", "menu": "m", "id": "a", "name": None}, "invalid name"),
+                           ({"op": "0", "pong_id": None}, "invalid pong_id")):
+            reply, = self.request(self.client, msg)
+            self.assertEqual((reply["status"], reply["error"]), ("error", error), msg)
+        self.assertEqual(service._menuList, [("m", "Menu")])
+        self.assertEqual(service.getRemoteMenu("m").items(), [{"id": "a", "name": "A"}])
+        self.assertEqual(str(service), "test")
+
+    def testNotIdentified(self):
+        reply, = self.request(self.client, {"op": "3", "id": "m", "name": "Menu"})
+        self.assertEqual(reply["error"], "Not identified")
+
+
+class RequestIdTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.connect()
+
+    def testEchoed(self):
+        reply, = self.request(self.client, {"op": "1", "service-name": "test", "req_id": "id-1"})
+        self.assertEqual((reply["status"], reply["req_id"]), ("ok", "id-1"))
+        reply, = self.request(self.client, {"op": "0", "ping_id": 5, "req_id": 7})
+        self.assertEqual((reply["pong_id"], reply["req_id"]), (5, 7))
+
+    def testEchoedInErrors(self):
+        for msg in ({"op": "3", "id": "m", "req_id": 1},
+                    {"op": "99", "req_id": 2},
+                    {"op": "4", "id": "unknown", "req_id": 3}):
+            reply, = self.request(self.client, msg)
+            self.assertEqual((reply["status"], reply["req_id"]), ("error", msg["req_id"]))
+
+    def testInvalidIdNotEchoed(self):
+        for reqId in (True, {"a": 1}, 1.5):
+            reply, = self.request(self.client, {"op": "0", "ping_id": 1, "req_id": reqId})
+            self.assertNotIn("req_id", reply)
+        reply, = self.request(self.client, {"op": "0", "ping_id": 1})
+        self.assertNotIn("req_id", reply)
+
+    def testPipelined(self):
+        self.identify(self.client)
+        self.request(self.client, {"op": "10", "events": ["quit"]})
+        data = b"".join(json.dumps({"op": "3", "id": i % 3, "name": "M", "req_id": i}).encode("utf-8") + b"\n"
+                        for i in range(6))
+        self.client.feed(data)
+        self.client.process(100, time.monotonic())
+        # Events pushed outside of a request carry no req_id.
+        self.client.pushEvent({"event": events.QUIT})
+        replies = self.output(self.client)
+        self.assertEqual([(r.get("req_id"), r.get("status")) for r in replies],
+                         [(0, "ok"), (1, "ok"), (2, "ok"), (3, "error"), (4, "error"), (5, "error"),
+                          (None, None)])
+
+
+class HeartbeatTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.connect()
+
+    def testIdleClientPinged(self):
+        start = self.client._lastActivity
+        self.assertEqual(self.client.on_timer(start + 1), start + netservice.IDLE_TIMEOUT)
+        now = start + netservice.IDLE_TIMEOUT
+        self.assertEqual(self.client.on_timer(now), now + netservice.HEARTBEAT_TIMEOUT)
+        ping, = self.output(self.client)
+        self.assertEqual(ping["op"], "0")
+        self.assertEqual(ping["ping_id"], "server-1")
+        # Not answered yet
+        self.assertEqual(self.client.on_timer(now + 1), now + netservice.HEARTBEAT_TIMEOUT)
+        self.assertIsNone(self.client.on_timer(now + netservice.HEARTBEAT_TIMEOUT))
+
+    def testAnsweringClientKept(self):
+        now = self.client._lastActivity + netservice.IDLE_TIMEOUT
+        self.client.on_timer(now)
+        self.client._lastActivity = now + 1
+        later = now + netservice.HEARTBEAT_TIMEOUT
+        self.assertEqual(self.client.on_timer(later), now + 1 + netservice.IDLE_TIMEOUT)
+
+    def testDeadClientReaped(self):
+        alive = self.connect()
+        now = time.monotonic()
+        self.server._timers = netservice.TimerWheel(now=now - 60)
+        self.client._lastActivity = now - 50
+        self.client._pingSentAt = now - 20
+        alive._lastActivity = now - 1
+        self.server._timers.schedule(self.client, now - 10)
+        self.server._timers.schedule(alive, now - 10)
+        self.server.checkIdleClients()
+        self.assertNotIn(self.client._sock, self.server._clients)
+        self.assertTrue(self.client._closed)
+        self.assertIn(alive._sock, self.server._clients)
+        self.assertEqual(len(self.server._timers), 1)
+
+
+class SubscriptionTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.connect()
+        self.identify(self.client)
+
+    def testSubscribe(self):
+        reply, = self.request(self.client, {"op": "10", "events": ["menu_activate", "quit"]})
+        self.assertEqual(reply["status"], "ok")
+        self.assertEqual(reply["events"], ["menu_activate", "quit"])
+        reply, = self.request(self.client, {"op": "11", "events": ["quit"]})
+        self.assertEqual(reply["events"], ["menu_activate"])
+        for names in (["log"], ["nonexistent"], [1]):
+            reply, = self.request(self.client, {"op": "10", "events": names})
+            self.assertEqual(reply["status"], "error")
+
+    def testPushedEvents(self):
+        self.request(self.client, {"op": "10", "events": ["service_focus"]})
+        self.client.pushEvent({"event": events.QUIT})
+        self.client.pushEvent({"event": events.SERVICE_FOCUS, "focused": True})
+        pushed = self.output(self.client)
+        self.client._enqueue(b"x" * (netservice.OUT_HIGH_WATER + 1))
+        self.client.pushEvent({"event": events.SERVICE_FOCUS, "focused": False})
+        self.client._consume(netservice.OUT_HIGH_WATER + 1)
+        self.client.pushEvent({"event": events.SERVICE_FOCUS, "focused": True})
+        pushed += self.output(self.client)
+        self.assertEqual([(msg["op"], msg["event"], msg["seq"], msg["data"]) for msg in pushed],
+                         [("12", "service_focus", 1, {"focused": True}),
+                          ("12", "service_focus", 3, {"focused": True})])
+        self.assertEqual(self.client.droppedEvents, 1)
+
+    def testServiceEventsForwarded(self):
+        self.request(self.client, {"op": "10", "events": ["menu_activate"]})
+        self.request(self.client, {"op": "3", "id": "m", "name": "Menu"})
+        self.request(self.client, {"op": "6", "menu": "m", "id": "play", "name": "Play",
+                                   "action": "play", "actionData": {"speed": 2}})
+        self.client._service._inqueue.put({"event": events.MENU_ACTIVATE,
+                                           "menuId": "m", "itemIdx": 0})
+        self.server.handleEvents()
+        pushed, = self.output(self.client)
+        self.assertEqual(pushed["event"], "menu_activate")
+        self.assertEqual(pushed["data"], {"menuId": "m", "itemIdx": 0, "itemId": "play",
+                                          "action": "play", "actionData": {"speed": 2}})
+
+
+class ThrottlingTest(ServerTestCase):
+    rateLimits = {"notification": (1, 1000)}
+
+    def testNotificationsThrottled(self):
+        client = self.connect()
+        self.identify(client)
+        data = b"".join(json.dumps({"op": "9", "message": f"hello {i}"}).encode("utf-8") + b"\n"
+                        for i in range(5))
+        client.feed(data + b'{"op": "0", "ping_id": 1}\n')
+        now = time.monotonic()
+        # Burst of RATE_BURST seconds
+        self.assertEqual(client.process(100, now), 2)
+        self.assertEqual(client.process(100, now), 0)
+        self.assertEqual(client.throttled, {"notification": 1})
+        self.assertAlmostEqual(client.throttleDelay(now), 1.0, places=2)
+        self.assertEqual(client.process(100, now + 1.0), 1)
+        # Messages are handled in order: the ping waits behind the notifications.
+        self.assertEqual(client.process(100, now + 3.0), 3)
+        self.assertIsNone(client.throttleDelay(now + 3.0))
+        self.assertEqual(client.handled, {"control": 2, "notification": 5})
+        self.assertEqual([msg["op"] for msg in self.output(client)], ["9"] * 5 + ["0"])
+
+
+class FairnessTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._budget = netservice.PROCESS_BUDGET
+        netservice.PROCESS_BUDGET = 20
+
+    def tearDown(self):
+        netservice.PROCESS_BUDGET = self._budget
+        super().tearDown()
+
+    def testRoundRobin(self):
+        clients = [self.connect() for i in range(3)]
+        for client in clients:
+            client.feed(b'{"op": "0", "ping_id": 1}\n' * 100)
+        self.server.processClients()
+        # The first client gets a full quantum, the next one the rest of the budget.
+        self.assertEqual([len(c._pending) for c in clients], [84, 96, 100])
+        self.server.processClients()
+        self.assertEqual([len(c._pending) for c in clients], [84, 80, 96])
+        self.server.processClients()
+        self.assertEqual([len(c._pending) for c in clients], [80, 80, 80])
+
+    def testIdleClientsLeaveBudget(self):
+        netservice.PROCESS_BUDGET = 1000
+        busy, idle = self.connect(), self.connect()
+        busy.feed(b'{"op": "0", "ping_id": 1}\n' * 100)
+        idle.feed(b'{"op": "0", "ping_id": 1}\n')
+        self.server.processClients()
+        self.assertFalse(busy.hasPendingInput())
+        self.assertFalse(idle.hasPendingInput())
+
+
+class MenuServiceTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.connect()
+        self.service = self.identify(self.client)
+        self.postedEvents(self.service)
+
+    def flush(self):
+        self.server._lastMenuFlush = 0.0
+        self.server.flushMenuChanges()
+        return self.postedEvents(self.service)
+
+    def testChangesBatched(self):
+        for msg in ({"op": "3", "id": "m", "name": "Menu"},
+                    {"op": "3", "id": 2, "name": "Other"},
+                    {"op": "6", "menu": "m", "id": "a", "name": "A"},
+                    {"op": "6", "menu": "m", "id": "b", "name": "B", "position": 0},
+                    {"op": "8", "menu": "m", "id": "a", "name": "A2"},
+                    {"op": "7", "menu": "m", "id": "b"}):
+            reply, = self.request(self.client, msg)
+            self.assertEqual(reply["status"], "ok")
+        self.assertEqual((reply["position"], reply["version"]), (0, 4))
+        menuUpdate, itemsChanged = self.flush()
+        self.assertEqual(menuUpdate, {"event": events.MENU_UPDATE,
+                                      "menus": [("m", "Menu"), (2, "Other")]})
+        self.assertEqual(itemsChanged["event"], events.MENU_ITEMS_CHANGED)
+        self.assertEqual((itemsChanged["base"], itemsChanged["version"]), (0, 4))
+        self.assertEqual([change[:2] for change in itemsChanged["changes"]],
+                         [["add", 0], ["add", 0], ["update", 1], ["del", 0]])
+        self.assertEqual(self.flush(), [])
+
+    def testUnknownMenuAndItems(self):
+        self.request(self.client, {"op": "3", "id": "m", "name": "Menu"})
+        self.request(self.client, {"op": "6", "menu": "m", "id": "a", "name": "A"})
+        for msg, error in (({"op": "3", "id": "m", "name": "Again"}, "Duplicate menu id"),
+                           ({"op": "6", "menu": "x", "id": "a", "name": "A"}, "Unknown menu"),
+                           ({"op": "6", "menu": "m", "id": "a", "name": "A"}, "Duplicate item id"),
+                           ({"op": "7", "menu": "m", "id": "z"}, "Unknown item"),
+                           ({"op": "8", "menu": "m", "id": "z", "name": "Z"}, "Unknown item"),
+                           ({"op": "4", "id": "x"}, "Unknown menu")):
+            reply, = self.request(self.client, msg)
+            self.assertEqual((reply["status"], reply["error"]), ("error", error), msg)
+
+    def testGetItemsFlushesChanges(self):
+        self.request(self.client, {"op": "3", "id": "m", "name": "Menu"})
+        self.request(self.client, {"op": "6", "menu": "m", "id": "a", "name": "A"})
+        self.service._inqueue.put({"event": events.MENU_GET_ITEMS, "id": "m"})
+        self.server.handleEvents()
+        menuUpdate, itemsChanged, items = self.postedEvents(self.service)
+        self.assertEqual(itemsChanged["version"], 1)
+        self.assertEqual(items, {"event": events.MENU_GET_ITEMS,
+                                 "items": {"id": "m", "name": "Menu", "version": 1,
+                                           "items": [{"id": "a", "name": "A"}]}})
+        self.assertEqual(self.flush(), [])
+
+
+def _noData(bufsize):
+    raise BlockingIOError
+
+
+class WebSocketTest(ServerTestCase):
+
+    UPGRADE = ("GET / HTTP/1.1\r\n"
+               "Host: 127.0.0.1:62101\r\n"
+               "Upgrade: websocket\r\n"
+               "Connection: keep-alive, Upgrade\r\n"
+               "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+               "Sec-WebSocket-Version: 13\r\n")
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.connect(netservice.WebSocketClient)
+        self.frames = frame_buffer(_noData, False)
+
+    def rawOutput(self):
+        data = b"".join(bytes(chunk) for chunk in self.client._outQueue)
+        self.client._consume(len(data))
+        return data
+
+    def receivedFrames(self):
+        self.frames.feed(self.rawOutput())
+        frames = []
+        while True:
+            try:
+                frames.append(self.frames.recv_frame())
+            except BlockingIOError:
+                return frames
+
+    def upgrade(self, headers=""):
+        self.client.feed((self.UPGRADE + headers + "\r\n").encode("latin-1"))
+        return self.rawOutput().decode("latin-1")
+
+    def sendText(self, msg, fin=1, opcode=ABNF.OPCODE_TEXT):
+        frame = ABNF.create_frame(json.dumps(msg) if isinstance(msg, dict) else msg, opcode, fin)
+        self.client.feed(frame.format())
+
+    def testUpgrade(self):
+        response = self.upgrade("Origin: chrome-extension://abcdef\r\n")
+        self.assertTrue(response.startswith("HTTP/1.1 101 Switching Protocols\r\n"))
+        self.assertIn("Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=\r\n", response)
+        self.sendText({"op": "1", "service-name": "ws", "compression": ["deflate"]})
+        self.sendText({"op": "0", "ping_id": "p"})
+        self.client.process(10, time.monotonic())
+        identify, pong = [json.loads(f.data) for f in self.receivedFrames()]
+        # Compression is not negotiated over WebSocket.
+        self.assertEqual((identify["status"], identify["compression"]), ("ok", None))
+        self.assertEqual(pong["pong_id"], "p")
+
+    def testFragmentsAndControlFrames(self):
+        self.upgrade()
+        self.sendText('{"op": "0", ', fin=0)
+        self.client.feed(ABNF.create_frame("hello", ABNF.OPCODE_PING).format())
+        self.sendText('"ping_id": 2}', fin=1, opcode=ABNF.OPCODE_CONT)
+        self.client.process(10, time.monotonic())
+        pong, reply = self.receivedFrames()
+        self.assertEqual((pong.opcode, pong.data), (ABNF.OPCODE_PONG, b"hello"))
+        self.assertEqual(json.loads(reply.data)["pong_id"], 2)
+        self.client.feed(ABNF.create_frame(b"\x03\xe8bye", ABNF.OPCODE_CLOSE).format())
+        close, = self.receivedFrames()
+        self.assertEqual((close.opcode, close.data), (ABNF.OPCODE_CLOSE, b"\x03\xe8"))
+        self.assertFalse(self.client.wantsRead())
+
+    def testUnmaskedFrameRefused(self):
+        self.upgrade()
+        self.client.feed(ABNF(1, 0, 0, 0, ABNF.OPCODE_TEXT, 0, b"{}").format())
+        close, = self.receivedFrames()
+        self.assertEqual((close.opcode, close.data), (ABNF.OPCODE_CLOSE, b"\x03\xea"))
+
+    def testOriginRefused(self):
+        response = self.upgrade("Origin: https://example.com\r\n")
+        self.assertTrue(response.startswith("HTTP/1.1 403 Forbidden\r\n"))
+        self.assertFalse(self.client.wantsRead())
+        self.assertTrue(self.client.hasPendingOutput())
+        self.assertFalse(self.client.on_write())
+
+    def testLookalikeOriginsRefused(self):
+        for origin in ("http://localhost.evil.example", "http://127.0.0.1.nip.io",
+                       "http://localhost@evil.example", "http://evil.example/http://localhost",
+                       "https://localhost", "file://evil.example", "http://localhost:x",
+                       "chrome-extension-evil://x", "null", ""):
+            self.client = self.connect(netservice.WebSocketClient)
+            response = self.upgrade(f"Origin: {origin}\r\n")
+            self.assertTrue(response.startswith("HTTP/1.1 403 "), origin)
+
+    def testAllowedOrigins(self):
+        for origin in ("moz-extension://x", "Chrome-Extension://abc", "file://", "file://localhost",
+                       "http://localhost:8080", "HTTP://127.0.0.1", "http://LOCALHOST"):
+            client = self.client = self.connect(netservice.WebSocketClient)
+            response = self.upgrade(f"Origin: {origin}\r\n")
+            self.assertTrue(response.startswith("HTTP/1.1 101 "), origin)
+            self.assertTrue(client.wantsRead())
+
+    def testBadRequests(self):
+        self.client.feed(b"GET / HTTP/1.1\r\nHost: x\r\n\r\n")
+        self.assertTrue(self.rawOutput().startswith(b"HTTP/1.1 400 "))
+        self.client = self.connect(netservice.WebSocketClient)
+        self.client.feed(self.UPGRADE.replace("Version: 13", "Version: 8").encode("latin-1") + b"\r\n")
+        response = self.rawOutput().decode("latin-1")
+        self.assertTrue(response.startswith("HTTP/1.1 426 "))
+        self.assertIn("Sec-WebSocket-Version: 13\r\n", response)
+        self.client = self.connect(netservice.WebSocketClient)
+        self.client.feed(b"GET / HTTP/1.1\r\n" + b"X: y\r\n" * 2000)
+        self.assertTrue(self.rawOutput().startswith(b"HTTP/1.1 431 "))
+
+
+class RingTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.connect()
+        self.service = self.identify(self.client)
+        for msg in ({"op": "3", "id": "status", "name": "Status"},
+                    {"op": "6", "menu": "status", "id": "cpu", "name": "idle"},
+                    {"op": "6", "menu": "status", "id": 7, "name": "seven"}):
+            reply, = self.request(self.client, msg)
+            self.assertEqual(reply["status"], "ok")
+        self.server.flushMenuChanges()
+        self.postedEvents(self.service)
+        reply, = self.request(self.client, {"op": "13", "size": 4096})
+        self.assertEqual(reply["status"], "ok")
+        self.ring = shmring.RingBuffer.attach(reply["name"], reply["capacity"])
+
+    def tearDown(self):
+        self.ring.close()
+        super().tearDown()
+
+    def testValuesRenameItems(self):
+        self.assertTrue(self.ring.write("status/cpu", b"busy"))
+        self.assertTrue(self.ring.write("status/7", b"seven and a half"))
+        self.assertTrue(self.ring.write("status/cpu", "très occupé".encode("utf-8")))
+        self.assertTrue(self.ring.write("status/unknown", b"ignored"))
+        self.assertTrue(self.ring.write("nomenu/cpu", b"ignored"))
+        self.server.drainRings()
+        menu = self.service.getRemoteMenu("status")
+        self.assertEqual(menu.get("cpu")["name"], "très occupé")
+        self.assertEqual(menu.get(7)["name"], "seven and a half")
+        self.assertEqual(self.client.ringUpdates, 4)
+        # No reply is sent, but the change is posted like a menuItemUpdate.
+        self.assertEqual(self.output(self.client), [])
+        self.server._lastMenuFlush = 0.0
+        self.server.flushMenuChanges()
+        posted, = self.postedEvents(self.service)
+        self.assertEqual(posted["event"], events.MENU_ITEMS_CHANGED)
+        self.assertEqual(posted["id"], "status")
+        self.assertEqual(posted["version"], menu.version)
+        self.assertEqual([change[:2] for change in posted["changes"]],
+                         [["update", 0], ["update", 1]])
+        self.assertEqual(posted["changes"][0][2]["name"], "très occupé")
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "AF_UNIX sockets not supported")
+class UnixSocketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "private", "test.sock")
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server._shouldQuit = True
+            server.join()
+        self.tmp.cleanup()
+
+    def startServer(self):
+        server = netservice.Server(HeadlessPlugin(), 0, unixPath=self.path, wsPort=None)
+        server.daemon = True
+        server.start()
+        self.servers.append(server)
+        return server
+
+    def testIdentify(self):
+        server = self.startServer()
+        self.assertIsNotNone(server._unixSock)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode), 0o700)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(5)
+            sock.connect(self.path)
+            sock.sendall(b'{"op": "1", "service-name": "unix", "req_id": 1}\n')
+            data = b""
+            while not data.endswith(b"\n"):
+                data += sock.recv(4096)
+            # Checked before disconnecting, which removes the client.
+            clients = list(server._clients.values())
+        reply = json.loads(data)
+        self.assertEqual((reply["op"], reply["status"], reply["req_id"]), ("1", "ok", 1))
+        self.assertEqual([client._clientName[:6] for client in clients], ["unix, "])
+
+    def testStaleSocketReplaced(self):
+        os.makedirs(os.path.dirname(self.path), 0o700)
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self.assertIsNotNone(self.startServer()._unixSock)
+
+    def testLiveSocketKept(self):
+        first = self.startServer()
+        second = self.startServer()
+        self.assertIsNotNone(first._unixSock)
+        self.assertIsNone(second._unixSock)
+        self.assertTrue(stat.S_ISSOCK(os.lstat(self.path).st_mode))
+
+    def testOtherFilesKept(self):
+        os.makedirs(os.path.dirname(self.path), 0o700)
+        with open(self.path, "w") as f:
+            f.write("data")
+        self.assertIsNone(self.startServer()._unixSock)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "data")
+
+    def testSharedDirectoryRefused(self):
+        os.makedirs(os.path.dirname(self.path), 0o777)
+        os.chmod(os.path.dirname(self.path), 0o777)
+        self.assertIsNone(self.startServer()._unixSock)
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+#test_shmring.py
+#
+# Tests of the shared memory ring buffer.
+
+import os
+import unittest
+
+import nvdastubs
+import shmring
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.consumer = shmring.RingBuffer.create(f"nvdaws-test-{os.getpid()}", 256)
+        self.producer = shmring.RingBuffer.attach(self.consumer.name, self.consumer.capacity)
+
+    def tearDown(self):
+        self.producer.close()
+        self.consumer.close()
+
+    def testLatestValues(self):
+        self.assertTrue(self.consumer.isEmpty())
+        self.assertEqual(self.consumer.readLatest(), {})
+        self.assertTrue(self.producer.write("a", b"1"))
+        self.assertTrue(self.producer.write("b", b""))
+        self.assertTrue(self.producer.write("é", b"3"))
+        self.assertTrue(self.producer.write("a", b"4"))
+        self.assertFalse(self.consumer.isEmpty())
+        self.assertEqual(self.consumer.readLatest(), {"a": b"4", "b": b"", "é": b"3"})
+        self.assertTrue(self.consumer.isEmpty())
+        self.assertTrue(self.producer.isEmpty())
+
+    def testWrapAround(self):
+        # Records of 24 bytes, in a ring of 256: the end of the data area is
+        # skipped when the next record does not fit before it.
+        written = 0
+        for rounds in range(6):
+            for i in range(7):
+                self.assertTrue(self.producer.write(f"k{i}", b"%016d" % written))
+                written += 1
+            self.assertEqual(self.consumer.readLatest(),
+                             {f"k{i}": b"%016d" % (written - 7 + i) for i in range(7)})
+        self.assertGreater(self.producer._get(shmring._HEAD), 2 * self.consumer.capacity)
+
+    def testFull(self):
+        count = 0
+        while self.producer.write("key", b"x" * 10):
+            count += 1
+        self.assertEqual(count, self.consumer.capacity // 24)
+        self.assertEqual(self.consumer.readLatest(), {"key": b"x" * 10})
+        # The space is released once consumed.
+        self.assertTrue(self.producer.write("key", b"y"))
+        with self.assertRaises(ValueError):
+            self.producer.write("big", b"z" * self.consumer.capacity)
+
+    def testFullAfterPadding(self):
+        for i in range(10):
+            self.assertTrue(self.producer.write("k", b"%010d" % i))
+        self.consumer.readLatest()
+        # The first record skips the last 16 bytes of the data area, which
+        # count as used until consumed.
+        for i in range(10):
+            self.assertTrue(self.producer.write("k", b"%010d" % i))
+        self.assertFalse(self.producer.write("k", b"full"))
+        self.assertEqual(self.consumer.readLatest(), {"k": b"%010d" % 9})
+        self.assertTrue(self.producer.write("k", b"again"))
+        self.assertEqual(self.consumer.readLatest(), {"k": b"again"})
+
+    def testWaitingFlag(self):
+        self.assertFalse(self.producer.consumerWaiting())
+        self.consumer.setWaiting()
+        self.assertTrue(self.producer.consumerWaiting())
+        self.assertFalse(self.producer.consumerWaiting())
+
+    def testCorruptedIndexes(self):
+        shmring._index.pack_into(self.producer._buf, shmring._HEAD, 10 * self.consumer.capacity)
+        with self.assertRaises(ValueError):
+            self.consumer.readLatest()
+
+    def testCorruptedRecord(self):
+        self.producer.write("key", b"value")
+        shmring._recordHeader.pack_into(self.producer._buf, shmring.HEADER_SIZE, 2, 10)
+        with self.assertRaises(ValueError):
+            self.consumer.readLatest()
+
+
+if __name__ == "__main__":
+    unittest.main()